@@ -1,16 +1,49 @@
-from armasec.armasec import Armasec
-from armasec.openid_config_loader import OpenidConfigLoader
-from armasec.token_decoder import TokenDecoder, extract_keycloak_permissions
-from armasec.token_manager import TokenManager
-from armasec.token_payload import TokenPayload
-from armasec.token_security import TokenSecurity
+"""
+Exports are loaded lazily so that the framework-neutral parts of armasec, like the Verifier and the
+TokenAuthMiddleware, can be imported without importing FastAPI.
+"""
+
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from armasec.armasec import Armasec
+    from armasec.middleware import TokenAuthMiddleware
+    from armasec.openid_config_loader import OpenidConfigLoader
+    from armasec.token_decoder import TokenDecoder, extract_keycloak_permissions
+    from armasec.token_manager import TokenManager
+    from armasec.token_payload import TokenPayload
+    from armasec.token_security import TokenSecurity
+    from armasec.verifier import Verifier
+
+_exports = {
+    "Armasec": "armasec.armasec",
+    "TokenAuthMiddleware": "armasec.middleware",
+    "TokenManager": "armasec.token_manager",
+    "TokenSecurity": "armasec.token_security",
+    "TokenPayload": "armasec.token_payload",
+    "TokenDecoder": "armasec.token_decoder",
+    "OpenidConfigLoader": "armasec.openid_config_loader",
+    "Verifier": "armasec.verifier",
+    "extract_keycloak_permissions": "armasec.token_decoder",
+}
 
 __all__ = [
     "Armasec",
+    "TokenAuthMiddleware",
     "TokenManager",
     "TokenSecurity",
     "TokenPayload",
     "TokenDecoder",
     "OpenidConfigLoader",
+    "Verifier",
     "extract_keycloak_permissions",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
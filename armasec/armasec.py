@@ -2,14 +2,28 @@
 This module defines the core Armasec class.
 """
 
+import os
+import weakref
 from functools import lru_cache
-from typing import Callable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
 from fastapi import HTTPException, status
 
+from armasec.claims_envelope import ClaimsEnvelope
+from armasec.decision_cache import DecisionCache
+from armasec.permission_registry import permission_registry
+from armasec.permissions import freeze_match_keys
+from armasec.pluggable import PluginRunner, load_plugins
+from armasec.revocation import RevocationList
 from armasec.schemas import DomainConfig
+from armasec.tenant_registry import TenantRegistry
+from armasec.token_cache import TokenCache
 from armasec.token_security import PermissionMode, TokenSecurity
 from armasec.utilities import noop
+from armasec.verifier import ManagerConfig, Verifier
+
+# Tracked weakly so that the single fork hook does not keep discarded instances alive
+_instances: "weakref.WeakSet[Armasec]" = weakref.WeakSet()
 
 
 class Armasec:
@@ -25,6 +39,13 @@ class Armasec:
         domain_configs: Optional[List[DomainConfig]] = None,
         debug_logger: Optional[Callable[[str], None]] = noop,
         debug_exceptions: bool = False,
+        token_cache: Optional[TokenCache] = None,
+        reauth_grace: float = 0.0,
+        claims_envelope: Optional[ClaimsEnvelope] = None,
+        plugin_runner: Optional[PluginRunner] = None,
+        decision_cache: Optional[DecisionCache] = None,
+        wildcard_scopes: bool = False,
+        revocation_list: Optional[RevocationList] = None,
         **kargs,
     ):
         """
@@ -36,6 +57,18 @@ class Armasec:
                               passed as a logger method like `logger.debug`
             debug_exceptions: If True, raise original exceptions. Should only be used in a testing
                               or debugging context.
+            token_cache:      Optional TokenCache used to skip verification of tokens that were
+                              already verified.
+            reauth_grace:     Seconds a websocket may stay open after its token expires while it
+                              waits for an in-band token refresh. If 0, it is closed at expiry.
+            claims_envelope:  Optional ClaimsEnvelope accepted in place of verifying the token.
+            plugin_runner:    Optional PluginRunner that runs the plugin checks with a timeout or
+                              with sync plugins offloaded to threads.
+            decision_cache:   Optional DecisionCache shared by all routes for the authorization
+                              decisions made for each token.
+            wildcard_scopes:  If True, token permissions like `jobs:*`, `*:read` or `admin` grant
+                              the scopes they match on every route.
+            revocation_list:  Optional RevocationList that rejects revoked tokens on every route.
             kargs:            Arguments compatible to instantiate the DomainConfig model.
         """
         primary_domain_config = DomainConfig(**kargs)
@@ -51,13 +84,39 @@ class Armasec:
             )
         self.debug_logger = debug_logger
         self.debug_exceptions = debug_exceptions
+        self.token_cache = token_cache
+        self.reauth_grace = reauth_grace
+        self.claims_envelope = claims_envelope
+        # Shared by all TokenSecurity instances so that plugin metrics cover every route
+        self.plugin_runner = (
+            plugin_runner if plugin_runner is not None else PluginRunner(debug_logger=debug_logger)
+        )
+        self.decision_cache = decision_cache
+        self.wildcard_scopes = wildcard_scopes
+        self.revocation_list = revocation_list
+
+        # Shared by all TokenSecurity instances so that managers are only loaded once
+        self.verifier = Verifier(
+            self.domain_configs,
+            debug_logger=debug_logger,
+            debug_exceptions=debug_exceptions,
+            token_cache=token_cache,
+        )
+
+        # Memoized per instance, since a cache on the method would keep every instance alive
+        self._lockdown = lru_cache(maxsize=128)(self._build_token_security)
+
+        _instances.add(self)
 
-    @lru_cache(maxsize=128)
     def lockdown(
         self,
         *scopes: str,
         permission_mode: PermissionMode = PermissionMode.ALL,
         skip_plugins: bool = False,
+        plugins: Optional[Iterable[str]] = None,
+        plugin_tags: Optional[Iterable[str]] = None,
+        requires: Optional[str] = None,
+        match_keys: Optional[Mapping[str, Any]] = None,
     ) -> TokenSecurity:
         """
         Initialize an instance of TokenSecurity to lockdown a route. Uses memoization to minimize
@@ -69,7 +128,33 @@ class Armasec:
             permissions_mode: If "ALL", all scopes listed are required for access. If "SOME", only
                 one of the scopes listed are required for access.
             skip_plugins: If True, do not evaluate plugin validators.
+            plugins: The names of the plugins to evaluate for the route. If neither plugins nor
+                plugin_tags are supplied, all plugin validators are evaluated.
+            plugin_tags: Evaluate the plugins that declare any of these tags for the route.
+            requires: A boolean scope expression the token's permissions must satisfy, like
+                `admin or (read:x and tenant:y)`. Applied along with the scopes.
+            match_keys: Key-value pairs the token payload must contain for the route.
         """
+        return self._lockdown(
+            scopes,
+            permission_mode,
+            skip_plugins,
+            tuple(sorted(plugins)) if plugins is not None else None,
+            tuple(sorted(plugin_tags)) if plugin_tags is not None else None,
+            requires,
+            freeze_match_keys(match_keys) if match_keys else None,
+        )
+
+    def _build_token_security(
+        self,
+        scopes: Tuple[str, ...],
+        permission_mode: PermissionMode,
+        skip_plugins: bool,
+        plugins: Optional[Tuple[str, ...]],
+        plugin_tags: Optional[Tuple[str, ...]],
+        requires: Optional[str],
+        match_keys: Optional[Tuple[Tuple[str, Any], ...]],
+    ) -> TokenSecurity:
         return TokenSecurity(
             domain_configs=self.domain_configs,
             scopes=scopes,
@@ -77,12 +162,89 @@ class Armasec:
             debug_logger=self.debug_logger,
             debug_exceptions=self.debug_exceptions,
             skip_plugins=skip_plugins,
+            verifier=self.verifier,
+            reauth_grace=self.reauth_grace,
+            claims_envelope=self.claims_envelope,
+            plugin_runner=self.plugin_runner,
+            plugins=plugins,
+            plugin_tags=plugin_tags,
+            requires=requires,
+            match_keys=dict(match_keys) if match_keys else None,
+            decision_cache=self.decision_cache,
+            wildcard_scopes=self.wildcard_scopes,
+            revocation_list=self.revocation_list,
         )
 
+    @property
+    def managers(self) -> List[ManagerConfig]:
+        """
+        The managers of the statically configured domains loaded by the verifier.
+        """
+        return self.verifier.managers
+
+    @property
+    def tenant_registries(self) -> Dict[str, TenantRegistry]:
+        """
+        The registries that resolve the managers of templated domains.
+        """
+        return self.verifier.tenant_registries
+
+    def preload(self):
+        """
+        Load the OIDC resources and managers for every statically configured domain up front.
+
+        Call this in the master process of a pre-fork server (like gunicorn with `--preload`) so
+        that discovery, jwks fetches, and key preparation happen once before `fork()`. Forked
+        workers inherit the ready managers through copy-on-write memory and do not call the OIDC
+        provider on their first request. Locks, shared stores, and token cache connections are
+        reset in each forked child. Installed plugins are discovered here too instead of on the
+        first request.
+        """
+        self.debug_logger("Preloading managers for all domains")
+        self.verifier.load_managers()
+        load_plugins()
+
+    def _after_fork(self):
+        """
+        Reset the process-local state inherited from the parent process in a forked child.
+        """
+        self.verifier.after_fork()
+        self.plugin_runner.result_cache.reset()
+        permission_registry.reset()
+        for domain_config in self.domain_configs:
+            if domain_config.role_map is not None:
+                domain_config.role_map.reset()
+        if self.decision_cache is not None:
+            self.decision_cache.reset()
+        if self.revocation_list is not None:
+            self.revocation_list.reset()
+
+    def prefetch_tenants(self, domain: str, tenants: Iterable[str]):
+        """
+        Load the managers for hot tenants of a templated domain ahead of their first request.
+
+        Args:
+            domain:  The templated domain, like `auth.example.com/realms/{tenant}`.
+            tenants: The tenants to load. Loads run with bounded concurrency.
+        """
+        self.verifier.prefetch_tenants(domain, tenants)
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Report the health of the OIDC resources for each loaded domain for use in a health probe.
+
+        The report is unhealthy if any domain is serving jwks that have exceeded their maximum
+        staleness or if its circuit breaker is open. Also reports the call statistics of each
+        plugin.
+        """
+        return dict(**self.verifier.health(), plugins=self.plugin_runner.metrics())
+
     def lockdown_all(
         self,
         *scopes: str,
         skip_plugins: bool = False,
+        plugins: Optional[Iterable[str]] = None,
+        plugin_tags: Optional[Iterable[str]] = None,
     ) -> TokenSecurity:
         """
         Initialize an instance of TokenSecurity to lockdown a route. Uses memoization to minimize
@@ -93,17 +255,23 @@ class Armasec:
         Args:
             scopes: A list of the scopes needed to access the endpoint. All are required.
             skip_plugins: If True, do not evaluate plugin validators.
+            plugins: The names of the plugins to evaluate for the route.
+            plugin_tags: Evaluate the plugins that declare any of these tags for the route.
         """
         return self.lockdown(
             *scopes,
             permission_mode=PermissionMode.ALL,
             skip_plugins=skip_plugins,
+            plugins=plugins,
+            plugin_tags=plugin_tags,
         )
 
     def lockdown_some(
         self,
         *scopes: str,
         skip_plugins: bool = False,
+        plugins: Optional[Iterable[str]] = None,
+        plugin_tags: Optional[Iterable[str]] = None,
     ) -> TokenSecurity:
         """
         Initialize an instance of TokenSecurity to lockdown a route. Uses memoization to minimize
@@ -113,9 +281,24 @@ class Armasec:
         Args:
             scopes: A list of the scopes needed to access the endpoint. Only one is required.
             skip_plugins: If True, do not evaluate plugin validators.
+            plugins: The names of the plugins to evaluate for the route.
+            plugin_tags: Evaluate the plugins that declare any of these tags for the route.
         """
         return self.lockdown(
             *scopes,
             permission_mode=PermissionMode.SOME,
             skip_plugins=skip_plugins,
+            plugins=plugins,
+            plugin_tags=plugin_tags,
         )
+
+
+def _reset_instances_in_child():
+    """
+    Reset the live Armasec instances in a forked child. Registered once for all of them.
+    """
+    for armasec in list(_instances):
+        armasec._after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_instances_in_child)
@@ -0,0 +1,116 @@
+"""
+This module defines a request-scoped AuthorizationContext for fine-grained checks like GraphQL
+field resolvers.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple, Union
+
+from armasec.exceptions import AuthorizationError
+from armasec.permissions import PermissionMode, check_match_keys, check_permissions
+from armasec.token_payload import TokenPayload
+from armasec.utilities import noop
+
+
+class AuthorizationContext:
+    """
+    Answer many authorization checks for one verified token within a single request.
+
+    Build one context per request from the TokenPayload returned by TokenSecurity and pass it to
+    resolvers, for example through the Strawberry context getter. The token's permissions are
+    precomputed once and every decision is memoized by `(scopes, mode)`, so checking the same
+    scopes on hundreds of fields only evaluates them once. The checks follow the same
+    PermissionMode and match_keys semantics as TokenSecurity.
+    """
+
+    __slots__ = ("token_payload", "permissions", "debug_logger", "_decisions")
+
+    def __init__(
+        self,
+        token_payload: TokenPayload,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the AuthorizationContext.
+
+        Args:
+            token_payload: The verified payload of the request's token.
+            debug_logger:  A callable, that if provided, will allow debug logging. Should be
+                           passed as a logger method like `logger.debug`
+        """
+        self.token_payload = token_payload
+        self.permissions = token_payload.permission_set
+        self.debug_logger = debug_logger if debug_logger else noop
+        self._decisions: Dict[Tuple[Any, Any], bool] = dict()
+
+    def allows(
+        self,
+        scopes: Union[str, Iterable[str]],
+        mode: Union[PermissionMode, str] = PermissionMode.ALL,
+    ) -> bool:
+        """
+        Check if the token grants the scopes under the permission mode.
+
+        Args:
+            scopes: A scope or the scopes to check.
+            mode:   The PermissionMode to apply. `ALL` requires every scope and `SOME` requires at
+                    least one of them.
+        """
+        if not isinstance(scopes, (str, tuple, frozenset)):
+            scopes = tuple(scopes)
+        key = (scopes, mode)
+        decision = self._decisions.get(key)
+        if decision is not None:
+            return decision
+
+        required = frozenset((scopes,) if isinstance(scopes, str) else scopes)
+        permission_mode = PermissionMode(mode)
+        if permission_mode == PermissionMode.ALL:
+            decision = required <= self.permissions
+        elif permission_mode == PermissionMode.SOME:
+            decision = not required.isdisjoint(self.permissions)
+        else:
+            raise AuthorizationError(f"Unknown permission_mode: {mode}")
+        self._decisions[key] = decision
+        return decision
+
+    def require(
+        self,
+        scopes: Union[str, Iterable[str]],
+        mode: Union[PermissionMode, str] = PermissionMode.ALL,
+    ):
+        """
+        Require the token to grant the scopes under the permission mode. Raise AuthorizationError
+        if it does not.
+
+        Args:
+            scopes: A scope or the scopes to require.
+            mode:   The PermissionMode to apply.
+        """
+        # Normalized once, since a generator would be exhausted by allows() before the check
+        if not isinstance(scopes, (str, tuple, frozenset)):
+            scopes = tuple(scopes)
+        try:
+            # Fast path for memoized decisions
+            if self._decisions.get((scopes, mode)):
+                return
+        except TypeError:
+            pass
+
+        if not self.allows(scopes, mode):
+            # Delegate to the shared check so the error matches the one TokenSecurity raises
+            check_permissions(
+                self.permissions,
+                (scopes,) if isinstance(scopes, str) else scopes,
+                PermissionMode(mode),
+                debug_logger=self.debug_logger,
+            )
+
+    def require_claims(self, match_keys: Mapping[str, Any]):
+        """
+        Require the token to contain key-value pairs, with the same semantics as the `match_keys`
+        of a DomainConfig. Raise AuthorizationError if it does not.
+
+        Args:
+            match_keys: The key-value pairs to match in the token payload.
+        """
+        check_match_keys(self.token_payload, match_keys)
@@ -0,0 +1,137 @@
+"""
+This module provides a CircuitBreaker that guards calls to an OIDC provider.
+"""
+
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from auto_name_enum import AutoNameEnum, auto
+
+from armasec.utilities import noop
+
+
+class BreakerState(AutoNameEnum):
+    """
+    States of a circuit breaker.
+
+    Attributes:
+        CLOSED:    Calls are allowed through.
+        OPEN:      Calls are rejected until the reset timeout elapses.
+        HALF_OPEN: A single probe call is in flight to check if the provider has recovered.
+    """
+
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker that opens after repeated failures.
+
+    While the breaker is open, calls are rejected without touching the network. Once the reset
+    timeout elapses, exactly one caller is allowed through as a half-open probe. The probe's
+    outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes a CircuitBreaker.
+
+        Args:
+            failure_threshold: The number of consecutive failures that opens the breaker.
+            reset_timeout:     The number of seconds to wait before probing an open breaker.
+            debug_logger:      A callable, that if provided, will allow debug logging. Should be
+                               passed as a logger method like `logger.debug`
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.debug_logger = debug_logger if debug_logger else noop
+
+        # Counts calls by outcome ("success", "failure", "rejected") and state transitions
+        self.stats: Counter = Counter()
+
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    @property
+    def state(self) -> BreakerState:
+        """
+        The current state of the breaker.
+        """
+        return self._state
+
+    def allow_request(self) -> bool:
+        """
+        Check if a call may proceed.
+
+        Only one caller at a time is allowed through once an open breaker's reset timeout has
+        elapsed. That caller must report the outcome with `record_success()` or `record_failure()`.
+        """
+        if self._state is BreakerState.CLOSED:
+            return True
+
+        if (
+            self._state is BreakerState.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+            and self._probe_lock.acquire(blocking=False)
+        ):
+            self.debug_logger("Circuit breaker is half-open. Allowing a probe request")
+            self._transition(BreakerState.HALF_OPEN)
+            return True
+
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        """
+        Record a successful call and close the breaker.
+        """
+        with self._lock:
+            self.stats["success"] += 1
+            self._failures = 0
+            if self._state is not BreakerState.CLOSED:
+                self.debug_logger("Circuit breaker is closing")
+                self._transition(BreakerState.CLOSED)
+            self._release_probe()
+
+    def record_failure(self):
+        """
+        Record a failed call and open the breaker if the failure threshold has been reached.
+        """
+        with self._lock:
+            self.stats["failure"] += 1
+            self._failures += 1
+            if self._state is BreakerState.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.debug_logger(f"Circuit breaker is opening after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._transition(BreakerState.OPEN)
+            self._release_probe()
+
+    def after_fork(self):
+        """
+        Replace the locks that may have been held by another thread when the process forked.
+        """
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        if self._state is BreakerState.HALF_OPEN:
+            self._transition(BreakerState.OPEN)
+
+    def _transition(self, state: BreakerState):
+        if self._state is not state:
+            self.stats[f"to_{state.value.lower()}"] += 1
+        self._state = state
+
+    def _release_probe(self):
+        if self._probe_lock.locked():
+            self._probe_lock.release()
@@ -0,0 +1,172 @@
+"""
+This module defines a ClaimsEnvelope that passes verified claims between internal services.
+
+An edge service that has verified a user's token mints a short-lived, HMAC-signed envelope of its
+claims and attaches it to the requests it makes to internal services. The internal services accept
+the envelope with a constant-time HMAC check instead of verifying the token's RSA signature again.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Iterable, Optional
+
+
+from armasec.exceptions import ArmasecError, AuthenticationError
+from armasec.token_payload import TokenPayload
+from armasec.utilities import get_authorization_scheme_param
+
+
+class ClaimsEnvelope:
+    """
+    Mint and verify HMAC-signed envelopes of verified token claims.
+
+    An envelope is `<body>.<signature>`, where both parts are unpadded base64url. The body is a
+    compact JSON object with the token's subject, permissions, client id, issuer, audience and any
+    extra claims listed in `include_claims`. It is bound to the original token by its `jti` and
+    `exp`: the envelope never outlives the token, and the original Authorization header must be
+    forwarded along with the envelope with the same `jti` and `exp`. Set `allow_unbound` to accept
+    envelopes without the token on hops that do not forward it, so that a leaked envelope may be
+    replayed on its own until it expires.
+
+    The envelope only proves that a service holding the secret verified the token. The issuer,
+    audience and `match_keys` of the receiving service's domains must still be checked, which
+    TokenSecurity does with `Verifier.check_forwarded()`.
+    """
+
+    header_name = "X-Armasec-Claims"
+
+    def __init__(
+        self,
+        secret: bytes,
+        ttl: float = 30.0,
+        previous_secrets: Iterable[bytes] = (),
+        include_claims: Iterable[str] = (),
+        allow_unbound: bool = False,
+    ):
+        """
+        Initializes the ClaimsEnvelope.
+
+        Args:
+            secret:           The shared secret used to sign new envelopes. It must be shared by
+                              the services that mint and verify envelopes and kept out of reach of
+                              clients.
+            ttl:              The maximum lifetime of an envelope in seconds. Envelopes also expire
+                              with the token they were minted from.
+            previous_secrets: Secrets that are still accepted during a rotation but are no longer
+                              used to sign.
+            include_claims:   Extra claims of the token to carry in the envelope.
+            allow_unbound:    If True, accept envelopes that are not forwarded with their token.
+        """
+        ArmasecError.require_condition(secret, "The envelope secret must not be empty")
+        self.ttl = ttl
+        self.include_claims = tuple(include_claims)
+        self.allow_unbound = allow_unbound
+        self._secrets = [secret, *previous_secrets]
+
+    def mint(self, token_payload: TokenPayload) -> str:
+        """
+        Mint an envelope for the verified payload of a token.
+
+        Args:
+            token_payload: A TokenPayload that was verified by a TokenManager.
+        """
+        now = time.time()
+        token_exp = token_payload.expire.timestamp() if token_payload.expire else None
+        envelope_exp = now + self.ttl if token_exp is None else min(now + self.ttl, token_exp)
+
+        claims: Dict[str, Any] = dict(
+            sub=token_payload.sub,
+            permissions=token_payload.permissions,
+            exp=envelope_exp,
+            texp=token_exp,
+            jti=getattr(token_payload, "jti", None),
+        )
+        if token_payload.client_id is not None:
+            claims["azp"] = token_payload.client_id
+        for claim in ("iss", "aud", *self.include_claims):
+            value = getattr(token_payload, claim, None)
+            if value is not None:
+                claims[claim] = value
+
+        body = _encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{body}.{self._sign(self._secrets[0], body)}"
+
+    def headers(self, token_payload: TokenPayload) -> Dict[str, str]:
+        """
+        Build the headers that carry an envelope for the verified payload of a token.
+        """
+        return {self.header_name: self.mint(token_payload)}
+
+    def verify(self, envelope: str, authorization: Optional[str] = None) -> TokenPayload:
+        """
+        Verify an envelope and return the TokenPayload it carries. Raise AuthenticationError if the
+        signature does not match, if the envelope has expired, or if it is not bound to the
+        forwarded token.
+
+        Args:
+            envelope:      The envelope to verify.
+            authorization: The original Authorization header. Only optional if `allow_unbound`
+                           is set.
+        """
+        (body, _, signature) = envelope.partition(".")
+        AuthenticationError.require_condition(body and signature, "Malformed claims envelope")
+        AuthenticationError.require_condition(
+            any(
+                hmac.compare_digest(signature.encode("utf-8"), self._sign(secret, body).encode())
+                for secret in self._secrets
+            ),
+            "Invalid claims envelope signature",
+        )
+
+        with AuthenticationError.handle_errors("Malformed claims envelope"):
+            claims = json.loads(_decode(body))
+            expires = float(claims.pop("exp"))
+            token_expires = claims.pop("texp")
+        AuthenticationError.require_condition(
+            expires > time.time(),
+            "Claims envelope has expired",
+        )
+
+        if not authorization:
+            AuthenticationError.require_condition(
+                self.allow_unbound, "Claims envelope was not forwarded with its token"
+            )
+        else:
+            # Deferred so that importing armasec does not import python-jose
+            from jose import JWTError, jwt
+
+            (_, token) = get_authorization_scheme_param(authorization)
+            try:
+                token_claims = jwt.get_unverified_claims(token)
+            except JWTError:
+                raise AuthenticationError("Forwarded token is malformed")
+            AuthenticationError.require_condition(
+                token_claims.get("jti") == claims.get("jti")
+                and token_claims.get("exp") == token_expires,
+                "Claims envelope is not bound to the forwarded token",
+            )
+            claims["original_token"] = token
+
+        claims["exp"] = token_expires if token_expires else expires
+        token_payload = TokenPayload(**claims)
+        if authorization:
+            # Cached decisions depend on the claims that the envelope carries, so the digest that
+            # keys them covers those claims along with the bound token
+            material = json.dumps(claims, sort_keys=True, separators=(",", ":"), default=str)
+            token_payload._token_digest = hashlib.sha256(material.encode("utf-8")).digest()
+        return token_payload
+
+    @staticmethod
+    def _sign(secret: bytes, body: str) -> str:
+        return _encode(hmac.new(secret, body.encode("utf-8"), hashlib.sha256).digest())
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
@@ -0,0 +1,127 @@
+"""
+This module provides a DecisionCache for the authorization decisions made for verified tokens.
+"""
+
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from typing import Any, Dict, Hashable, Optional, Tuple, Type
+
+from armasec.exceptions import ArmasecError
+
+MISS = object()
+
+
+class DecisionCache:
+    """
+    An in-process store for the allow or deny decisions made for a token on a route.
+
+    Decisions are keyed by the digest of the token and the key of the route's decision, which
+    covers its Policy and the plugins selected for it. A decision includes the outcome of the
+    plugins that opt in by declaring `armasec_decision_cacheable = True`; such a plugin must decide
+    on the token payload alone. Other plugins run on every request.
+
+    Decisions expire when the token does, or after `max_ttl` if it is set. Looking up a decision
+    costs a single dict lookup and does not take a lock.
+
+    A deny is stored as the type and arguments of its error, and every lookup builds a new error
+    from them. Concurrent requests never raise the same instance, whose traceback and context
+    would be shared.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_ttl: Optional[float] = None):
+        """
+        Initializes the DecisionCache.
+
+        Args:
+            max_entries: The maximum number of decisions to hold. When it is reached, expired
+                         decisions are dropped first, then the oldest ones.
+            max_ttl:     Optional maximum number of seconds to keep a decision, for example to
+                         pick up permission changes before long-lived tokens expire.
+        """
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: Dict[
+            Hashable, Tuple[float, Optional[Tuple[Type[ArmasecError], Tuple[Any, ...]]]]
+        ] = dict()
+        self._lock = threading.Lock()
+
+        # Counts "hits", "misses", "sets" and "evictions"
+        self.stats: Counter = Counter()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Retrieve a decision. Returns None for an allow, a new ArmasecError for a deny, or MISS if
+        there is no live decision for the key.
+        """
+        item = self._entries.get(key)
+        if item is not None and item[0] > time.time():
+            self.stats["hits"] += 1
+            denial = item[1]
+            if denial is None:
+                return None
+            (error_type, args) = denial
+            return error_type(*args)
+        self.stats["misses"] += 1
+        return MISS
+
+    def set(self, key: Hashable, error: Optional[ArmasecError], expires_at: Optional[float]):
+        """
+        Store a decision until the token expires. Decisions for tokens without an expiry are not
+        stored.
+
+        Args:
+            key:        The token digest and the decision key of the route.
+            error:      None if the token was allowed, or the ArmasecError that denied it.
+            expires_at: The expiry of the token as a timestamp.
+        """
+        if expires_at is None:
+            return
+        now = time.time()
+        if self.max_ttl is not None:
+            expires_at = min(expires_at, now + self.max_ttl)
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._evict(now)
+            self._entries[key] = (expires_at, (type(error), error.args) if error else None)
+            self.stats["sets"] += 1
+
+    def clear(self):
+        """
+        Drop all cached decisions, for example after changing the permissions of a user.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        """
+        Report the number of cached decisions, the cache's counters, and its hit rate.
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            entries=len(self._entries),
+            hit_rate=self.stats["hits"] / lookups if lookups else None,
+            **self.stats,
+        )
+
+    def reset(self):
+        """
+        Reset the lock inherited from the parent process in a forked child.
+        """
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        """
+        Make room for new decisions. Must be called with the lock held.
+
+        Drops the expired decisions. If none have expired, drops the oldest tenth of them so that
+        the entries are not scanned again on every insert.
+        """
+        evicted = [key for (key, (expires_at, _)) in self._entries.items() if expires_at <= now]
+        if not evicted:
+            # Dicts keep insertion order, so the first keys are the oldest decisions
+            evicted = list(islice(self._entries, max(self.max_entries // 10, 1)))
+        for key in evicted:
+            del self._entries[key]
+        self.stats["evictions"] += len(evicted)
@@ -1,5 +1,6 @@
+from http import HTTPStatus
+
 import buzz
-import starlette.status
 
 
 class ArmasecError(buzz.Buzz):
@@ -10,7 +11,7 @@ class ArmasecError(buzz.Buzz):
         status_code: The HTTP status code indicated by the error. Set to 400.
     """
 
-    status_code: int = starlette.status.HTTP_400_BAD_REQUEST
+    status_code: int = HTTPStatus.BAD_REQUEST
     detail: str = "Bad request"
 
 
@@ -22,7 +23,7 @@ class AuthenticationError(ArmasecError):
         status_code: The HTTP status code indicated by the error. Set to 401.
     """
 
-    status_code: int = starlette.status.HTTP_401_UNAUTHORIZED
+    status_code: int = HTTPStatus.UNAUTHORIZED
     detail: str = "Not authenticated"
 
 
@@ -34,7 +35,7 @@ class AuthorizationError(ArmasecError):
         status_code: The HTTP status code indicated by the error. Set to 403.
     """
 
-    status_code: int = starlette.status.HTTP_403_FORBIDDEN
+    status_code: int = HTTPStatus.FORBIDDEN
     detail: str = "Not authorized"
 
 
@@ -46,5 +47,17 @@ class PayloadMappingError(ArmasecError):
         status_code: The HTTP status code indicated by the error. Set to 500.
     """
 
-    status_code: int = starlette.status.HTTP_500_INTERNAL_SERVER_ERROR
+    status_code: int = HTTPStatus.INTERNAL_SERVER_ERROR
     detail: str = "Server error"
+
+
+class PluginTimeoutError(ArmasecError):
+    """
+    Indicates that the plugin checks did not finish in time. The request is denied.
+
+    Attributes:
+        status_code: The HTTP status code indicated by the error. Set to 503.
+    """
+
+    status_code: int = HTTPStatus.SERVICE_UNAVAILABLE
+    detail: str = "Authorization checks timed out"
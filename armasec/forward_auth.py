@@ -0,0 +1,345 @@
+"""
+This module defines a standalone forward-auth ASGI app that verifies tokens for a reverse proxy.
+
+The app can sit behind nginx `auth_request` or Traefik `ForwardAuth` so that services behind the
+proxy do not need to verify tokens themselves. Run it with a plain ASGI server::
+
+    ARMASEC_DOMAIN_CONFIGS='[{"domain": "auth.example.com", "audience": "https://api"}]' \
+        ARMASEC_ROUTES='{"jobs": {"scopes": ["read:jobs"]}}' \
+        uvicorn --factory armasec.forward_auth:create_app
+
+Proxies pass the headers of the original request through to the subrequest, so the scopes of each
+upstream location should be configured here as a named route and selected by the path of the
+subrequest, like `auth_request /verify/jobs;`.
+"""
+
+import json
+import os
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from armasec.exceptions import ArmasecError, AuthenticationError
+from armasec.middleware import ASGIApp, Receive, Scope, Send
+from armasec.permissions import PermissionMode, check_permissions
+from armasec.schemas import DomainConfig
+from armasec.token_cache import InMemoryTokenCache, TokenCache
+from armasec.token_payload import TokenPayload
+from armasec.utilities import noop
+from armasec.verifier import Verifier
+
+DEFAULT_CLAIM_HEADERS = {
+    "X-Auth-Subject": "sub",
+    "X-Auth-Client-Id": "client_id",
+    "X-Auth-Permissions": "permissions",
+}
+
+SCOPES_HEADER = b"x-armasec-scopes"
+PERMISSION_MODE_HEADER = b"x-armasec-permission-mode"
+
+
+class RoutePolicy(NamedTuple):
+    """
+    The scopes required by an upstream location.
+
+    Attributes:
+        scopes:          The scopes required by the location.
+        permission_mode: `ALL` to require every scope, or `SOME` to require one of them.
+    """
+
+    scopes: Tuple[str, ...] = ()
+    permission_mode: str = PermissionMode.ALL.value
+
+
+class ForwardAuthApp:
+    """
+    An ASGI app that answers forward-auth subrequests from a reverse proxy.
+
+    Routes:
+        `GET {verify_path}`: Verifies the Authorization header of the original request. Responds
+            with 200 and the selected claims as headers, 401 if the token cannot be verified, or
+            403 if it lacks the required scopes.
+        `GET {verify_path}/{route}`: Verifies the token like `{verify_path}` and requires the
+            scopes of the named route. Responds with 404 if the route is not configured.
+        `POST {verify_path}/bulk`: Verifies a batch of tokens in one call. The body is a JSON
+            object like `{"tokens": [...], "scopes": [...], "permission_mode": "ALL"}` and the
+            response has one result per token, in order.
+        `GET {health_path}`: Reports the health of the verifier with 200 or 503.
+
+    Scopes may also be required with the `X-Armasec-Scopes` header (comma separated). Since a
+    client can send it too, all of them are required and the `X-Armasec-Permission-Mode` header is
+    ignored, so that a client can only restrict its own access. Both headers are ignored on named
+    routes. Only set `trust_policy_headers` if the proxy strips or overwrites both headers on every
+    location, like with nginx `proxy_set_header`, since a client could otherwise send `SOME`.
+    """
+
+    def __init__(
+        self,
+        verifier: Verifier,
+        claim_headers: Optional[Mapping[str, str]] = None,
+        verify_path: str = "/verify",
+        health_path: str = "/health",
+        max_bulk_size: int = 1000,
+        routes: Optional[Mapping[str, RoutePolicy]] = None,
+        trust_policy_headers: bool = False,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the ForwardAuthApp.
+
+        Args:
+            verifier:             The Verifier used to check tokens.
+            claim_headers:        Mapping of response header names to the token claims they
+                                  carry. List claims are joined with commas. Missing claims are
+                                  omitted.
+            verify_path:          The path of the forward-auth endpoint. The bulk endpoint is at
+                                  `{verify_path}/bulk`.
+            health_path:          The path of the health endpoint.
+            max_bulk_size:        The maximum number of tokens accepted by a bulk request.
+            routes:               Mapping of route names to the policies served at
+                                  `{verify_path}/{route}`.
+            trust_policy_headers: If True, the `X-Armasec-Permission-Mode` header is honored. The
+                                  proxy must then strip or overwrite the `X-Armasec-*` headers of
+                                  the original request.
+            debug_logger:         A callable, that if provided, will allow debug logging. Should be
+                                  passed as a logger method like `logger.debug`
+        """
+        self.verifier = verifier
+        self.claim_headers = [
+            (name.lower().encode("latin-1"), claim)
+            for (name, claim) in (
+                claim_headers if claim_headers is not None else DEFAULT_CLAIM_HEADERS
+            ).items()
+        ]
+        self.verify_path = verify_path
+        self.bulk_path = f"{verify_path}/bulk"
+        self.health_path = health_path
+        self.max_bulk_size = max_bulk_size
+        self.routes = {f"{verify_path}/{name}": policy for (name, policy) in (routes or {}).items()}
+        self.trust_policy_headers = trust_policy_headers
+        self.debug_logger = debug_logger if debug_logger else noop
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"]
+        if path == self.verify_path:
+            await self._respond(send, *self.forward_auth(_raw_headers(scope)))
+        elif path == self.bulk_path and scope["method"] == "POST":
+            body = await _read_body(receive)
+            await self._respond(send, *self.bulk_verify(body))
+        elif path in self.routes:
+            await self._respond(send, *self.forward_auth(_raw_headers(scope), self.routes[path]))
+        elif path == self.health_path:
+            health = self.verifier.health()
+            status = HTTPStatus.OK if health["healthy"] else HTTPStatus.SERVICE_UNAVAILABLE
+            await self._respond(send, status, [], health)
+        else:
+            await self._respond(send, HTTPStatus.NOT_FOUND, [], dict(detail="Not found"))
+
+    def forward_auth(
+        self, headers: Mapping[bytes, bytes], route: Optional[RoutePolicy] = None
+    ) -> Tuple[int, List[Tuple[bytes, bytes]], Optional[Dict[str, Any]]]:
+        """
+        Verify the token of a forward-auth subrequest. Returns the status, the response headers,
+        and an optional JSON body.
+
+        Args:
+            headers: The raw headers of the subrequest, keyed by lower-case name.
+            route:   Optional policy of the route the subrequest was sent to. If provided, the
+                     `X-Armasec-*` headers are ignored.
+        """
+        authorization = headers.get(b"authorization")
+        if route is not None:
+            (scopes, permission_mode) = (list(route.scopes), route.permission_mode)
+        else:
+            scopes = _split_scopes(headers.get(SCOPES_HEADER, b"").decode("latin-1"))
+            permission_mode = PermissionMode.ALL.value
+            if self.trust_policy_headers:
+                permission_mode = headers.get(PERMISSION_MODE_HEADER, b"ALL").decode("latin-1")
+            elif PERMISSION_MODE_HEADER in headers:
+                self.debug_logger("Ignoring the untrusted X-Armasec-Permission-Mode header")
+        try:
+            token_payload = self.verify(
+                authorization.decode("latin-1") if authorization else None,
+                scopes,
+                permission_mode,
+            )
+        except Exception as err:
+            self.debug_logger(f"Forward-auth rejected: {err}")
+            status = getattr(err, "status_code", HTTPStatus.UNAUTHORIZED)
+            detail = getattr(err, "detail", "Not authenticated")
+            return (status, [(b"www-authenticate", b"Bearer")], dict(detail=detail))
+        return (HTTPStatus.OK, self.build_claim_headers(token_payload), None)
+
+    def bulk_verify(
+        self, body: bytes
+    ) -> Tuple[int, List[Tuple[bytes, bytes]], Optional[Dict[str, Any]]]:
+        """
+        Verify a batch of tokens. Returns the status, the response headers, and the JSON body.
+
+        Args:
+            body: The raw JSON body of the bulk request.
+        """
+        try:
+            request = json.loads(body)
+            tokens = request["tokens"]
+            ArmasecError.require_condition(
+                isinstance(tokens, list) and len(tokens) <= self.max_bulk_size,
+                f"Expected a list of at most {self.max_bulk_size} tokens",
+            )
+            scopes = request.get("scopes") or []
+            permission_mode = request.get("permission_mode", "ALL")
+        except Exception as err:
+            self.debug_logger(f"Malformed bulk request: {err}")
+            return (HTTPStatus.BAD_REQUEST, [], dict(detail="Malformed bulk request"))
+
+        results = []
+        for token in tokens:
+            try:
+                token_payload = self.verify(f"Bearer {token}", scopes, permission_mode)
+            except Exception as err:
+                results.append(
+                    dict(
+                        status=int(getattr(err, "status_code", HTTPStatus.UNAUTHORIZED)),
+                        detail=getattr(err, "detail", "Not authenticated"),
+                    )
+                )
+            else:
+                results.append(dict(status=int(HTTPStatus.OK), claims=self.claims(token_payload)))
+        return (HTTPStatus.OK, [], dict(results=results))
+
+    def verify(
+        self, authorization: Optional[str], scopes: Iterable[str], permission_mode: str
+    ) -> TokenPayload:
+        """
+        Verify a token and check it against the scopes requested for the upstream location.
+        """
+        token_payload = self.verifier.verify(authorization)
+        scopes = list(scopes)
+        if scopes:
+            try:
+                mode = PermissionMode(permission_mode.upper())
+            except ValueError:
+                raise ArmasecError(f"Unknown permission_mode: {permission_mode}")
+            check_permissions(token_payload.permissions, scopes, mode, self.debug_logger)
+        return token_payload
+
+    def claims(self, token_payload: TokenPayload) -> Dict[str, Any]:
+        """
+        Select the configured claims from a token payload.
+        """
+        claims = dict()
+        for _, claim in self.claim_headers:
+            value = getattr(token_payload, claim, None)
+            if value is not None:
+                claims[claim] = value
+        return claims
+
+    def build_claim_headers(self, token_payload: TokenPayload) -> List[Tuple[bytes, bytes]]:
+        """
+        Render the configured claims of a token payload as response headers.
+        """
+        headers = []
+        for name, claim in self.claim_headers:
+            value = getattr(token_payload, claim, None)
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = ",".join(str(item) for item in value)
+            headers.append((name, str(value).encode("latin-1", errors="replace")))
+        return headers
+
+    async def _respond(
+        self,
+        send: Send,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        body: Optional[Dict[str, Any]],
+    ):
+        content = json.dumps(body, default=str).encode("utf-8") if body is not None else b""
+        headers = [
+            *headers,
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(content)).encode("latin-1")),
+        ]
+        await send(dict(type="http.response.start", status=int(status), headers=headers))
+        await send(dict(type="http.response.body", body=content))
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self.verifier.load_managers()
+                except AuthenticationError as err:
+                    self.debug_logger(f"Failed to preload managers: {err}")
+                await send(dict(type="lifespan.startup.complete"))
+            elif message["type"] == "lifespan.shutdown":
+                await send(dict(type="lifespan.shutdown.complete"))
+                return
+
+
+def create_app(debug_logger: Optional[Callable[..., None]] = None) -> ASGIApp:
+    """
+    Build a ForwardAuthApp configured from environment variables.
+
+    Variables:
+        ARMASEC_DOMAIN_CONFIGS:   A JSON list of DomainConfig objects. Required.
+        ARMASEC_CLAIM_HEADERS:    A JSON object mapping response header names to claims.
+        ARMASEC_TOKEN_CACHE_SIZE: The size of the in-memory verified token cache. 0 disables it.
+                                  Defaults to 10000.
+        ARMASEC_ROUTES:           A JSON object mapping route names to objects with the `scopes`
+                                  and optional `permission_mode` of the route.
+        ARMASEC_TRUST_POLICY_HEADERS: If "true", the `X-Armasec-Permission-Mode` header is
+                                  honored. Only set it if the proxy strips the `X-Armasec-*`
+                                  headers of the original request.
+    """
+    raw_domain_configs = os.environ.get("ARMASEC_DOMAIN_CONFIGS")
+    ArmasecError.require_condition(raw_domain_configs, "ARMASEC_DOMAIN_CONFIGS is not set")
+    domain_configs = [DomainConfig(**item) for item in json.loads(str(raw_domain_configs))]
+
+    raw_claim_headers = os.environ.get("ARMASEC_CLAIM_HEADERS")
+    claim_headers = json.loads(raw_claim_headers) if raw_claim_headers else None
+
+    cache_size = int(os.environ.get("ARMASEC_TOKEN_CACHE_SIZE", "10000"))
+    token_cache = TokenCache(InMemoryTokenCache(max_entries=cache_size)) if cache_size else None
+
+    raw_routes = os.environ.get("ARMASEC_ROUTES")
+    routes = {
+        name: RoutePolicy(
+            scopes=tuple(item.get("scopes", ())),
+            permission_mode=item.get("permission_mode", PermissionMode.ALL.value),
+        )
+        for (name, item) in (json.loads(raw_routes) if raw_routes else {}).items()
+    }
+    trust_policy_headers = os.environ.get("ARMASEC_TRUST_POLICY_HEADERS", "").lower() == "true"
+
+    verifier = Verifier(domain_configs, debug_logger=debug_logger, token_cache=token_cache)
+    return ForwardAuthApp(
+        verifier,
+        claim_headers=claim_headers,
+        routes=routes,
+        trust_policy_headers=trust_policy_headers,
+        debug_logger=debug_logger,
+    )
+
+
+def _raw_headers(scope: Scope) -> Dict[bytes, bytes]:
+    return dict(scope.get("headers", ()))
+
+
+def _split_scopes(value: str) -> List[str]:
+    return [scope.strip() for scope in value.split(",") if scope.strip()]
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
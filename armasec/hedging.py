@@ -0,0 +1,173 @@
+"""
+This module provides a HedgedFetcher that races requests across mirror URLs of an OIDC provider.
+"""
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Optional, Tuple
+
+from armasec.exceptions import AuthenticationError
+from armasec.utilities import noop
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class LatencyStats:
+    """
+    Rolling latency statistics for a single mirror URL.
+    """
+
+    def __init__(self, window: int = 100):
+        """
+        Initializes the LatencyStats.
+
+        Args:
+            window: The number of most recent successful calls used to compute percentiles.
+        """
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.successes = 0
+        self.errors = 0
+        self.wins = 0
+
+    def record(self, elapsed: float):
+        """
+        Record the latency of a successful call.
+        """
+        self.successes += 1
+        self.samples.append(elapsed)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Compute a latency percentile from the rolling window. Returns None if there are no samples.
+
+        Args:
+            fraction: The percentile to compute as a fraction between 0 and 1.
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self) -> dict:
+        """
+        Summarize the statistics for reporting.
+        """
+        return dict(
+            successes=self.successes,
+            errors=self.errors,
+            wins=self.wins,
+            p50=self.percentile(0.5),
+            p95=self.percentile(0.95),
+        )
+
+
+class HedgedFetcher:
+    """
+    Fetch a resource from an ordered list of mirror URLs with hedged requests.
+
+    The first mirror is called immediately. If it has not answered within a delay derived from its
+    observed latency percentile, a request is fired at the next mirror, and so on. The first valid
+    response wins and the pending requests are cancelled. Requests that are already in flight are
+    abandoned and their results are only used to update the latency statistics.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        default_delay: float = 0.1,
+        min_samples: int = 5,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes a HedgedFetcher.
+
+        Args:
+            percentile:    The latency percentile of a mirror after which the next mirror is
+                           called, as a fraction between 0 and 1.
+            default_delay: The hedge delay in seconds to use until a mirror has enough samples.
+            min_samples:   The number of samples a mirror needs before its percentile is used.
+            debug_logger:  A callable, that if provided, will allow debug logging. Should be passed
+                           as a logger method like `logger.debug`
+        """
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.debug_logger = debug_logger if debug_logger else noop
+        self.stats: Dict[str, LatencyStats] = dict()
+
+    def hedge_delay(self, url: str) -> float:
+        """
+        Compute how long to wait for a mirror before firing a request at the next one.
+        """
+        stats = self.stats.get(url)
+        if stats is None or len(stats.samples) < self.min_samples:
+            return self.default_delay
+        return stats.percentile(self.percentile) or self.default_delay
+
+    def _timed_get(self, url: str, headers: Dict[str, str]) -> "httpx.Response":
+        # Deferred so that importing armasec does not import httpx
+        import httpx
+
+        stats = self.stats.setdefault(url, LatencyStats())
+        start = time.perf_counter()
+        try:
+            response = httpx.get(url, headers=headers)
+            # Any other answer, like a 404 from a misconfigured mirror, must not beat a good one
+            AuthenticationError.require_condition(
+                response.status_code in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED),
+                f"Got an unexpected status from url {url}: {response.status_code}",
+            )
+        except Exception:
+            stats.errors += 1
+            raise
+        stats.record(time.perf_counter() - start)
+        return response
+
+    def get(
+        self,
+        urls: List[str],
+        headers_for: Callable[[str], Dict[str, str]],
+    ) -> Tuple[str, "httpx.Response"]:
+        """
+        Fetch from the mirrors and return the winning url with its response.
+
+        Args:
+            urls:        The ordered list of mirror URLs serving the same resource.
+            headers_for: A callable that provides the request headers to send to a given url.
+        """
+        executor = ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix="armasec-hedge")
+        pending: Dict[Future, str] = dict()
+        remaining = list(urls)
+        errors: List[str] = list()
+        try:
+            while remaining or pending:
+                if remaining:
+                    url = remaining.pop(0)
+                    self.debug_logger(f"Firing hedged request at '{url}'")
+                    pending[executor.submit(self._timed_get, url, headers_for(url))] = url
+                    timeout: Optional[float] = self.hedge_delay(url) if remaining else None
+                else:
+                    timeout = None
+
+                (done, _) = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    if future.exception() is None:
+                        self.stats[url].wins += 1
+                        return (url, future.result())
+                    errors.append(f"{url}: {future.exception()}")
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        raise AuthenticationError(f"All mirrors failed: {'; '.join(errors)}")
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Summarize the latency statistics of each mirror for reporting.
+        """
+        return {url: stats.summary() for (url, stats) in self.stats.items()}
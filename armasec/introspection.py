@@ -0,0 +1,211 @@
+"""
+This module defines an IntrospectionClient that validates opaque tokens through an RFC 7662
+token introspection endpoint.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import Counter
+from functools import partial
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from buzz import DoExceptParams
+
+from armasec.exceptions import AuthenticationError
+from armasec.utilities import log_error, noop
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class IntrospectionClient:
+    """
+    Introspect opaque tokens, like Keycloak's reference tokens, that cannot be verified locally.
+
+    Introspection is a network round trip, so the responses are cached per token digest. An active
+    token's claims are cached until its `exp` or for `max_ttl` seconds, whichever comes first. An
+    inactive token is cached for `max_ttl` seconds so that replaying it does not reach the provider.
+    Concurrent lookups of the same token share a single call to the endpoint, and calls share a
+    pool of connections.
+
+    The claims of an active token are returned without the `active` member. If they have no
+    `permissions`, the space-delimited `scope` is used, and if they have no `sub`, the `client_id`
+    is used, as for tokens issued through the client credentials grant.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        client_id: Optional[str] = None,
+        client_secret: Optional[str] = None,
+        max_ttl: float = 60.0,
+        max_entries: int = 10000,
+        timeout: float = 5.0,
+        max_connections: int = 20,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the IntrospectionClient.
+
+        Args:
+            endpoint:        The URL of the introspection endpoint.
+            client_id:       Optional id of the client that authenticates with the endpoint.
+            client_secret:   Optional secret of the client that authenticates with the endpoint.
+            max_ttl:         The maximum number of seconds to cache an introspection response.
+            max_entries:     The maximum number of cached responses. When it is reached, expired
+                             responses are dropped first, then the oldest ones.
+            timeout:         The number of seconds to wait for the endpoint to answer.
+            max_connections: The maximum number of pooled connections to the endpoint.
+            debug_logger:    A callable, that if provided, will allow debug logging. Should be
+                             passed as a logger method like `logger.debug`
+        """
+        self.endpoint = endpoint
+        self.auth = (client_id, client_secret or "") if client_id else None
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.debug_logger = debug_logger if debug_logger else noop
+
+        self._entries: Dict[bytes, Tuple[float, Optional[Dict[str, Any]]]] = dict()
+        self._inflight: Dict[bytes, "asyncio.Task"] = dict()
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Counts "hits", "misses", "joins", "calls", "failures" and "evictions"
+        self.stats: Counter = Counter()
+
+    async def introspect(self, token: str) -> Dict[str, Any]:
+        """
+        Get the claims of an active token. Raise AuthenticationError if the token is not active or
+        the endpoint could not be called.
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        item = self._entries.get(key)
+        if item is not None and item[0] > time.time():
+            self.stats["hits"] += 1
+            claims = item[1]
+        else:
+            task = self._inflight.get(key)
+            if task is None:
+                self.stats["misses"] += 1
+                task = asyncio.ensure_future(self._fetch(key, token))
+                self._inflight[key] = task
+                task.add_done_callback(partial(self._settle, key))
+            else:
+                self.stats["joins"] += 1
+            # Shielded so that a cancelled request does not cancel the call for the others
+            claims = await asyncio.shield(task)
+
+        AuthenticationError.require_condition(claims is not None, "Token is not active")
+        assert claims is not None  # make static type analyzer happy
+        return dict(claims)
+
+    async def _fetch(self, key: bytes, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Call the introspection endpoint and cache its response.
+        """
+        self.stats["calls"] += 1
+        self.debug_logger(f"Introspecting token at {self.endpoint}")
+        with AuthenticationError.handle_errors(
+            f"Failed to introspect token at {self.endpoint}",
+            do_except=self._fail,
+        ):
+            response = await self._get_client().post(
+                self.endpoint,
+                data=dict(token=token, token_type_hint="access_token"),
+                auth=self.auth,  # type: ignore[arg-type]
+            )
+            response.raise_for_status()
+            data = response.json()
+            AuthenticationError.require_condition(
+                isinstance(data, dict), "The introspection response must be an object"
+            )
+
+        now = time.time()
+        expires_at = now + self.max_ttl
+        claims: Optional[Dict[str, Any]] = None
+        if data.get("active") is True:
+            claims = {name: value for (name, value) in data.items() if name != "active"}
+            if "permissions" not in claims:
+                claims["permissions"] = str(claims.get("scope", "")).split()
+            if "sub" not in claims and "client_id" in claims:
+                claims["sub"] = claims["client_id"]
+            exp = claims.get("exp")
+            if exp is not None:
+                expires_at = min(expires_at, float(exp))
+
+        if expires_at > now:
+            if len(self._entries) >= self.max_entries:
+                self._evict(now)
+            self._entries[key] = (expires_at, claims)
+        return claims
+
+    def _settle(self, key: bytes, task: "asyncio.Task"):
+        self._inflight.pop(key, None)
+
+    def _fail(self, dep: DoExceptParams):
+        self.stats["failures"] += 1
+        log_error(self.debug_logger, dep)
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        """
+        Get the pooled client for the running event loop, since a client cannot be shared across
+        event loops.
+        """
+        # Deferred so that importing armasec does not import httpx
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._client_loop = loop
+        return self._client
+
+    def _evict(self, now: float):
+        """
+        Drop the expired responses, or the oldest tenth of them if none have expired.
+        """
+        expired = [key for (key, (expires_at, _)) in self._entries.items() if expires_at <= now]
+        if not expired:
+            expired = list(islice(self._entries, max(1, self.max_entries // 10)))
+        for key in expired:
+            self._entries.pop(key, None)
+        self.stats["evictions"] += len(expired)
+
+    async def aclose(self):
+        """
+        Close the pooled connections.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+    def clear(self):
+        """
+        Drop every cached response.
+        """
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        """
+        Report the number of cached responses and the client's counters.
+        """
+        return dict(entries=len(self._entries), **self.stats)
+
+    def reset(self):
+        """
+        Drop the connections and lookups inherited from the parent process in a forked child.
+        """
+        self._client = None
+        self._client_loop = None
+        self._inflight = dict()
@@ -0,0 +1,108 @@
+"""
+This module defines a pure ASGI middleware that authenticates requests with a Verifier.
+"""
+
+import json
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Iterable, MutableMapping, Optional
+
+from armasec.utilities import noop
+from armasec.verifier import Verifier
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+WS_POLICY_VIOLATION = 1008
+
+
+class TokenAuthMiddleware:
+    """
+    An ASGI middleware that verifies the token of every HTTP request and WebSocket connection.
+
+    The Authorization header is read directly from the raw `scope["headers"]` and verified once.
+    The verified TokenPayload is attached to `scope["state"]["token_payload"]`, so it is available
+    as `request.state.token_payload` in Starlette, FastAPI, and Litestar, and as
+    `scope["state"]["token_payload"]` in a bare ASGI app. Requests that fail verification are
+    rejected before they reach the app.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        verifier: Verifier,
+        exempt_paths: Iterable[str] = (),
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the middleware.
+
+        Args:
+            app:          The ASGI app to protect.
+            verifier:     The Verifier used to check the token in the Authorization header.
+            exempt_paths: Paths that are passed through without authentication, like a health
+                          probe.
+            debug_logger: A callable, that if provided, will allow debug logging. Should be
+                          passed as a logger method like `logger.debug`
+        """
+        self.app = app
+        self.verifier = verifier
+        self.exempt_paths = frozenset(exempt_paths)
+        self.debug_logger = debug_logger if debug_logger else noop
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket") or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            token_payload = await self.verifier.verify_async(get_authorization(scope))
+        except Exception as err:
+            self.debug_logger(f"Rejecting {scope['type']} request: {err}")
+            await self.reject(scope, send, err)
+            return
+
+        scope.setdefault("state", {})["token_payload"] = token_payload
+        await self.app(scope, receive, send)
+
+    async def reject(self, scope: Scope, send: Send, err: Exception):
+        """
+        Reject a request that failed verification.
+
+        HTTP requests get a JSON error response with the status of the error. WebSocket connections
+        are closed before they are accepted with a policy violation code.
+        """
+        if scope["type"] == "websocket":
+            await send(dict(type="websocket.close", code=WS_POLICY_VIOLATION))
+            return
+
+        status_code = getattr(err, "status_code", HTTPStatus.UNAUTHORIZED)
+        detail = getattr(err, "detail", "Not authenticated")
+        body = json.dumps(dict(detail=detail)).encode("utf-8")
+        await send(
+            dict(
+                type="http.response.start",
+                status=int(status_code),
+                headers=[
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"www-authenticate", b"Bearer"),
+                ],
+            )
+        )
+        await send(dict(type="http.response.body", body=body))
+
+
+def get_authorization(scope: Scope) -> Optional[str]:
+    """
+    Find the value of the Authorization header in the raw headers of an ASGI scope.
+
+    ASGI servers lower-case header names, so the raw bytes can be compared directly.
+    """
+    headers: Iterable = scope.get("headers", ())
+    for name, value in headers:
+        if name == b"authorization":
+            return value.decode("latin-1")
+    return None
@@ -3,17 +3,23 @@ This module provides the OpenidConfigLoader which is used to load openid-configu
 OIDC provider.
 """
 
+import time
+from collections import Counter
 from functools import partial
-from typing import Callable, Optional
-
-import httpx
-import starlette
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
+from armasec.circuit_breaker import CircuitBreaker
 from armasec.exceptions import AuthenticationError
+from armasec.hedging import HedgedFetcher
 from armasec.schemas.jwks import JWKs
 from armasec.schemas.openid_config import OpenidConfig
+from armasec.shared_store import SharedJwksStore
 from armasec.utilities import log_error, noop
 
+if TYPE_CHECKING:
+    import httpx
+
 
 class OpenidConfigLoader:
     _config: Optional[OpenidConfig] = None
@@ -24,21 +30,65 @@ class OpenidConfigLoader:
         domain: str,
         use_https: bool = True,
         debug_logger: Optional[Callable[..., None]] = None,
+        refresh_interval: Optional[float] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        max_staleness: Optional[float] = None,
+        mirrors: Optional[List[str]] = None,
+        jwks_uri_mirrors: Optional[List[str]] = None,
+        hedged_fetcher: Optional[HedgedFetcher] = None,
+        shared_store: Optional[SharedJwksStore] = None,
     ):
         """
         Initializes a base TokenManager.
 
         Args:
-            secret:        The secret key needed to decode a token
-            domain:        The domain of the OIDC provider. This is to construct the
-                           openid-configuration url
-            use_https:     If falsey, use ``http`` instead of ``https`` (the default).
-            debug_logger:  A callable, that if provided, will allow debug logging. Should be passed
-                           as a logger method like `logger.debug`
+            secret:           The secret key needed to decode a token
+            domain:           The domain of the OIDC provider. This is to construct the
+                              openid-configuration url
+            use_https:        If falsey, use ``http`` instead of ``https`` (the default).
+            debug_logger:     A callable, that if provided, will allow debug logging. Should be
+                              passed as a logger method like `logger.debug`
+            refresh_interval: Optional number of seconds after which the loaded resources should
+                              be revalidated against the OIDC provider. If not provided, the
+                              resources are loaded once and never refreshed.
+            circuit_breaker:  Optional CircuitBreaker that guards calls to the OIDC provider.
+            max_staleness:    Optional number of seconds that the last good jwks may be served
+                              after they could not be revalidated. If not provided, the last good
+                              jwks are served until a refresh succeeds.
+            mirrors:          Optional list of alternate domains that serve the openid
+                              configuration for the same issuer.
+            jwks_uri_mirrors: Optional list of alternate URIs that serve the same jwks.
+            hedged_fetcher:   The HedgedFetcher used when mirrors are available. One is created if
+                              not provided.
+            shared_store:     Optional SharedJwksStore used to share the loaded resources with the
+                              other worker processes on the host. Entries are only loaded from it
+                              while they are younger than the refresh interval, or the maximum
+                              staleness if there is none. Otherwise, the provider is called.
         """
         self.domain = domain
         self.use_https = use_https
         self.debug_logger = debug_logger if debug_logger else noop
+        self.refresh_interval = refresh_interval
+        self.circuit_breaker = circuit_breaker
+        self.max_staleness = max_staleness
+        self.mirrors = mirrors if mirrors else list()
+        self.jwks_uri_mirrors = jwks_uri_mirrors if jwks_uri_mirrors else list()
+        self.hedged_fetcher = (
+            hedged_fetcher if hedged_fetcher else HedgedFetcher(debug_logger=self.debug_logger)
+        )
+
+        # Counts revalidation responses by status code (200 for changed, 304 for not modified)
+        self.refresh_counts: Counter = Counter()
+
+        self.shared_store = shared_store
+        self._store_generation: Optional[int] = None
+
+        self._validators: Dict[str, Dict[str, str]] = dict()
+        self._last_refresh = time.monotonic()
+        self._jwks_validated_at: Optional[float] = None
+
+        # Set while the last good jwks are served because a refresh failed
+        self.serving_stale = False
 
     @staticmethod
     def build_openid_config_url(domain: str, use_https: bool = True):
@@ -52,38 +102,119 @@ class OpenidConfigLoader:
         protocol = "https" if use_https else "http"
         return f"{protocol}://{domain}/.well-known/openid-configuration"
 
-    def _load_openid_resource(self, url: str):
+    def _load_openid_resource(
+        self,
+        url: str,
+        conditional: bool = False,
+        mirror_urls: Optional[List[str]] = None,
+    ) -> Optional[Any]:
         """
         Helper method to load data from an openid connect resource.
+
+        The `ETag` and `Last-Modified` validators from successful responses are stored so that
+        later conditional requests can be answered with a `304 Not Modified`.
+
+        Args:
+            url:         The url of the resource to load.
+            conditional: If truthy, send the stored validators for the url and return `None` if
+                         the provider reports that the resource has not been modified.
+            mirror_urls: Optional alternate urls for the same resource. If provided, hedged
+                         requests are made across the url and its mirrors.
         """
         self.debug_logger(f"Attempting to fetch from openid resource '{url}'")
-        with AuthenticationError.handle_errors(
-            f"Call to url {url} failed",
-            do_except=partial(log_error, self.debug_logger),
-        ):
-            response = httpx.get(url)
+
+        def headers_for(url: str) -> Dict[str, str]:
+            return self._validators.get(url, dict()) if conditional else dict()
+
+        if self.circuit_breaker is None:
+            (url, response) = self._get(url, headers_for, mirror_urls)
+        else:
+            AuthenticationError.require_condition(
+                self.circuit_breaker.allow_request(),
+                f"Circuit breaker is open for domain {self.domain}",
+            )
+            try:
+                (url, response) = self._get(url, headers_for, mirror_urls)
+                AuthenticationError.require_condition(
+                    response.status_code < HTTPStatus.INTERNAL_SERVER_ERROR,
+                    f"Got a server error from url {url}: {response.status_code}",
+                )
+            except AuthenticationError:
+                self.circuit_breaker.record_failure()
+                raise
+            self.circuit_breaker.record_success()
+
+        if conditional:
+            self.refresh_counts[response.status_code] += 1
+            if response.status_code == HTTPStatus.NOT_MODIFIED:
+                self.debug_logger(f"Resource at '{url}' was not modified")
+                return None
+
         AuthenticationError.require_condition(
-            response.status_code == starlette.status.HTTP_200_OK,
+            response.status_code == HTTPStatus.OK,
             f"Didn't get a success status code from url {url}: {response.status_code}",
         )
+
+        validators = dict()
+        if "etag" in response.headers:
+            validators["If-None-Match"] = response.headers["etag"]
+        if "last-modified" in response.headers:
+            validators["If-Modified-Since"] = response.headers["last-modified"]
+        self._validators[url] = validators
+
         return response.json()
 
+    def _get(
+        self,
+        url: str,
+        headers_for: Callable[[str], Dict[str, str]],
+        mirror_urls: Optional[List[str]] = None,
+    ) -> Tuple[str, "httpx.Response"]:
+        # Deferred so that importing armasec does not import httpx
+        import httpx
+
+        with AuthenticationError.handle_errors(
+            f"Call to url {url} failed",
+            do_except=partial(log_error, self.debug_logger),
+        ):
+            if mirror_urls:
+                return self.hedged_fetcher.get([url, *mirror_urls], headers_for)
+            return (url, httpx.get(url, headers=headers_for(url)))
+
+    def _parse_config(self, data: Any) -> OpenidConfig:
+        with AuthenticationError.handle_errors(
+            "openid config data was invalid",
+            do_except=partial(log_error, self.debug_logger),
+        ):
+            return OpenidConfig(**data)
+
+    def _parse_jwks(self, data: Any) -> JWKs:
+        with AuthenticationError.handle_errors(
+            "jwks data was invalid",
+            do_except=partial(log_error, self.debug_logger),
+        ):
+            return JWKs(**data)
+
+    @property
+    def _config_mirror_urls(self) -> List[str]:
+        return [self.build_openid_config_url(mirror, self.use_https) for mirror in self.mirrors]
+
     @property
     def config(self) -> OpenidConfig:
         """
         Retrive the openid config from an OIDC provider. Lazy loads the config so that API calls are
         deferred until the coniguration is needed.
         """
+        if not self._config and self._load_from_store():
+            self.debug_logger("Loaded openid configuration from shared store")
+
         if not self._config:
             self.debug_logger("Fetching openid configration")
             data = self._load_openid_resource(
-                self.build_openid_config_url(self.domain, self.use_https)
+                self.build_openid_config_url(self.domain, self.use_https),
+                mirror_urls=self._config_mirror_urls,
             )
-            with AuthenticationError.handle_errors(
-                "openid config data was invalid",
-                do_except=partial(log_error, self.debug_logger),
-            ):
-                self._config = OpenidConfig(**data)
+            self._config = self._parse_config(data)
 
         return self._config
 
@@ -93,13 +224,227 @@ class OpenidConfigLoader:
         Retrives JWKs public keys from an OIDC provider. Lazy loads the jwks so that API calls are
         deferred until the jwks are needed.
         """
+        if not self._jwks and self._load_from_store():
+            self.debug_logger("Loaded jwks from shared store")
+
         if not self._jwks:
             self.debug_logger("Fetching jwks")
-            data = self._load_openid_resource(str(self.config.jwks_uri))
-            with AuthenticationError.handle_errors(
-                "jwks data was invalid",
-                do_except=partial(log_error, self.debug_logger),
-            ):
-                self._jwks = JWKs(**data)
+            data = self._load_openid_resource(
+                str(self.config.jwks_uri),
+                mirror_urls=self.jwks_uri_mirrors,
+            )
+            self._jwks = self._parse_jwks(data)
+            self._jwks_validated_at = time.monotonic()
+            self._publish_to_store()
 
         return self._jwks
+
+    @property
+    def jwks_age(self) -> Optional[float]:
+        """
+        The number of seconds since the served jwks were last validated with the OIDC provider.
+        """
+        if self._jwks_validated_at is None:
+            return None
+        return time.monotonic() - self._jwks_validated_at
+
+    @property
+    def jwks_expired(self) -> bool:
+        """
+        Indicate if stale jwks are being served and have exceeded the maximum staleness.
+        """
+        if not self.serving_stale or self.max_staleness is None:
+            return False
+        age = self.jwks_age
+        return age is not None and age > self.max_staleness
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Report the state of the loader for use in a health probe.
+        """
+        breaker_state = self.circuit_breaker.state.value if self.circuit_breaker else None
+        return dict(
+            domain=self.domain,
+            breaker_state=breaker_state,
+            jwks_age=self.jwks_age,
+            serving_stale=self.serving_stale,
+            jwks_expired=self.jwks_expired,
+            refresh_counts=dict(self.refresh_counts),
+            mirrors=self.hedged_fetcher.summary(),
+        )
+
+    def after_fork(self):
+        """
+        Reset the process-local state that must not be shared with a forked child.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.after_fork()
+
+    @property
+    def refresh_due(self) -> bool:
+        """
+        Indicate if the refresh interval has elapsed since the resources were last revalidated.
+        """
+        if self.refresh_interval is None:
+            return False
+        return time.monotonic() - self._last_refresh >= self.refresh_interval
+
+    def refresh(self) -> bool:
+        """
+        Revalidate the openid config and jwks against the OIDC provider.
+
+        Conditional requests are used so that unchanged resources are answered with a
+        `304 Not Modified` and are neither re-downloaded nor re-parsed. Returns `True` only if a
+        new set of jwks was loaded.
+
+        If the provider cannot be reached, the last good jwks continue to be served until they
+        exceed the maximum staleness. After that, the failure is raised.
+        """
+        self.debug_logger("Revalidating openid configuration and jwks")
+        self._last_refresh = time.monotonic()
+
+        if self.shared_store is None:
+            return self._refresh_from_provider()
+
+        entry = self._read_store()
+        if entry is not None and time.time() - entry["updated_at"] < (self.refresh_interval or 0):
+            self.debug_logger("Another worker refreshed recently. Using the shared store")
+            return self._adopt_store_entry(entry)
+
+        try:
+            acquired = self.shared_store.try_acquire_refresh()
+        except OSError as err:
+            self.debug_logger(f"Shared store is unavailable: {err}")
+            return self._refresh_from_provider()
+
+        if not acquired:
+            self.debug_logger("Another worker is refreshing. Using the loaded resources")
+            return False
+
+        try:
+            changed = self._refresh_from_provider()
+            if not self.serving_stale:
+                self._publish_to_store()
+            return changed
+        finally:
+            self.shared_store.release_refresh()
+
+    def sync_from_store(self) -> bool:
+        """
+        Adopt the resources published by another worker if the shared store has changed.
+
+        The check costs a single read of the store's generation counter, so it is cheap enough to
+        be made on every request. Returns `True` only if a new set of jwks was adopted.
+        """
+        if self.shared_store is None or self._jwks is None:
+            return False
+        try:
+            if self.shared_store.generation == self._store_generation:
+                return False
+        except (OSError, ValueError):
+            return False
+
+        entry = self._read_store()
+        if entry is None:
+            return False
+        return self._adopt_store_entry(entry)
+
+    def _refresh_from_provider(self) -> bool:
+        try:
+            changed = self._revalidate()
+        except AuthenticationError:
+            self.serving_stale = self._jwks is not None
+            if self._jwks is None or self.jwks_expired:
+                raise
+            self.debug_logger(f"Serving stale jwks for domain {self.domain} ({self.jwks_age}s)")
+            return False
+
+        self.serving_stale = False
+        return changed
+
+    def _read_store(self) -> Optional[Dict[str, Any]]:
+        if self.shared_store is None:
+            return None
+        try:
+            self._store_generation = self.shared_store.generation
+            return self.shared_store.get(self.domain)
+        except (OSError, ValueError) as err:
+            self.debug_logger(f"Shared store is unavailable: {err}")
+            return None
+
+    def _load_from_store(self) -> bool:
+        max_age = self.refresh_interval if self.refresh_interval is not None else self.max_staleness
+        if max_age is None:
+            return False
+        entry = self._read_store()
+        if entry is None:
+            return False
+        age = time.time() - entry["updated_at"]
+        if age >= max_age:
+            self.debug_logger(f"Ignoring shared store entry for domain {self.domain} ({age}s old)")
+            return False
+        try:
+            self._adopt_store_entry(entry)
+        except AuthenticationError:
+            return False
+        return True
+
+    def _adopt_store_entry(self, entry: Dict[str, Any]) -> bool:
+        config = self._parse_config(entry["config"])
+        jwks = self._parse_jwks(entry["jwks"])
+        self._validators.update(entry["validators"])
+        self._jwks_validated_at = time.monotonic() - max(0.0, time.time() - entry["updated_at"])
+        self.serving_stale = False
+
+        self._config = config
+        if jwks == self._jwks:
+            return False
+        self._jwks = jwks
+        return True
+
+    def _publish_to_store(self):
+        if self.shared_store is None or self._config is None or self._jwks is None:
+            return
+        try:
+            self.shared_store.put(
+                self.domain,
+                dict(
+                    config=self._config.model_dump(mode="json"),
+                    jwks=self._jwks.model_dump(mode="json"),
+                    validators=self._validators,
+                    updated_at=time.time(),
+                ),
+            )
+            self._store_generation = self.shared_store.generation
+        except (OSError, ValueError) as err:
+            self.debug_logger(f"Failed to publish to shared store: {err}")
+
+    def _revalidate(self) -> bool:
+        if self._config is not None:
+            data = self._load_openid_resource(
+                self.build_openid_config_url(self.domain, self.use_https),
+                conditional=True,
+                mirror_urls=self._config_mirror_urls,
+            )
+            if data is not None:
+                self._config = self._parse_config(data)
+
+        if self._jwks is None:
+            self.jwks
+            return True
+
+        data = self._load_openid_resource(
+            str(self.config.jwks_uri),
+            conditional=True,
+            mirror_urls=self.jwks_uri_mirrors,
+        )
+        self._jwks_validated_at = time.monotonic()
+        if data is None:
+            return False
+
+        jwks = self._parse_jwks(data)
+        if jwks == self._jwks:
+            return False
+
+        self._jwks = jwks
+        return True
@@ -0,0 +1,168 @@
+"""
+This module defines declarative permission extractors compiled from claim paths.
+
+A path names a claim in a decoded token with its keys separated by dots, like
+`resource_access.{azp}.roles`. The permissions found at every path are merged in order, and
+duplicates are dropped. A path may use:
+
+- `{claim}` in a key, which is replaced with the value of a top-level claim, like `{azp}`
+- `*` as a key, which matches every key of an object, like `resource_access.*.roles`
+- double quotes around a key that contains dots, like `"https://my.app/roles"`
+- a `|split` suffix, which splits a string claim on whitespace, like `scope|split`
+
+Paths that are missing from a token are skipped.
+"""
+
+import re
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+
+from armasec.exceptions import ArmasecError
+
+KEYCLOAK_PERMISSION_PATHS = ("realm_access.roles", "resource_access.{azp}.roles")
+AUTH0_PERMISSION_PATHS = ("permissions", "scope|split")
+
+WILDCARD = "*"
+
+KEY_PATTERN = re.compile(r'\s*(?:"([^"]*)"|([^."]+?))\s*(?:\.|$)')
+CLAIM_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+class ClaimPath:
+    """
+    A single compiled claim path.
+    """
+
+    def __init__(self, spec: str):
+        """
+        Initializes the ClaimPath. Raises ArmasecError if the spec is malformed.
+
+        Args:
+            spec: The path, like `resource_access.{azp}.roles` or `scope|split`.
+        """
+        self.spec = spec
+        (path, _, operation) = spec.partition("|")
+        ArmasecError.require_condition(
+            operation.strip() in ("", "split"),
+            f"Unknown operation {operation.strip()!r} in permission path: {spec}",
+        )
+        self.split = operation.strip() == "split"
+
+        self.keys: List[str] = []
+        position = 0
+        path = path.strip()
+        while position < len(path):
+            match = KEY_PATTERN.match(path, position)
+            ArmasecError.require_condition(
+                match is not None and match.end() > position,
+                f"Malformed permission path at {position}: {spec}",
+            )
+            assert match is not None  # make static type analyzer happy
+            (quoted, bare) = match.groups()
+            self.keys.append(quoted if quoted is not None else bare)
+            position = match.end()
+        ArmasecError.require_condition(self.keys, f"Empty permission path: {spec}")
+
+        # Keys without placeholders or wildcards are looked up directly
+        self._steps: List[Tuple[str, Any]] = [
+            ("each", None)
+            if key == WILDCARD
+            else ("template", key)
+            if CLAIM_PATTERN.search(key)
+            else ("key", key)
+            for key in self.keys
+        ]
+
+    def find(self, claims: Dict[str, Any]) -> List[Any]:
+        """
+        Collect the raw values found at the path in a decoded token.
+        """
+        nodes: List[Any] = [claims]
+        for kind, key in self._steps:
+            if kind == "template":
+                key = CLAIM_PATTERN.sub(lambda match: str(claims.get(match[1])), key)
+            found: List[Any] = []
+            for node in nodes:
+                if not isinstance(node, dict):
+                    continue
+                if kind == "each":
+                    found.extend(node.values())
+                    continue
+                value = node.get(key)
+                if value is not None:
+                    found.append(value)
+            nodes = found
+        return nodes
+
+    def __repr__(self) -> str:
+        return f"ClaimPath({self.spec!r})"
+
+
+class PermissionPaths:
+    """
+    A permission extractor compiled from claim paths, for use as the `permission_extractor` of a
+    DomainConfig or a TokenDecoder.
+
+    The merged permissions are memoized per distinct set of raw claim values, so tokens that carry
+    the same roles for the same client only merge and split them once.
+    """
+
+    def __init__(self, paths: Iterable[str], max_entries: int = 1024):
+        """
+        Initializes the PermissionPaths and compiles each path.
+
+        Args:
+            paths:       The claim paths to collect permissions from, in order.
+            max_entries: The maximum number of memoized extractions. If 0, nothing is memoized.
+        """
+        self.paths = [ClaimPath(spec) for spec in paths]
+        self.max_entries = max_entries
+        self._memo: OrderedDict[Hashable, Tuple[str, ...]] = OrderedDict()
+
+    def __call__(self, decoded_token: Dict[str, Any]) -> List[str]:
+        """
+        Extract the permissions from a decoded token.
+        """
+        raw = tuple(_freeze(path.find(decoded_token), path.spec) for path in self.paths)
+        permissions = self._memo.get(raw) if self.max_entries else None
+        if permissions is None:
+            permissions = self._merge(raw)
+            if self.max_entries:
+                self._memo[raw] = permissions
+                if len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+        return list(permissions)
+
+    def _merge(self, raw: Tuple[Tuple[Any, ...], ...]) -> Tuple[str, ...]:
+        groups: List[Iterable[str]] = []
+        for path, values in zip(self.paths, raw):
+            for value in values:
+                if isinstance(value, str):
+                    groups.append(value.split() if path.split else (value,))
+                elif path.split:
+                    groups.append(chain.from_iterable(item.split() for item in value))
+                else:
+                    groups.append(value)
+        # dict.fromkeys drops duplicates while keeping the first-seen order
+        return tuple(dict.fromkeys(chain.from_iterable(groups)))
+
+    def __repr__(self) -> str:
+        return f"PermissionPaths({[path.spec for path in self.paths]!r})"
+
+
+def _freeze(values: List[Any], spec: str) -> Tuple[Any, ...]:
+    """
+    Make the raw values found at a path hashable. Only strings and lists are accepted.
+    """
+    frozen: List[Any] = []
+    for value in values:
+        if isinstance(value, list):
+            frozen.append(tuple(value))
+        else:
+            ArmasecError.require_condition(
+                isinstance(value, str),
+                f"Permission path {spec} holds a {type(value).__name__}, not a string or list",
+            )
+            frozen.append(value)
+    return tuple(frozen)
@@ -0,0 +1,138 @@
+"""
+This module defines an app-wide registry that interns permissions to bit positions.
+
+Once the permissions used by routes and queries are interned, a set of permissions can be encoded
+as an integer bitmask. Checking that a token has all or some of a set of permissions then costs a
+single integer operation instead of building and comparing sets.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+ONE = ord("1")
+
+
+class PermissionRegistry:
+    """
+    Interns permission strings to bit positions.
+
+    Permissions are interned when a route policy is compiled or a permission is queried, and their
+    bits never change afterwards. Permissions that were never interned are left out of the masks,
+    which is safe because no policy or query can ask for them. Each time a permission is interned,
+    the `version` of the registry changes so that masks built earlier can be rebuilt.
+
+    Attributes:
+        bits:  The bit of each interned permission.
+        names: The interned permissions by bit position.
+    """
+
+    bits: Dict[str, int]
+    names: List[str]
+    _slots: Dict[str, int]
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        Initializes the PermissionRegistry.
+
+        Args:
+            max_entries: The maximum number of memoized compiled masks. If 0, nothing is memoized.
+        """
+        self.bits = dict()
+        self.names = []
+        self.max_entries = max_entries
+        self._compiled: OrderedDict[Tuple[str, ...], int] = OrderedDict()
+
+        # One-based bit positions, so that unknown permissions can be filtered out as falsy
+        self._slots = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        """
+        The number of interned permissions. Changes whenever a permission is interned.
+        """
+        return len(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, permission: object) -> bool:
+        return permission in self.bits
+
+    def intern(self, permission: str) -> int:
+        """
+        Get the bit of a permission, assigning the next free bit position if it is new.
+        """
+        bit = self.bits.get(permission)
+        if bit is not None:
+            return bit
+        with self._lock:
+            bit = self.bits.get(permission)
+            if bit is None:
+                bit = 1 << len(self.names)
+                self.names.append(permission)
+                self._slots[permission] = len(self.names)
+                self.bits[permission] = bit
+        return bit
+
+    def compile(self, permissions: Tuple[str, ...]) -> int:
+        """
+        Intern a group of permissions and get their combined mask. Memoized, since the bits of
+        interned permissions never change.
+        """
+        mask = self._compiled.get(permissions)
+        if mask is not None:
+            return mask
+
+        mask = 0
+        for permission in permissions:
+            mask |= self.intern(permission)
+        if self.max_entries:
+            with self._lock:
+                self._compiled[permissions] = mask
+                if len(self._compiled) > self.max_entries:
+                    self._compiled.popitem(last=False)
+        return mask
+
+    def mask(self, permissions: Iterable[str]) -> int:
+        """
+        Encode permissions as a mask without interning them. Permissions that have not been
+        interned are left out.
+        """
+        if not isinstance(permissions, (list, tuple)):
+            permissions = list(permissions)
+
+        # Writing digits is much cheaper than or-ing each bit into a growing integer
+        digits = bytearray(b"0") * (len(self.names) + 1)
+        try:
+            for slot in filter(None, map(self._slots.get, permissions)):
+                digits[slot] = ONE
+        except IndexError:
+            # A permission was interned by another thread while encoding
+            return self.mask(permissions)
+        digits.reverse()
+        return int(digits, 2) >> 1
+
+    def decode(self, mask: int) -> List[str]:
+        """
+        Get the permissions whose bits are set in a mask.
+        """
+        names = self.names
+        digits = bin(mask)[:1:-1]
+        permissions = []
+        position = digits.find("1")
+        while position != -1:
+            permissions.append(names[position])
+            position = digits.find("1", position + 1)
+        return permissions
+
+    def reset(self):
+        """
+        Reset the lock inherited from the parent process in a forked child.
+        """
+        self._lock = threading.Lock()
+
+
+# The registry shared by every route policy and token payload in the process
+permission_registry = PermissionRegistry()
@@ -0,0 +1,152 @@
+"""
+This module defines how the permissions in a token are checked against the scopes of an endpoint.
+"""
+
+from typing import Any, Callable, Iterable, Mapping, Optional, Tuple
+
+from auto_name_enum import AutoNameEnum, auto
+from snick import unwrap
+
+from armasec.exceptions import AuthorizationError
+from armasec.token_payload import TokenPayload
+from armasec.utilities import noop
+
+MATCH_KEYS_MESSAGE = "Not authorized: token doesn't contain necessary key-value pairs"
+
+
+class PermissionMode(AutoNameEnum):
+    """
+    Endpoint permissions.
+
+    Attributes:
+        ALL:  Require all listed permissions.
+        SOME: Require at least one of the listed permissions.
+    """
+
+    ALL = auto()
+    SOME = auto()
+
+
+def check_permissions(
+    permissions: Iterable[str],
+    scopes: Iterable[str],
+    permission_mode: PermissionMode = PermissionMode.ALL,
+    debug_logger: Optional[Callable[..., None]] = None,
+):
+    """
+    Check the permissions of a token against required scopes. Raise AuthorizationError if the
+    check fails.
+
+    Args:
+        permissions:     The permissions extracted from the token.
+        scopes:          The scopes required by the endpoint.
+        permission_mode: The PermissionMode to apply.
+        debug_logger:    A callable, that if provided, will allow debug logging. Should be passed
+                         as a logger method like `logger.debug`
+    """
+    token_permissions = set(permissions)
+    my_permissions = set(scopes)
+
+    # Messages are only built when they are used so that passing checks stay cheap
+    if debug_logger and debug_logger is not noop:
+        debug_logger(
+            unwrap(
+                f"""
+                Checking my permissions {my_permissions} against token_permissions
+                {token_permissions} using PermissionMode {permission_mode}
+                """
+            )
+        )
+    if permission_mode == PermissionMode.ALL:
+        if my_permissions <= token_permissions:
+            return
+        raise AuthorizationError(
+            unwrap(
+                f"""
+                Token permissions {token_permissions} missing some required permissions
+                {my_permissions - token_permissions}
+                """
+            )
+        )
+    elif permission_mode == PermissionMode.SOME:
+        if token_permissions & my_permissions:
+            return
+        raise AuthorizationError(
+            unwrap(
+                f"""
+                Token permissions {token_permissions} missing at least
+                one required permissions
+                {my_permissions}
+                """
+            )
+        )
+    else:
+        raise AuthorizationError(f"Unknown permission_mode: {permission_mode}")
+
+
+def check_match_keys(token_payload: TokenPayload, match_keys: Mapping[str, Any]):
+    """
+    Check that a token payload contains the required key-value pairs. Raise AuthorizationError if
+    the check fails.
+
+    Booleans must match by identity and scalars by equality. For collections, the claim must
+    share at least one item with the collection.
+
+    Args:
+        token_payload: The verified payload of the token.
+        match_keys:    The key-value pairs to match in the payload.
+    """
+    message = MATCH_KEYS_MESSAGE
+    for key_to_match, value_to_match in match_keys.items():
+        if isinstance(value_to_match, bool):
+            AuthorizationError.require_condition(
+                getattr(token_payload, key_to_match) is value_to_match, message
+            )
+        elif isinstance(value_to_match, (str, int, float)):
+            AuthorizationError.require_condition(
+                getattr(token_payload, key_to_match) == value_to_match,
+                message,
+            )
+        else:
+            AuthorizationError.require_condition(
+                set(getattr(token_payload, key_to_match)) & set(value_to_match),
+                message,
+            )
+
+
+def compile_match_keys(
+    match_keys: Mapping[str, Any],
+) -> Optional[Callable[[TokenPayload], bool]]:
+    """
+    Compile `match_keys` into a predicate over a token payload with the same semantics as
+    `check_match_keys()`. The type of each value is only inspected once and collections are frozen
+    up front. Returns None if there are no keys to match.
+
+    Args:
+        match_keys: The key-value pairs to match in the payload.
+    """
+    checks = [_compile_match_key(key, value) for (key, value) in match_keys.items()]
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    return lambda payload: all(check(payload) for check in checks)
+
+
+def _compile_match_key(key: str, value: Any) -> Callable[[TokenPayload], bool]:
+    if isinstance(value, bool):
+        return lambda payload: getattr(payload, key) is value
+    if isinstance(value, (str, int, float)):
+        return lambda payload: getattr(payload, key) == value
+    values = frozenset(value)
+    return lambda payload: not values.isdisjoint(getattr(payload, key))
+
+
+def freeze_match_keys(match_keys: Mapping[str, Any]) -> Tuple[Tuple[str, Any], ...]:
+    """
+    Convert match_keys into a hashable value that is equal for equal match_keys.
+    """
+    return tuple(
+        (key, frozenset(value) if isinstance(value, (list, set, dict)) else value)
+        for (key, value) in sorted(match_keys.items())
+    )
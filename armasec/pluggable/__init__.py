@@ -1,11 +1,46 @@
 """
 Manage plugins from armasec.
+
+Installed plugins are discovered on the first plugin check rather than on import. Exports other
+than the plugin manager and the `hookimpl` marker are loaded lazily so that plugins can import
+`hookimpl` cheaply.
 """
 
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
 import pluggy
 from armasec.pluggable import hookspecs
 
+if TYPE_CHECKING:
+    from armasec.pluggable.discovery import load_plugins
+    from armasec.pluggable.result_cache import PluginResultCache, route_path
+    from armasec.pluggable.runner import PluginRunner
+
 hookimpl = pluggy.HookimplMarker("armasec")
 plugin_manager = pluggy.PluginManager("armasec")
 plugin_manager.add_hookspecs(hookspecs)
-plugin_manager.load_setuptools_entrypoints("armasec")
+
+_exports = {
+    "PluginResultCache": "armasec.pluggable.result_cache",
+    "PluginRunner": "armasec.pluggable.runner",
+    "load_plugins": "armasec.pluggable.discovery",
+    "route_path": "armasec.pluggable.result_cache",
+}
+
+__all__ = [
+    "PluginResultCache",
+    "PluginRunner",
+    "hookimpl",
+    "load_plugins",
+    "plugin_manager",
+    "route_path",
+]
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,120 @@
+"""
+Discover the plugins installed under the `armasec` entrypoint group.
+
+Discovery is deferred until the first plugin check, or until `load_plugins()` is called
+explicitly, so that importing armasec does not scan the metadata of every installed distribution.
+The result of the scan is cached on disk and reused until the installed distributions change.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from importlib.metadata import EntryPoint, entry_points
+from typing import List, Optional, Tuple
+
+from armasec.pluggable import plugin_manager
+
+ENTRYPOINT_GROUP = "armasec"
+
+# The cache path to use when none is supplied. An empty value disables the on-disk cache.
+CACHE_PATH_ENV = "ARMASEC_ENTRYPOINT_CACHE"
+
+loaded = False
+_load_lock = threading.Lock()
+
+
+def default_cache_path() -> Optional[str]:
+    """
+    Get the path of the on-disk entrypoint cache for the running environment.
+
+    Uses the `ARMASEC_ENTRYPOINT_CACHE` environment variable if it is set. Otherwise, the cache is
+    kept in the user's cache directory with one file per environment.
+    """
+    cache_path = os.environ.get(CACHE_PATH_ENV)
+    if cache_path is not None:
+        return cache_path or None
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    environment = hashlib.sha1(sys.prefix.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, "armasec", f"entrypoints-{environment}.json")
+
+
+def path_fingerprint() -> str:
+    """
+    Fingerprint the import path by the modification times of its entries.
+
+    Installing, upgrading, or removing a distribution adds or removes its metadata directory, which
+    changes the modification time of the directory that holds it.
+    """
+    digest = hashlib.sha1()
+    for entry in sys.path:
+        try:
+            mtime = os.stat(entry or ".").st_mtime_ns
+        except OSError:
+            continue
+        digest.update(f"{entry}\0{mtime}\0".encode("utf-8", errors="replace"))
+    return digest.hexdigest()
+
+
+def scan_entrypoints(cache_path: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    List the `(name, value)` of each entrypoint in the `armasec` group.
+
+    Args:
+        cache_path: The path of a JSON file that caches the scan. The cached scan is used if the
+                    import path has not changed since it was written. If None, always scan.
+    """
+    fingerprint = path_fingerprint() if cache_path else None
+    if cache_path:
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if cached["fingerprint"] == fingerprint:
+                return [(name, value) for (name, value) in cached["entrypoints"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    scanned = sorted(
+        {(entrypoint.name, entrypoint.value) for entrypoint in entry_points(group=ENTRYPOINT_GROUP)}
+    )
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as cache_file:
+                json.dump(dict(fingerprint=fingerprint, entrypoints=scanned), cache_file)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+    return scanned
+
+
+def load_plugins(cache_path: Optional[str] = None) -> List[str]:
+    """
+    Register the plugins installed under the `armasec` entrypoint group with the plugin manager.
+
+    Only the first call loads the plugins. It is called before the first plugin check, but may be
+    called explicitly at startup, for example before forking workers. Returns the names of the
+    plugins that were registered.
+
+    Args:
+        cache_path: The path of the on-disk entrypoint cache. Defaults to `default_cache_path()`.
+    """
+    global loaded
+    registered: List[str] = []
+    if loaded:
+        return registered
+
+    with _load_lock:
+        if loaded:
+            return registered
+        for name, value in scan_entrypoints(cache_path or default_cache_path()):
+            if plugin_manager.get_plugin(name) is not None or plugin_manager.is_blocked(name):
+                continue
+            plugin = EntryPoint(name=name, value=value, group=ENTRYPOINT_GROUP).load()
+            plugin_manager.register(plugin, name=name)
+            registered.append(name)
+        loaded = True
+    return registered
@@ -2,20 +2,22 @@
 Hook specification module for armasec plugins.
 """
 
-from typing import Callable
+from typing import TYPE_CHECKING, Callable
 
 import pluggy
-from starlette.requests import Request
 
-from armasec.token_payload import TokenPayload
+if TYPE_CHECKING:
+    from starlette.requests import HTTPConnection
+
+    from armasec.token_payload import TokenPayload
 
 hookspec = pluggy.HookspecMarker("armasec")
 
 
 @hookspec
 def armasec_plugin_check(
-    request: Request,
-    token_payload: TokenPayload,
+    request: "HTTPConnection",
+    token_payload: "TokenPayload",
     debug_logger: Callable[..., None],
 ) -> None:
     """
@@ -24,9 +26,36 @@ def armasec_plugin_check(
     If the check fails, it should raise a ArmasecError or a subclass thereof.
 
     Args:
-        request:       The original request made to the secured endpoint. Will be passed
-                       to the plugin method if the implementation includes it as a
-                       keyword argument.
+        request:       The original request or websocket made to the secured endpoint.
+                       Will be passed to the plugin method if the implementation
+                       includes it as a keyword argument.
+        token_payload: The contents of the auth token. Will be passed ot the plugin
+                       method if the implementation includes it as a keyword argument
+        debug_logger:  A callable, that if provided, will allow debug logging. Should be
+                       passed as a logger method like `logger.debug`. Will be passed to
+                       the plugin method if the implementation includes it as a keyword
+                       argument.
+    """
+
+
+@hookspec
+async def armasec_plugin_check_async(
+    request: "HTTPConnection",
+    token_payload: "TokenPayload",
+    debug_logger: Callable[..., None],
+) -> None:
+    """
+    Check a token payload for validity against a request using your async plugin.
+
+    Use this hook for checks that need I/O, like looking up a tenant in a database. The
+    implementations of all plugins are awaited concurrently, so the time spent on plugins for a
+    request is bounded by the slowest one. If the check fails, it should raise a ArmasecError or a
+    subclass thereof.
+
+    Args:
+        request:       The original request or websocket made to the secured endpoint.
+                       Will be passed to the plugin method if the implementation
+                       includes it as a keyword argument.
         token_payload: The contents of the auth token. Will be passed ot the plugin
                        method if the implementation includes it as a keyword argument
         debug_logger:  A callable, that if provided, will allow debug logging. Should be
@@ -0,0 +1,132 @@
+"""
+Cache the decisions of plugin checks.
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Hashable, Optional, Tuple, Type
+
+from armasec.exceptions import ArmasecError
+
+MISS = object()
+
+
+class PluginResultCache:
+    """
+    An in-process, least recently used store for the pass or fail decisions of plugin checks.
+
+    A plugin opts in by declaring an `armasec_cache_key` callable and an `armasec_cache_ttl`:
+
+        armasec_cache_ttl = 300
+
+        def armasec_cache_key(request, token_payload):
+            return (token_payload.sub, route_path(request))
+
+    The key callable is called with the request and the token payload before each check. If it
+    returns None, the check is not cached. A passing check is cached as a pass and a check that
+    raises an ArmasecError is cached as the type and arguments of that error, so that each hit
+    raises a new instance instead of sharing one across concurrent requests. Other errors are never
+    cached. Entries expire after the plugin's TTL or when the token they were decided for expires,
+    whichever comes first.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        """
+        Initializes the PluginResultCache.
+
+        Args:
+            max_entries: The maximum number of decisions to hold before evicting the least
+                         recently used one.
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict[
+            Hashable, Tuple[float, Optional[Tuple[Type[ArmasecError], Tuple[Any, ...]]]]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counts "hits", "misses", "sets" and "evictions"
+        self.stats: Counter = Counter()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Retrieve a decision. Returns None for a pass, a new ArmasecError for a failure, or MISS if
+        there is no live decision for the key.
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return MISS
+            (expires_at, failure) = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.stats["misses"] += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        if failure is None:
+            return None
+        (error_type, args) = failure
+        return error_type(*args)
+
+    def set(
+        self,
+        key: Hashable,
+        error: Optional[ArmasecError],
+        ttl: float,
+        token_expires_at: Optional[float] = None,
+    ):
+        """
+        Store a decision until the TTL passes or the token expires.
+
+        Args:
+            key:              The key declared by the plugin for the check.
+            error:            None if the check passed, or the ArmasecError it raised.
+            ttl:              The number of seconds to keep the decision.
+            token_expires_at: The expiry of the token as a timestamp, if it has one.
+        """
+        expires_at = time.time() + ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        with self._lock:
+            self._entries[key] = (expires_at, (type(error), error.args) if error else None)
+            self._entries.move_to_end(key)
+            self.stats["sets"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        """
+        Drop all cached decisions, for example after changing a plugin's data source.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> dict:
+        """
+        Report the number of cached decisions, the cache's counters, and its hit rate.
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            entries=len(self._entries),
+            hit_rate=self.stats["hits"] / lookups if lookups else None,
+            **self.stats,
+        )
+
+    def reset(self):
+        """
+        Reset the lock inherited from the parent process in a forked child.
+        """
+        self._lock = threading.Lock()
+
+
+def route_path(request: Any) -> str:
+    """
+    Get the path template of the route that matched a request, like `/items/{item_id}`. Falls back
+    to the request's path if no route matched.
+    """
+    route = request.scope.get("route")
+    path = getattr(route, "path", None)
+    return path if path is not None else request.scope.get("path", "")
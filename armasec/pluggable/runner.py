@@ -0,0 +1,441 @@
+"""
+Run the plugin checks for a request.
+"""
+
+import asyncio
+import inspect
+import time
+from concurrent.futures import Executor
+from itertools import groupby
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import pluggy
+
+from armasec.exceptions import ArmasecError, PluginTimeoutError
+from armasec.pluggable import discovery, plugin_manager
+from armasec.pluggable.result_cache import MISS, PluginResultCache
+from armasec.utilities import noop
+
+HOOK_ARGNAMES = ("request", "token_payload", "debug_logger")
+
+# Marks a check whose decision is not stored in the result cache
+NOT_CACHED: Hashable = None
+
+
+class PlannedCheck(NamedTuple):
+    """
+    A plugin check resolved from a hook implementation.
+    """
+
+    name: str
+    function: Callable[..., Any]
+    argnames: Tuple[str, ...]
+    is_async: bool
+    cost: float
+    cache_key: Optional[Callable[[Any, Any], Optional[Hashable]]] = None
+    cache_ttl: float = 0
+    decision_cacheable: bool = False
+
+
+class PluginStats:
+    """
+    Call statistics for a single plugin.
+    """
+
+    def __init__(self):
+        """
+        Initializes the PluginStats.
+        """
+        self.calls = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float, failed: bool = False):
+        """
+        Record the latency of a finished call.
+        """
+        self.calls += 1
+        self.failures += failed
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def summary(self) -> dict:
+        """
+        Summarize the statistics for reporting.
+        """
+        return dict(
+            calls=self.calls,
+            failures=self.failures,
+            cancelled=self.cancelled,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+            cache_hit_rate=(
+                self.cache_hits / (self.cache_hits + self.cache_misses)
+                if self.cache_hits + self.cache_misses
+                else None
+            ),
+            total_time=self.total_time,
+            mean_time=self.total_time / self.calls if self.calls else None,
+            max_time=self.max_time,
+        )
+
+
+class PluginSelection:
+    """
+    The plugins selected for a route, resolved into a plan of cost-ordered tiers.
+
+    Plugins are selected by their registered name, like the name of their `armasec` entrypoint, or
+    by the tags they declare in an `armasec_tags` attribute. A plugin may declare its relative cost
+    in an `armasec_cost` attribute; plugins without one have a cost of 0. The plan groups the
+    checks by cost so that the cheap ones run first and a failure denies the request before the
+    expensive ones are called.
+
+    The plan is resolved once and only resolved again if plugins are registered or unregistered.
+    """
+
+    def __init__(
+        self,
+        manager: pluggy.PluginManager,
+        names: Optional[Iterable[str]] = None,
+        tags: Optional[Iterable[str]] = None,
+    ):
+        """
+        Initializes the PluginSelection. If neither names nor tags are supplied, all plugins are
+        selected.
+
+        Args:
+            manager: The pluggy PluginManager with the registered plugins.
+            names:   The names of the plugins to select.
+            tags:    Select the plugins that declare any of these tags.
+        """
+        self.manager = manager
+        self.names = frozenset(names) if names is not None else None
+        self.tags = frozenset(tags) if tags is not None else None
+        self._resolved_for: Optional[Tuple[List, List]] = None
+        self._plan: List[List[PlannedCheck]] = []
+        self._partial_plans: Dict[bool, List[List[PlannedCheck]]] = {True: [], False: []}
+
+    def includes(self, plugin: Any) -> bool:
+        """
+        Check if a registered plugin is part of the selection.
+        """
+        if self.names is None and self.tags is None:
+            return True
+        if self.names is not None and self.manager.get_name(plugin) in self.names:
+            return True
+        return self.tags is not None and not self.tags.isdisjoint(
+            getattr(plugin, "armasec_tags", ())
+        )
+
+    def plan(self, decision_cacheable: Optional[bool] = None) -> List[List[PlannedCheck]]:
+        """
+        Return the selected checks grouped into tiers of equal cost, cheapest first.
+
+        Args:
+            decision_cacheable: If True, only include the plugins that declare
+                                `armasec_decision_cacheable`. If False, only include the others.
+        """
+        sync_impls = self.manager.hook.armasec_plugin_check.get_hookimpls()
+        async_impls = self.manager.hook.armasec_plugin_check_async.get_hookimpls()
+        if self._resolved_for != (sync_impls, async_impls):
+            self._plan = self._resolve(sync_impls, async_impls)
+            self._partial_plans = {
+                cacheable: [
+                    filtered
+                    for filtered in (
+                        [check for check in tier if check.decision_cacheable == cacheable]
+                        for tier in self._plan
+                    )
+                    if filtered
+                ]
+                for cacheable in (True, False)
+            }
+            self._resolved_for = (sync_impls, async_impls)
+        return self._plan if decision_cacheable is None else self._partial_plans[decision_cacheable]
+
+    def _resolve(self, sync_impls: List, async_impls: List) -> List[List[PlannedCheck]]:
+        checks: List[PlannedCheck] = []
+        if any(impl.hookwrapper or impl.wrapper for impl in sync_impls):
+            # Wrappers need pluggy's call loop, so the selected sync impls run as a single call
+            excluded = [impl.plugin for impl in sync_impls if not self.includes(impl.plugin)]
+            hook_caller = self.manager.subset_hook_caller("armasec_plugin_check", excluded)
+            checks.append(
+                PlannedCheck(
+                    "armasec_plugin_check",
+                    lambda *args: hook_caller(**dict(zip(HOOK_ARGNAMES, args))),
+                    HOOK_ARGNAMES,
+                    False,
+                    0,
+                )
+            )
+            sync_impls = []
+
+        # pluggy calls the most recently registered implementations first
+        for impl in [*reversed(sync_impls), *reversed(async_impls)]:
+            if not self.includes(impl.plugin):
+                continue
+            checks.append(
+                PlannedCheck(
+                    self.manager.get_name(impl.plugin) or impl.plugin_name,
+                    impl.function,
+                    tuple(impl.argnames),
+                    inspect.iscoroutinefunction(impl.function),
+                    getattr(impl.plugin, "armasec_cost", 0),
+                    getattr(impl.plugin, "armasec_cache_key", None),
+                    getattr(impl.plugin, "armasec_cache_ttl", 0),
+                    getattr(impl.plugin, "armasec_decision_cacheable", False),
+                )
+            )
+
+        checks.sort(key=lambda check: check.cost)
+        return [list(tier) for (_, tier) in groupby(checks, key=lambda check: check.cost)]
+
+
+class PluginRunner:
+    """
+    Run the `armasec_plugin_check` and `armasec_plugin_check_async` implementations of the
+    registered plugins for a request.
+
+    The checks run in tiers of equal cost, cheapest first (see PluginSelection). Within a tier,
+    async implementations are awaited concurrently. Sync implementations are called inline in
+    pluggy's call order unless `offload_sync` is set, in which case each of them runs in a thread
+    alongside the async ones. Either way, the checks fail fast on the first error and are bounded
+    by an optional timeout, so the time spent on a tier is bounded by its slowest plugin rather
+    than the sum of all of them.
+
+    The decisions of plugins that declare a cache key and TTL are cached in the `result_cache`
+    (see PluginResultCache), so such a plugin is only called again once its decision expires.
+
+    The number of calls, failures, cache hits and the latency of each plugin are recorded in
+    `stats`.
+    """
+
+    def __init__(
+        self,
+        manager: Optional[pluggy.PluginManager] = None,
+        timeout: Optional[float] = None,
+        offload_sync: bool = False,
+        executor: Optional[Executor] = None,
+        result_cache: Optional[PluginResultCache] = None,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the PluginRunner.
+
+        Args:
+            manager:      The pluggy PluginManager with the registered plugins. Defaults to the
+                          armasec plugin manager.
+            timeout:      The number of seconds to wait for the checks before denying the request
+                          with a PluginTimeoutError. If None, wait indefinitely.
+            offload_sync: If True, run sync plugins in threads so they do not block the event
+                          loop and run concurrently with the other plugins.
+            executor:     The executor for offloaded sync plugins. Defaults to the event loop's
+                          default executor.
+            result_cache: The store for the decisions of cacheable plugins. Defaults to an
+                          in-process PluginResultCache.
+            debug_logger: A callable, that if provided, will allow debug logging. Should be
+                          passed as a logger method like `logger.debug`
+        """
+        self.manager = manager if manager is not None else plugin_manager
+        self.timeout = timeout
+        self.offload_sync = offload_sync
+        self.executor = executor
+        self.result_cache = result_cache if result_cache is not None else PluginResultCache()
+        self.debug_logger = debug_logger if debug_logger else noop
+        self.stats: Dict[str, PluginStats] = dict()
+        self.all_plugins = PluginSelection(self.manager)
+
+    def select(
+        self,
+        names: Optional[Iterable[str]] = None,
+        tags: Optional[Iterable[str]] = None,
+    ) -> PluginSelection:
+        """
+        Select the plugins to run for a route by name or by tag.
+
+        Args:
+            names: The names of the plugins to select.
+            tags:  Select the plugins that declare any of these tags.
+        """
+        if names is None and tags is None:
+            return self.all_plugins
+        return PluginSelection(self.manager, names=names, tags=tags)
+
+    def metrics(self) -> Dict[str, dict]:
+        """
+        Report the call statistics of each plugin.
+        """
+        return {name: stats.summary() for (name, stats) in self.stats.items()}
+
+    async def check(
+        self,
+        request: Any,
+        token_payload: Any,
+        debug_logger: Optional[Callable[..., None]] = None,
+        selection: Optional[PluginSelection] = None,
+        decision_cacheable: Optional[bool] = None,
+    ):
+        """
+        Run the checks of the selected plugins. Raises the error of the first plugin that fails, or
+        a PluginTimeoutError if the checks do not finish within the timeout.
+
+        Args:
+            request:            The request or websocket made to the secured endpoint.
+            token_payload:      The verified payload of the request's token.
+            debug_logger:       The debug logger to pass to the plugins. Defaults to the runner's.
+            selection:          The plugins to run. Defaults to all registered plugins.
+            decision_cacheable: If True, only run the plugins that declare
+                                `armasec_decision_cacheable`. If False, only run the others. If
+                                None, run all of them.
+        """
+        if not discovery.loaded and self.manager is plugin_manager:
+            discovery.load_plugins()
+
+        plan = (selection if selection is not None else self.all_plugins).plan(decision_cacheable)
+        if not plan:
+            return
+
+        kwargs = dict(
+            request=request,
+            token_payload=token_payload,
+            debug_logger=debug_logger if debug_logger else self.debug_logger,
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout if self.timeout is not None else None
+        for tier in plan:
+            calls = []
+            for check in tier:
+                cache_key = NOT_CACHED
+                if check.cache_key is not None and check.cache_ttl > 0:
+                    (cached_pass, cache_key) = self._cached_decision(check, request, token_payload)
+                    if cached_pass:
+                        continue
+                calls.append((check, [kwargs[name] for name in check.argnames], cache_key))
+
+            # Inline checks run first so that no coroutine is left unawaited if one of them fails
+            awaitables: List[Awaitable] = []
+            for check, args, cache_key in calls:
+                if check.is_async:
+                    continue
+                if self.offload_sync:
+                    awaitables.append(
+                        loop.run_in_executor(
+                            self.executor, self._timed_sync, check, args, cache_key, token_payload
+                        )
+                    )
+                else:
+                    self._timed_sync(check, args, cache_key, token_payload)
+            awaitables.extend(
+                self._timed_async(check, args, cache_key, token_payload)
+                for (check, args, cache_key) in calls
+                if check.is_async
+            )
+
+            if awaitables:
+                await self._gather(
+                    awaitables, deadline - loop.time() if deadline is not None else None
+                )
+
+    def _cached_decision(
+        self, check: PlannedCheck, request: Any, token_payload: Any
+    ) -> Tuple[bool, Hashable]:
+        """
+        Look up the cached decision of a check. Raises the cached error of a failed check. Returns
+        whether a passing decision was cached and the key to store a new decision under.
+        """
+        assert check.cache_key is not None  # make static type analyzer happy
+        plugin_key = check.cache_key(request, token_payload)
+        if plugin_key is None:
+            return (False, NOT_CACHED)
+        cache_key = (check.name, plugin_key)
+        decision = self.result_cache.get(cache_key)
+        stats = self._stats_for(check.name)
+        if decision is MISS:
+            stats.cache_misses += 1
+            return (False, cache_key)
+        stats.cache_hits += 1
+        if decision is not None:
+            raise decision
+        return (True, cache_key)
+
+    def _stats_for(self, name: str) -> PluginStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats.setdefault(name, PluginStats())
+        return stats
+
+    def _timed_sync(
+        self, check: PlannedCheck, args: List[Any], cache_key: Hashable, token_payload: Any
+    ):
+        start = time.perf_counter()
+        try:
+            check.function(*args)
+        except BaseException as err:
+            self._finish(check, start, cache_key, token_payload, err)
+            raise
+        self._finish(check, start, cache_key, token_payload)
+
+    async def _timed_async(
+        self, check: PlannedCheck, args: List[Any], cache_key: Hashable, token_payload: Any
+    ):
+        start = time.perf_counter()
+        try:
+            await check.function(*args)
+        except asyncio.CancelledError:
+            self._stats_for(check.name).cancelled += 1
+            raise
+        except BaseException as err:
+            self._finish(check, start, cache_key, token_payload, err)
+            raise
+        self._finish(check, start, cache_key, token_payload)
+
+    def _finish(
+        self,
+        check: PlannedCheck,
+        start: float,
+        cache_key: Hashable,
+        token_payload: Any,
+        error: Optional[BaseException] = None,
+    ):
+        self._stats_for(check.name).record(time.perf_counter() - start, failed=error is not None)
+        if cache_key is NOT_CACHED or not (error is None or isinstance(error, ArmasecError)):
+            return
+        expire = getattr(token_payload, "expire", None)
+        self.result_cache.set(
+            cache_key,
+            error,
+            check.cache_ttl,
+            token_expires_at=expire.timestamp() if expire is not None else None,
+        )
+
+    async def _gather(self, awaitables: List[Awaitable], timeout: Optional[float]):
+        tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+        (done, pending) = await asyncio.wait(
+            tasks,
+            timeout=max(timeout, 0.0) if timeout is not None else None,
+            return_when=asyncio.FIRST_EXCEPTION,
+        )
+        for task in pending:
+            task.cancel()
+        for task in tasks:
+            if task in done and task.exception() is not None:
+                raise task.exception()  # type: ignore[misc]
+        PluginTimeoutError.require_condition(
+            not pending,
+            f"{len(pending)} plugin checks did not finish within {self.timeout} seconds",
+        )
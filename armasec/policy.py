@@ -0,0 +1,362 @@
+"""
+This module defines compiled authorization policies for routes.
+
+A Policy combines the scopes of a route, a boolean scope expression, and `match_keys` into a single
+predicate that is compiled once when the route is secured. Scopes are interned in the app-wide
+PermissionRegistry and compiled to bitmasks, so checking a token costs a few integer operations on
+the token's precomputed permission mask.
+"""
+
+import re
+from typing import (
+    Any,
+    Callable,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from snick import unwrap
+
+from armasec.exceptions import ArmasecError, AuthorizationError
+from armasec.permission_registry import permission_registry
+from armasec.permissions import (
+    MATCH_KEYS_MESSAGE,
+    PermissionMode,
+    check_permissions,
+    compile_match_keys,
+    freeze_match_keys,
+)
+from armasec.scope_trie import scope_trie
+from armasec.token_payload import TokenPayload
+from armasec.utilities import noop
+
+# A predicate over a permission mask from the app-wide PermissionRegistry
+Predicate = Callable[[int], bool]
+
+KEYWORDS = ("and", "or", "not")
+
+TOKEN_PATTERN = re.compile(r"""\s*(?:(\()|(\))|"([^"]*)"|'([^']*)'|([^\s()"']+))""")
+
+
+class ScopeExpression:
+    """
+    A boolean expression over scopes, like `admin or (read:x and tenant:y)`.
+
+    Scopes may be bare words or quoted. They are combined with `and`, `or`, `not`, and parentheses,
+    where `not` binds tighter than `and`, which binds tighter than `or`. The expression is parsed
+    and compiled into a predicate over a permission mask when it is built.
+    """
+
+    def __init__(self, expression: str):
+        """
+        Initializes the ScopeExpression. Raises ArmasecError if the expression is malformed.
+
+        Args:
+            expression: The expression to compile.
+        """
+        self.expression = expression
+        self._tokens = _tokenize(expression)
+        self._position = 0
+        tree = self._parse_or()
+        trailing = self._peek()
+        ArmasecError.require_condition(
+            trailing is None,
+            f"Unexpected {trailing[1] if trailing else ''!r} in scope expression: {expression}",
+        )
+        self.predicate: Predicate = _compile(tree)
+        self.scopes: FrozenSet[str] = frozenset(_scopes_of(tree))
+
+    def __call__(self, permissions: Iterable[str]) -> bool:
+        return self.predicate(permission_registry.mask(permissions))
+
+    def __repr__(self) -> str:
+        return f"ScopeExpression({self.expression!r})"
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+    def _take(self) -> Tuple[str, str]:
+        token = self._peek()
+        ArmasecError.require_condition(
+            token is not None, f"Unexpected end of scope expression: {self.expression}"
+        )
+        self._position += 1
+        assert token is not None  # make static type analyzer happy
+        return token
+
+    def _parse_or(self) -> tuple:
+        operands = [self._parse_and()]
+        while self._peek() == ("keyword", "or"):
+            self._take()
+            operands.append(self._parse_and())
+        return operands[0] if len(operands) == 1 else ("or", *operands)
+
+    def _parse_and(self) -> tuple:
+        operands = [self._parse_not()]
+        while self._peek() == ("keyword", "and"):
+            self._take()
+            operands.append(self._parse_not())
+        return operands[0] if len(operands) == 1 else ("and", *operands)
+
+    def _parse_not(self) -> tuple:
+        if self._peek() == ("keyword", "not"):
+            self._take()
+            return ("not", self._parse_not())
+        (kind, value) = self._take()
+        if kind == "scope":
+            return ("scope", value)
+        ArmasecError.require_condition(
+            kind == "open", f"Unexpected {value!r} in scope expression: {self.expression}"
+        )
+        tree = self._parse_or()
+        ArmasecError.require_condition(
+            self._take()[0] == "close",
+            f"Unbalanced parentheses in scope expression: {self.expression}",
+        )
+        return tree
+
+
+class Policy:
+    """
+    The compiled authorization requirements of a route.
+
+    A token is allowed if it has the scopes under the PermissionMode, satisfies the scope
+    expression, and contains the `match_keys`. Every requirement is optional.
+
+    With `wildcard_scopes`, a token has a scope if any of its permissions grants it, like `jobs:*`
+    or `*:read` for `jobs:read`, or `admin` for everything under `admin:` (see ScopeTrie).
+    """
+
+    def __init__(
+        self,
+        scopes: Optional[Iterable[str]] = None,
+        permission_mode: Union[PermissionMode, str] = PermissionMode.ALL,
+        requires: Optional[str] = None,
+        match_keys: Optional[Mapping[str, Any]] = None,
+        wildcard_scopes: bool = False,
+    ):
+        """
+        Initializes the Policy and compiles its predicate.
+
+        Args:
+            scopes:          The scopes required by the route.
+            permission_mode: If "ALL", all scopes are required. If "SOME", one of them is required.
+            requires:        A boolean scope expression the token's permissions must satisfy,
+                             like `admin or (read:x and tenant:y)`.
+            match_keys:      Key-value pairs the token payload must contain, with the same
+                             semantics as the `match_keys` of a DomainConfig.
+            wildcard_scopes: If True, match the scopes against wildcard and hierarchical token
+                             permissions instead of requiring exact matches.
+        """
+        self.scopes = tuple(scopes) if scopes else ()
+        self.wildcard_scopes = wildcard_scopes
+        self.permission_mode = permission_mode
+        self.expression = ScopeExpression(requires) if requires else None
+        self.match_keys = dict(match_keys) if match_keys else {}
+
+        # Equal for policies with the same requirements, so that their decisions can be shared
+        self.key: Hashable = (
+            frozenset(self.scopes),
+            permission_mode if self.scopes else None,
+            self.expression.expression if self.expression is not None else None,
+            freeze_match_keys(self.match_keys),
+            wildcard_scopes,
+        )
+
+        # The scopes to look up in a token's ScopeTrie when matching wildcards
+        self._required_scopes = tuple(
+            sorted(
+                set(self.scopes)
+                | (self.expression.scopes if self.expression is not None else frozenset())
+            )
+        )
+
+        self._scopes_predicate = _compile_scopes(self.scopes, permission_mode)
+        self._match_keys_predicate = compile_match_keys(self.match_keys)
+
+        predicates: List[Predicate] = []
+        if self._scopes_predicate is not None:
+            predicates.append(self._scopes_predicate)
+        if self.expression is not None:
+            predicates.append(self.expression.predicate)
+        self._permissions_predicate = _all_of(predicates)
+
+    @property
+    def is_empty(self) -> bool:
+        """
+        True if the policy allows any verified token.
+        """
+        return self._permissions_predicate is None and self._match_keys_predicate is None
+
+    def allows(self, token_payload: TokenPayload) -> bool:
+        """
+        Check if a verified token satisfies the policy.
+        """
+        if self._permissions_predicate is not None and not self._permissions_predicate(
+            self._mask_of(token_payload)
+        ):
+            return False
+        return self._match_keys_predicate is None or self._match_keys_predicate(token_payload)
+
+    def check(
+        self,
+        token_payload: TokenPayload,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Check a verified token against the policy. Raise AuthorizationError if it is not allowed.
+        The error message is only built if the check fails.
+
+        Args:
+            token_payload: The verified payload of the token.
+            debug_logger:  A callable, that if provided, will allow debug logging. Should be passed
+                           as a logger method like `logger.debug`
+        """
+        if debug_logger and debug_logger is not noop:
+            debug_logger(f"Checking token permissions against {self!r}")
+        if self.allows(token_payload):
+            return
+
+        permissions = token_payload.permission_set
+        mask = self._mask_of(token_payload)
+        if self._scopes_predicate is not None and not self._scopes_predicate(mask):
+            # Delegate to the shared check so the error matches the one for plain scopes
+            check_permissions(permissions, self.scopes, self.permission_mode)  # type: ignore[arg-type]
+        if self.expression is not None and not self.expression.predicate(mask):
+            raise AuthorizationError(
+                unwrap(
+                    f"""
+                    Token permissions {set(permissions)} do not satisfy the required scope
+                    expression: {self.expression.expression}
+                    """
+                )
+            )
+        raise AuthorizationError(MATCH_KEYS_MESSAGE)
+
+    def _mask_of(self, token_payload: TokenPayload) -> int:
+        """
+        Get the mask of the scopes the token has for the policy's predicate.
+        """
+        if self.wildcard_scopes:
+            return scope_trie(token_payload.permission_set).mask(self._required_scopes)
+        return token_payload.permission_mask
+
+    def __repr__(self) -> str:
+        requirements = []
+        if self.scopes:
+            requirements.append(f"scopes={self.scopes!r}, permission_mode={self.permission_mode}")
+        if self.expression is not None:
+            requirements.append(f"requires={self.expression.expression!r}")
+        if self.match_keys:
+            requirements.append(f"match_keys={self.match_keys!r}")
+        if self.wildcard_scopes:
+            requirements.append("wildcard_scopes=True")
+        return f"Policy({', '.join(requirements)})"
+
+
+def _tokenize(expression: str) -> List[Tuple[str, str]]:
+    tokens: List[Tuple[str, str]] = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        ArmasecError.require_condition(
+            match, f"Malformed scope expression at {position}: {expression}"
+        )
+        assert match is not None  # make static type analyzer happy
+        (open_paren, close_paren, double_quoted, single_quoted, word) = match.groups()
+        if open_paren:
+            tokens.append(("open", open_paren))
+        elif close_paren:
+            tokens.append(("close", close_paren))
+        elif word is not None and word.lower() in KEYWORDS:
+            tokens.append(("keyword", word.lower()))
+        else:
+            scope = next(
+                value for value in (double_quoted, single_quoted, word) if value is not None
+            )
+            tokens.append(("scope", scope))
+        position = match.end()
+    return tokens
+
+
+def _compile(tree: tuple) -> Predicate:
+    (operator, *operands) = tree
+    if operator == "scope":
+        bit = permission_registry.intern(operands[0])
+        return lambda mask: mask & bit != 0
+    if operator == "not":
+        inner = _compile(operands[0])
+        return lambda mask: not inner(mask)
+
+    # Operands that are plain scopes collapse into a single mask test
+    scopes = tuple(operand[1] for operand in operands if operand[0] == "scope")
+    others = [_compile(operand) for operand in operands if operand[0] != "scope"]
+    if operator == "and":
+        if scopes:
+            others.insert(0, _all_bits(permission_registry.compile(scopes)))
+        predicate = _all_of(others)
+    else:
+        if scopes:
+            others.insert(0, _any_bits(permission_registry.compile(scopes)))
+        predicate = _any_of(others)
+    assert predicate is not None  # make static type analyzer happy
+    return predicate
+
+
+def _compile_scopes(
+    scopes: Tuple[str, ...], permission_mode: Union[PermissionMode, str]
+) -> Optional[Predicate]:
+    if not scopes:
+        return None
+    if permission_mode == PermissionMode.ALL:
+        return _all_bits(permission_registry.compile(scopes))
+    if permission_mode == PermissionMode.SOME:
+        return _any_bits(permission_registry.compile(scopes))
+    # Unknown modes deny every token; check() raises the matching error
+    return lambda mask: False
+
+
+def _all_bits(required: int) -> Predicate:
+    return lambda mask: mask & required == required
+
+
+def _any_bits(required: int) -> Predicate:
+    return lambda mask: mask & required != 0
+
+
+def _all_of(predicates: List[Predicate]) -> Optional[Predicate]:
+    if not predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+    if len(predicates) == 2:
+        (first, second) = predicates
+        return lambda mask: first(mask) and second(mask)
+    return lambda mask: all(predicate(mask) for predicate in predicates)
+
+
+def _any_of(predicates: List[Predicate]) -> Optional[Predicate]:
+    if not predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+    if len(predicates) == 2:
+        (first, second) = predicates
+        return lambda mask: first(mask) or second(mask)
+    return lambda mask: any(predicate(mask) for predicate in predicates)
+
+
+def _scopes_of(tree: tuple) -> Iterable[str]:
+    (operator, *operands) = tree
+    if operator == "scope":
+        yield operands[0]
+        return
+    for operand in operands:
+        yield from _scopes_of(operand)
@@ -2,16 +2,18 @@
 This module provides a pytest plugin for testing.
 """
 
+import asyncio
 from collections import namedtuple
 from contextlib import _GeneratorContextManager, contextmanager
 from datetime import datetime, timezone
-from typing import Callable, Optional
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import parse_qs
 from uuid import uuid4
 
 import httpx
 import pytest
 import respx
-import starlette
 from jose import jwt
 from snick import dedent, strip_whitespace
 
@@ -296,14 +298,14 @@ def build_mock_openid_server(
                 OpenidConfigLoader.build_openid_config_url(domain),
             )
             openid_config_route.return_value = httpx.Response(
-                starlette.status.HTTP_200_OK,
+                HTTPStatus.OK,
                 json=openid_config.model_dump(mode="json"),
             )
 
             jwks = JWKs(keys=[jwk])
             jwks_route = respx.get(jwks_uri)
             jwks_route.return_value = httpx.Response(
-                starlette.status.HTTP_200_OK,
+                HTTPStatus.OK,
                 json=jwks.model_dump(mode="json"),
             )
             yield MockOpenidRoutes(openid_config_route, jwks_route)
@@ -325,3 +327,63 @@ def mock_openid_server(rs256_domain, rs256_openid_config, rs256_jwk, rs256_jwks_
     builder = build_mock_openid_server(rs256_domain, rs256_openid_config, rs256_jwk, rs256_jwks_uri)
     with builder() as constructed_builder:
         yield constructed_builder
+
+
+class MockIntrospectionServer:
+    """
+    A stand-in for an RFC 7662 introspection endpoint that knows the opaque tokens it issued.
+
+    Attributes:
+        endpoint: The URL of the introspection endpoint.
+        tokens:   The claims of each active token.
+        delay:    Seconds to wait before answering, to test concurrent introspection.
+        route:    The respx route of the endpoint, that records its calls.
+    """
+
+    def __init__(self, endpoint: str, delay: float = 0.0):
+        self.endpoint = endpoint
+        self.tokens: Dict[str, Dict[str, Any]] = dict()
+        self.delay = delay
+        self.route: Optional[respx.Route] = None
+
+    def issue(self, **claims) -> str:
+        """
+        Issue an opaque token that introspects as active with the supplied claims.
+        """
+        token = uuid4().hex
+        self.tokens[token] = claims
+        return token
+
+    def revoke(self, token: str):
+        """
+        Make a token introspect as inactive.
+        """
+        self.tokens.pop(token, None)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """
+        Answer an introspection request.
+        """
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        token = parse_qs(request.content.decode()).get("token", [""])[0]
+        claims = self.tokens.get(token)
+        if claims is None:
+            return httpx.Response(HTTPStatus.OK, json=dict(active=False))
+        return httpx.Response(HTTPStatus.OK, json=dict(claims, active=True))
+
+
+@pytest.fixture
+def mock_introspection_server(rs256_domain, mock_openid_server):
+    """
+    Provide a fixture that mocks the introspection endpoint of the mocked openid server.
+
+    Args:
+        rs256_domain:       An implicit fixture parameter.
+        mock_openid_server: An implicit fixture parameter.
+    """
+    server = MockIntrospectionServer(
+        f"https://{rs256_domain}/protocol/openid-connect/token/introspect"
+    )
+    server.route = respx.post(server.endpoint).mock(side_effect=server.handle)
+    yield server
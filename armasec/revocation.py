@@ -0,0 +1,372 @@
+"""
+This module defines a RevocationList that rejects tokens revoked before they expire.
+
+Revoked identifiers, like the `jti` of a token, the `sid` of a session or the `sub` of a
+compromised account, are held in memory and synced incrementally from a pluggable source. Checking
+a token only costs a few dict lookups, so revocation can be checked on every request without
+calling a database or an introspection endpoint.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from buzz import DoExceptParams
+
+from armasec.exceptions import ArmasecError, AuthenticationError
+from armasec.token_payload import TokenPayload
+from armasec.utilities import log_error, noop
+
+
+class RevocationDelta(NamedTuple):
+    """
+    The changes to a revocation list since the cursor passed to a source's `fetch()`.
+
+    Attributes:
+        revoked:  The newly revoked identifiers, each mapped to the timestamp after which it may
+                  be forgotten, like the `exp` of the revoked token, or None to keep it.
+        restored: The identifiers that are no longer revoked.
+        cursor:   The cursor to pass to the next `fetch()`.
+        full:     If True, `revoked` holds the whole list and replaces the one held in memory.
+    """
+
+    revoked: Mapping[str, Optional[float]]
+    restored: Iterable[str] = ()
+    cursor: Optional[str] = None
+    full: bool = False
+
+
+class MemoryRevocationSource:
+    """
+    A revocation source held in the process. Useful in tests and as a stand-in for a shared
+    service, since it serves the same incremental changes.
+    """
+
+    _revoked: Dict[str, Optional[float]]
+    _log: List[Tuple[str, Optional[float], bool]]
+
+    def __init__(self):
+        """
+        Initializes the MemoryRevocationSource.
+        """
+        self._revoked = dict()
+        self._log = []
+        self._lock = threading.Lock()
+
+    def revoke(self, identifier: str, expires_at: Optional[float] = None):
+        """
+        Revoke an identifier, optionally until a timestamp like the `exp` of the revoked token.
+        """
+        with self._lock:
+            self._revoked[identifier] = expires_at
+            self._log.append((identifier, expires_at, True))
+
+    def restore(self, identifier: str):
+        """
+        Lift the revocation of an identifier.
+        """
+        with self._lock:
+            self._revoked.pop(identifier, None)
+            self._log.append((identifier, None, False))
+
+    def fetch(self, cursor: Optional[str]) -> RevocationDelta:
+        """
+        Get the changes since the cursor, or the whole list if the cursor is None.
+        """
+        with self._lock:
+            if cursor is None:
+                return RevocationDelta(dict(self._revoked), cursor=str(len(self._log)), full=True)
+            revoked: Dict[str, Optional[float]] = dict()
+            restored = set()
+            for identifier, expires_at, is_revoked in self._log[int(cursor) :]:
+                if is_revoked:
+                    revoked[identifier] = expires_at
+                    restored.discard(identifier)
+                else:
+                    restored.add(identifier)
+                    revoked.pop(identifier, None)
+            return RevocationDelta(revoked, restored, cursor=str(len(self._log)))
+
+
+class FileRevocationSource:
+    """
+    A revocation source that reads a JSON file holding an object that maps each revoked
+    identifier to the timestamp after which it may be forgotten, or null.
+
+    The file is only read again when its modification time changes.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the FileRevocationSource.
+
+        Args:
+            path: The path of the JSON file.
+        """
+        self.path = path
+
+    def fetch(self, cursor: Optional[str]) -> RevocationDelta:
+        """
+        Get the whole list if the file changed since the cursor, or no changes if it did not.
+        """
+        with ArmasecError.handle_errors(f"Failed to load the revocation list from {self.path}"):
+            mtime = str(os.stat(self.path).st_mtime)
+            if mtime == cursor:
+                return RevocationDelta(dict(), cursor=cursor)
+            with open(self.path) as revocation_file:
+                revoked = json.load(revocation_file)
+            ArmasecError.require_condition(
+                isinstance(revoked, dict), "The revocation list must be an object"
+            )
+        return RevocationDelta(revoked, cursor=mtime, full=True)
+
+
+class HttpRevocationSource:
+    """
+    A revocation source served over HTTP.
+
+    The endpoint is called with the cursor of the last sync in a `since` query parameter, which is
+    left out on the first sync. It must answer with a JSON object holding the fields of a
+    RevocationDelta: `revoked`, and optionally `restored`, `cursor` and `full`.
+    """
+
+    def __init__(self, url: str, timeout: float = 5.0, headers: Optional[Dict[str, str]] = None):
+        """
+        Initializes the HttpRevocationSource.
+
+        Args:
+            url:     The URL of the endpoint.
+            timeout: The number of seconds to wait for the endpoint to answer.
+            headers: Optional headers to send, like credentials for the endpoint.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.headers = headers or {}
+
+    def fetch(self, cursor: Optional[str]) -> RevocationDelta:
+        """
+        Get the changes since the cursor from the endpoint.
+        """
+        # Deferred so that importing armasec does not import httpx
+        import httpx
+
+        with ArmasecError.handle_errors(f"Failed to sync the revocation list from {self.url}"):
+            response = httpx.get(
+                self.url,
+                params={"since": cursor} if cursor is not None else None,
+                headers=self.headers,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data = response.json()
+            return RevocationDelta(
+                revoked=data.get("revoked") or {},
+                restored=data.get("restored") or (),
+                cursor=data.get("cursor"),
+                full=bool(data.get("full", False)),
+            )
+
+
+class RevocationList:
+    """
+    The identifiers of revoked tokens, sessions and subjects, synced from a revocation source.
+
+    A source is any object with a `fetch(cursor)` method that returns a RevocationDelta, like a
+    FileRevocationSource, an HttpRevocationSource or a MemoryRevocationSource.
+
+    The list is synced when it is built and then every `sync_interval` seconds by a background
+    thread, so that checking a token never waits on the source. If a sync fails, the last synced
+    list is kept. Revocations are forgotten once they expire, since the tokens they revoked are
+    then rejected as expired anyway.
+
+    If the source cannot be reached when the list is built, the list fails closed by default:
+    every token is reported as revoked until the background thread syncs it. Set `fail_open` to
+    accept tokens until then instead, like when the source is expected to lag behind the app.
+    """
+
+    def __init__(
+        self,
+        source: Any,
+        sync_interval: Optional[float] = 30.0,
+        claims: Iterable[str] = ("jti", "sid", "sub"),
+        fail_open: bool = False,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the RevocationList, syncs it with the source and starts the background sync.
+
+        Args:
+            source:        The source of the revoked identifiers.
+            sync_interval: Optional number of seconds between background syncs with the source. If
+                           None, the list is only synced by calling `sync()`.
+            claims:        The claims of a token that are checked against the revoked identifiers.
+            fail_open:     If True, accept tokens until the list has been synced once. Otherwise
+                           they are reported as revoked.
+            debug_logger:  A callable, that if provided, will allow debug logging. Should be passed
+                           as a logger method like `logger.debug`
+        """
+        self.source = source
+        self.sync_interval = sync_interval
+        self.claims = tuple(claims)
+        self.fail_open = fail_open
+        self.debug_logger = debug_logger if debug_logger else noop
+
+        # The `sub` is a field of the payload while other claims are extras
+        self._check_sub = "sub" in self.claims
+        self._extra_claims = tuple(claim for claim in self.claims if claim != "sub")
+
+        self._revoked: Dict[str, Optional[float]] = dict()
+        self._expiries: List[Tuple[float, str]] = []
+        self._cursor: Optional[str] = None
+        self._synced = False
+        self._sync_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        # Counts "revoked" tokens, "unsynced" checks, "syncs" and "failures"
+        self.stats: Counter = Counter()
+
+        try:
+            self.sync()
+        except ArmasecError:
+            self.debug_logger(f"Revocation list failed {'open' if fail_open else 'closed'}")
+        self.start()
+
+    def __contains__(self, identifier: object) -> bool:
+        return identifier in self._revoked
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def is_revoked(self, token_payload: TokenPayload) -> bool:
+        """
+        Check if any of the token's identifying claims was revoked. Only looks up the list held in
+        memory, which is reported as revoking every token if it failed closed.
+        """
+        if not self._synced:
+            self.stats["unsynced"] += 1
+            return not self.fail_open
+
+        revoked = self._revoked
+        if self._check_sub and token_payload.sub in revoked:
+            self.stats["revoked"] += 1
+            return True
+
+        # Read the extras directly since the `model_extra` property is comparatively slow
+        extra = token_payload.__pydantic_extra__ or {}
+        for claim in self._extra_claims:
+            identifier = extra.get(claim)
+            if identifier is not None and identifier in revoked:
+                self.stats["revoked"] += 1
+                return True
+        return False
+
+    def check(self, token_payload: TokenPayload):
+        """
+        Raise an AuthenticationError if the token was revoked.
+        """
+        AuthenticationError.require_condition(
+            not self.is_revoked(token_payload), "Token has been revoked"
+        )
+
+    def start(self):
+        """
+        Start syncing the list every `sync_interval` seconds in a daemon thread, stopping the one
+        started before.
+        """
+        if self.sync_interval is None:
+            return
+        self._stopped.set()
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=self._run,
+            args=(self._stopped,),
+            name="armasec-revocation-sync",
+            daemon=True,
+        ).start()
+
+    def close(self):
+        """
+        Stop the background sync.
+        """
+        self._stopped.set()
+
+    def sync(self) -> bool:
+        """
+        Apply the changes from the source since the last sync. Returns False without waiting if
+        another thread is already syncing.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return False
+        try:
+            with ArmasecError.handle_errors(
+                "Failed to sync the revocation list",
+                do_except=self._fail_sync,
+            ):
+                delta = self.source.fetch(self._cursor)
+
+            if delta.full:
+                self._revoked = dict(delta.revoked)
+                self._expiries = [
+                    (expires_at, identifier)
+                    for (identifier, expires_at) in self._revoked.items()
+                    if expires_at is not None
+                ]
+                heapq.heapify(self._expiries)
+            else:
+                # Applied in place, since each change is atomic for concurrent checks
+                for identifier, expires_at in delta.revoked.items():
+                    self._revoked[identifier] = expires_at
+                    if expires_at is not None:
+                        heapq.heappush(self._expiries, (expires_at, identifier))
+                for identifier in delta.restored:
+                    self._revoked.pop(identifier, None)
+            self._forget_expired()
+            self._cursor = delta.cursor
+            self._synced = True
+            self.stats["syncs"] += 1
+            self.debug_logger(f"Synced {len(self._revoked)} revoked identifiers")
+            return True
+        finally:
+            self._sync_lock.release()
+
+    def metrics(self) -> dict:
+        """
+        Report the number of revoked identifiers and the list's counters.
+        """
+        return dict(revoked_identifiers=len(self._revoked), **self.stats)
+
+    def reset(self):
+        """
+        Reset the lock inherited from the parent process in a forked child and restart the
+        background sync, since threads do not survive a fork.
+        """
+        self._sync_lock = threading.Lock()
+        self.start()
+
+    def _run(self, stopped: threading.Event):
+        assert self.sync_interval is not None  # make static type analyzer happy
+        while not stopped.wait(self.sync_interval):
+            try:
+                self.sync()
+            except ArmasecError:
+                # Keep checking against the last synced list until the source recovers
+                pass
+
+    def _forget_expired(self):
+        """
+        Drop the revocations that expired. Only looks at the ones that are due.
+        """
+        now = time.time()
+        while self._expiries and self._expiries[0][0] <= now:
+            (expires_at, identifier) = heapq.heappop(self._expiries)
+            # Skip stale entries for identifiers that were revoked again or restored since
+            if self._revoked.get(identifier, -1) == expires_at:
+                del self._revoked[identifier]
+
+    def _fail_sync(self, dep: DoExceptParams):
+        self.stats["failures"] += 1
+        log_error(self.debug_logger, dep)
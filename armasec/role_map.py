@@ -0,0 +1,206 @@
+"""
+This module defines a RoleMap that expands the roles in a token into fine-grained permissions.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, FrozenSet, Iterable, Mapping, Optional, Set, Tuple
+
+from armasec.exceptions import ArmasecError
+
+
+class RoleMap:
+    """
+    Map roles to the roles and permissions they grant, like Keycloak's composite roles.
+
+    Each role maps to a list of names that may be permissions or other roles. The transitive
+    closure of every role is computed when the map is loaded, and the expansion of each distinct
+    tuple of input roles is cached, so a token's roles are only expanded the first time they are
+    seen. An expansion includes the input roles themselves, so routes may still require them.
+
+    The map may be reloaded while it is in use. Only the closures of the roles that changed, and
+    of the roles that include them, are rebuilt, and only the cached expansions that use them are
+    dropped.
+    """
+
+    def __init__(
+        self,
+        roles: Optional[Mapping[str, Iterable[str]]] = None,
+        path: Optional[str] = None,
+        check_interval: Optional[float] = None,
+        max_entries: int = 1024,
+    ):
+        """
+        Initializes the RoleMap.
+
+        Args:
+            roles:          The names granted by each role.
+            path:           Optional path of a JSON file holding the roles as an object of lists.
+                            Loaded in place of `roles`.
+            check_interval: Optional number of seconds between checks of the file's modification
+                            time. If it changed, the map is reloaded. If None, the file is only
+                            reloaded by calling `load_file()`.
+            max_entries:    The maximum number of cached expansions of distinct role tuples.
+        """
+        self.roles: Dict[str, FrozenSet[str]] = dict()
+        self.path = path
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+
+        self._closures: Dict[str, FrozenSet[str]] = dict()
+        self._expansions: OrderedDict[Tuple[str, ...], FrozenSet[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+
+        # Counts "hits", "misses", "evictions" and "reloads"
+        self.stats: Counter = Counter()
+
+        if path is not None:
+            self.load_file()
+        elif roles is not None:
+            self.reload(roles)
+
+    def expand(self, roles: Iterable[str]) -> FrozenSet[str]:
+        """
+        Get the roles and every role and permission they grant.
+        """
+        if self.check_interval is not None and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                self.load_file(only_if_changed=True)
+            except ArmasecError:
+                # Keep serving the last good map, like while a file is being replaced
+                pass
+
+        key = tuple(roles)
+        with self._lock:
+            expansion = self._expansions.get(key)
+            if expansion is not None:
+                self._expansions.move_to_end(key)
+                self.stats["hits"] += 1
+                return expansion
+            closures = self._closures
+
+        self.stats["misses"] += 1
+        names: Set[str] = set(key)
+        for role in key:
+            names.update(closures.get(role, ()))
+        expansion = frozenset(names)
+
+        with self._lock:
+            if self._closures is closures:
+                self._expansions[key] = expansion
+                while len(self._expansions) > self.max_entries:
+                    self._expansions.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return expansion
+
+    def reload(self, roles: Mapping[str, Iterable[str]]) -> Set[str]:
+        """
+        Replace the map. Returns the roles whose closures were rebuilt.
+
+        Args:
+            roles: The names granted by each role.
+        """
+        with self._reload_lock:
+            return self._reload(roles)
+
+    def _reload(self, roles: Mapping[str, Iterable[str]]) -> Set[str]:
+        new_roles = {role: frozenset(names) for (role, names) in roles.items()}
+        changed = {
+            role
+            for role in new_roles.keys() | self.roles.keys()
+            if new_roles.get(role) != self.roles.get(role)
+        }
+        if not changed:
+            return changed
+
+        # A role's closure changes if it, or any role it includes, changed
+        includers = defaultdict(set)
+        for role, names in new_roles.items():
+            for name in names:
+                includers[name].add(role)
+        affected = set(changed)
+        pending = list(changed)
+        while pending:
+            for role in includers[pending.pop()]:
+                if role not in affected:
+                    affected.add(role)
+                    pending.append(role)
+
+        closures = {
+            role: closure for (role, closure) in self._closures.items() if role not in affected
+        }
+        for role in affected:
+            if role in new_roles:
+                closures[role] = _close(role, new_roles, closures)
+
+        with self._lock:
+            self.roles = new_roles
+            self._closures = closures
+            for key in [key for key in self._expansions if not affected.isdisjoint(key)]:
+                del self._expansions[key]
+            self.stats["reloads"] += 1
+        return affected
+
+    def load_file(self, only_if_changed: bool = False) -> Set[str]:
+        """
+        Reload the map from its JSON file. Returns the roles whose closures were rebuilt.
+
+        Args:
+            only_if_changed: If True, skip the reload if the file was not modified since it was
+                             last loaded.
+        """
+        ArmasecError.require_condition(self.path is not None, "The RoleMap has no file to load")
+        assert self.path is not None  # make static type analyzer happy
+        with ArmasecError.handle_errors(f"Failed to load the role map from {self.path}"):
+            mtime = os.stat(self.path).st_mtime
+            if only_if_changed and mtime == self._mtime:
+                return set()
+            with open(self.path) as role_file:
+                roles = json.load(role_file)
+            ArmasecError.require_condition(
+                isinstance(roles, dict), "The role map must be an object of lists"
+            )
+        self._mtime = mtime
+        return self.reload(roles)
+
+    def metrics(self) -> dict:
+        """
+        Report the number of roles and cached expansions, and the cache's counters.
+        """
+        return dict(roles=len(self.roles), expansions=len(self._expansions), **self.stats)
+
+    def reset(self):
+        """
+        Reset the locks inherited from the parent process in a forked child.
+        """
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+
+def _close(
+    role: str, roles: Mapping[str, FrozenSet[str]], closures: Mapping[str, FrozenSet[str]]
+) -> FrozenSet[str]:
+    """
+    Collect every name reachable from a role, reusing the closures that are already known.
+    Tolerates cycles between roles.
+    """
+    reached: Set[str] = set()
+    pending = list(roles[role])
+    while pending:
+        name = pending.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+        known = closures.get(name)
+        if known is not None:
+            reached.update(known)
+        elif name in roles:
+            pending.extend(roles[name])
+    return frozenset(reached)
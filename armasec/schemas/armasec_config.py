@@ -5,7 +5,18 @@ This module provides a pydantic schema describing Armasec's configuration parame
 from typing import Any, Dict, List, Optional, Set, Union, Callable
 
 import snick
-from pydantic import BaseModel, Field
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    PrivateAttr,
+    field_validator,
+    model_validator,
+)
+
+from armasec.exceptions import ArmasecError
+from armasec.permission_paths import PermissionPaths
+from armasec.role_map import RoleMap
 
 
 class DomainConfig(BaseModel):
@@ -14,11 +25,37 @@ class DomainConfig(BaseModel):
     It expects the domain indeed and the audience to refer to.
 
     Attributes:
-        domain:     The OIDC domain from which resources are loaded.
+        domain:     The OIDC domain from which resources are loaded. May be templated with a
+                    `{tenant}` placeholder to resolve the managers of many issuers on demand.
         audience:   Optional designation of the token audience.
         algorithm:  The Algorithm to use for decoding. Defaults to RS256.
         use_https:  If true, use `https` for URLs. Otherwise use `http`
         match_keys: Dictionary of k/v pairs to match in the token when decoding it.
+        permission_extractor: Optional function that extracts permissions from the decoded token.
+        permission_paths: Optional claim paths compiled into an extractor used in place of the
+                          `permission_extractor`.
+        refresh_interval: Optional number of seconds between revalidations of the OIDC resources.
+        failure_threshold: Number of consecutive failed fetches that opens the circuit breaker.
+        reset_timeout: Number of seconds before an open circuit breaker probes the provider again.
+        max_staleness: Optional number of seconds that the last good jwks may be served while the
+                       provider is failing.
+        mirrors:    Alternate domains serving the openid configuration for the same issuer.
+        jwks_uri_mirrors: Alternate URIs serving the same jwks.
+        hedge_percentile: Latency percentile of a mirror after which the next mirror is called.
+        max_tenants: Maximum number of resident tenants for a templated domain.
+        tenant_idle_timeout: Seconds after which an idle tenant of a templated domain is evicted.
+        max_keys_per_tenant: Maximum number of jwks that a tenant may hold.
+        prefetch_concurrency: Maximum number of concurrent tenant loads when prefetching.
+        tenant_failure_ttl: Seconds during which a tenant that failed to load is not loaded again.
+        max_tenant_loads: Maximum number of concurrent tenant loads for requests.
+        shared_store_path: Optional path of a host-local store shared by worker processes.
+        role_map:   Optional RoleMap, or a mapping of roles to the roles and permissions they
+                    grant, that expands the permissions of verified tokens.
+        introspection: If true, validate opaque tokens through the introspection endpoint.
+        introspection_endpoint: Optional URL of the introspection endpoint.
+        introspection_client_id: Optional id of the client that calls the introspection endpoint.
+        introspection_client_secret: Optional secret of the client that calls the endpoint.
+        introspection_max_ttl: Maximum number of seconds to cache an introspection response.
     """
 
     domain: str = Field(str(), description="The OIDC domain where resources are loaded.")
@@ -56,3 +93,228 @@ class DomainConfig(BaseModel):
             """
         ),
     )
+    permission_paths: Optional[List[str]] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional claim paths to collect permissions from, like `realm_access.roles` and
+            `resource_access.{azp}.roles`. They are compiled into an extractor that is used in
+            place of the `permission_extractor`, so both may not be supplied. See docs for
+            `PermissionPaths` for the path syntax.
+            """
+        ),
+    )
+    refresh_interval: Optional[float] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional number of seconds after which the openid configuration and jwks should be
+            revalidated with the OIDC provider. Revalidation uses conditional requests, so
+            unchanged resources are not re-downloaded or re-parsed.
+            """
+        ),
+    )
+    failure_threshold: int = Field(
+        5,
+        description=snick.unwrap(
+            """
+            The number of consecutive failed calls to the OIDC provider after which the circuit
+            breaker opens and further calls are rejected without touching the network.
+            """
+        ),
+    )
+    reset_timeout: float = Field(
+        30.0,
+        description=snick.unwrap(
+            """
+            The number of seconds an open circuit breaker waits before a single probe call is
+            allowed through to the OIDC provider.
+            """
+        ),
+    )
+    max_staleness: Optional[float] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional number of seconds that the last good jwks may be served after a refresh has
+            failed. If not provided, the last good jwks are served until a refresh succeeds.
+            """
+        ),
+    )
+    mirrors: List[str] = Field(
+        list(),
+        description=snick.unwrap(
+            """
+            Ordered list of alternate domains that serve the openid configuration for the same
+            issuer. If provided, hedged requests are fired at the next mirror when the previous
+            one is slower than its usual latency.
+            """
+        ),
+    )
+    jwks_uri_mirrors: List[str] = Field(
+        list(),
+        description=snick.unwrap(
+            """
+            Ordered list of alternate URIs that serve the same jwks as the `jwks_uri` found in
+            the openid configuration. Used for hedged requests like `mirrors`.
+            """
+        ),
+    )
+    hedge_percentile: float = Field(
+        0.95,
+        description=snick.unwrap(
+            """
+            The latency percentile, as a fraction between 0 and 1, that a mirror may take to
+            answer before a hedged request is fired at the next mirror.
+            """
+        ),
+    )
+    max_tenants: int = Field(
+        1000,
+        description=snick.unwrap(
+            """
+            The maximum number of tenants of a templated domain whose managers and keys are kept
+            in memory. The least recently used tenant is evicted when the limit is exceeded.
+            """
+        ),
+    )
+    tenant_idle_timeout: Optional[float] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional number of seconds after which an idle tenant of a templated domain is
+            evicted. If not provided, tenants are only evicted when `max_tenants` is exceeded.
+            """
+        ),
+    )
+    max_keys_per_tenant: int = Field(
+        20,
+        description=snick.unwrap(
+            """
+            The maximum number of jwks that a tenant of a templated domain may hold. Tenants
+            exceeding the limit are rejected instead of being kept in memory.
+            """
+        ),
+    )
+    prefetch_concurrency: int = Field(
+        8,
+        description="The maximum number of concurrent tenant loads when prefetching hot tenants.",
+    )
+    tenant_failure_ttl: float = Field(
+        30.0,
+        description=snick.unwrap(
+            """
+            The number of seconds during which a tenant of a templated domain that failed to load
+            is rejected without calling its OIDC provider again.
+            """
+        ),
+    )
+    max_tenant_loads: int = Field(
+        8,
+        description=snick.unwrap(
+            """
+            The maximum number of tenants of a templated domain that requests may load at once.
+            Requests for other tenants that are not resident are rejected until a load finishes.
+            """
+        ),
+    )
+    shared_store_path: Optional[str] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional path of a memory-mapped file used to share the openid configuration and jwks
+            with the other worker processes on the host. Only one worker refreshes from the OIDC
+            provider while the others read from the store. If the store cannot be opened, each
+            worker fetches from the provider on its own.
+            """
+        ),
+    )
+
+    role_map: Optional[RoleMap] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional map of roles to the roles and permissions they grant. The permissions of a
+            verified token, after the `permission_extractor` is applied, are expanded through it.
+            May be supplied as a RoleMap or as a dictionary of lists.
+            """
+        ),
+    )
+    introspection: bool = Field(
+        False,
+        description=snick.unwrap(
+            """
+            If truthy, tokens that cannot be verified locally, like opaque reference tokens, are
+            validated through the RFC 7662 introspection endpoint of the domain.
+            """
+        ),
+    )
+    introspection_endpoint: Optional[str] = Field(
+        None,
+        description=snick.unwrap(
+            """
+            Optional URL of the introspection endpoint. If not provided, the
+            `introspection_endpoint` of the openid configuration is used.
+            """
+        ),
+    )
+    introspection_client_id: Optional[str] = Field(
+        None,
+        description="Optional id of the client that authenticates with the introspection endpoint.",
+    )
+    introspection_client_secret: Optional[str] = Field(
+        None,
+        description="Optional secret of the client that authenticates with the endpoint.",
+    )
+    introspection_max_ttl: float = Field(
+        60.0,
+        description=snick.unwrap(
+            """
+            The maximum number of seconds that an introspection response is cached. Responses
+            for active tokens are never cached past the token's `exp`.
+            """
+        ),
+    )
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _compiled_paths: Optional[PermissionPaths] = PrivateAttr(None)
+
+    @field_validator("role_map", mode="before")
+    @classmethod
+    def build_role_map(cls, value: Any) -> Any:
+        """
+        Build a RoleMap from a dictionary of roles, like one loaded from a config file.
+        """
+        if isinstance(value, dict):
+            return RoleMap(value)
+        return value
+
+    @model_validator(mode="after")
+    def compile_permission_paths(self) -> "DomainConfig":
+        """
+        Compile the `permission_paths`. The compiled extractor is kept private so that the
+        config can be dumped and validated again.
+        """
+        if self.permission_paths is not None:
+            ArmasecError.require_condition(
+                self.permission_extractor is None,
+                "Only one of permission_paths and permission_extractor may be supplied",
+            )
+            self._compiled_paths = PermissionPaths(self.permission_paths)
+        return self
+
+    @property
+    def resolved_permission_extractor(self) -> Optional[Callable[[Dict[str, Any]], List[str]]]:
+        """
+        The extractor compiled from the `permission_paths`, or else the `permission_extractor`.
+        """
+        if self._compiled_paths is not None:
+            return self._compiled_paths
+        return self.permission_extractor
+
+    @property
+    def is_templated(self) -> bool:
+        """
+        Indicate if the domain is templated with a `{tenant}` placeholder.
+        """
+        return "{tenant}" in self.domain
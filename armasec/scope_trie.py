@@ -0,0 +1,83 @@
+"""
+This module defines a trie of token permissions for wildcard and hierarchical scope matching.
+
+Permissions and scopes are split into segments on ":". A permission grants a scope if each of its
+segments equals the scope's segment at the same position or is `*`, and the scope has at least as
+many segments. So `jobs:*` and `*:read` grant `jobs:read`, and `admin` grants every scope under
+`admin:`, like `admin:users:delete`.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Tuple
+
+from armasec.permission_registry import permission_registry
+
+SEPARATOR = ":"
+WILDCARD = "*"
+
+# Marks a node at which a permission ends. Not a string, so it cannot collide with a segment
+GRANTS = object()
+
+
+class ScopeTrie:
+    """
+    An index of a token's permissions by segment.
+
+    Matching a scope walks at most two branches per segment, the exact segment and the wildcard,
+    so it depends on the depth of the scope rather than the number of permissions. Build tries
+    with `scope_trie()`, which caches them per distinct set of permissions.
+    """
+
+    def __init__(self, permissions: Iterable[str]):
+        """
+        Initializes the ScopeTrie.
+
+        Args:
+            permissions: The permissions of a token.
+        """
+        self.root: Dict[Any, Any] = dict()
+        for permission in permissions:
+            node = self.root
+            for segment in permission.split(SEPARATOR):
+                node = node.setdefault(segment, dict())
+            node[GRANTS] = True
+        self._masks: Dict[Tuple[str, ...], int] = dict()
+
+    def grants(self, scope: str) -> bool:
+        """
+        Check if any of the permissions grants a scope.
+        """
+        return _walk(self.root, scope.split(SEPARATOR), 0)
+
+    def mask(self, scopes: Tuple[str, ...]) -> int:
+        """
+        Get the mask of the scopes granted by the permissions in the app-wide PermissionRegistry.
+        Memoized per group of scopes, like the scopes of a route policy.
+        """
+        mask = self._masks.get(scopes)
+        if mask is None:
+            mask = permission_registry.compile(
+                tuple(scope for scope in scopes if self.grants(scope))
+            )
+            self._masks[scopes] = mask
+        return mask
+
+
+@lru_cache(maxsize=1024)
+def scope_trie(permissions: FrozenSet[str]) -> ScopeTrie:
+    """
+    Get the ScopeTrie for a set of permissions. Tokens with the same permissions share a trie.
+    """
+    return ScopeTrie(permissions)
+
+
+def _walk(node: Dict[Any, Any], segments: List[str], index: int) -> bool:
+    if GRANTS in node:
+        return True
+    if index == len(segments):
+        return False
+    child = node.get(segments[index])
+    if child is not None and _walk(child, segments, index + 1):
+        return True
+    wildcard = node.get(WILDCARD)
+    return wildcard is not None and wildcard is not child and _walk(wildcard, segments, index + 1)
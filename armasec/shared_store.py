@@ -0,0 +1,196 @@
+"""
+This module provides a host-local SharedJwksStore so that pre-fork workers can share OIDC resources.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from armasec.utilities import noop
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+MAGIC = b"ARMASEC1"
+HEADER = struct.Struct("<8sQI")
+GENERATION_OFFSET = len(MAGIC)
+
+
+class SharedJwksStore:
+    """
+    A memory-mapped file that holds the openid config and jwks of each domain for all the worker
+    processes on a host.
+
+    The file starts with a header holding a magic marker, a generation counter, and the length of a
+    JSON document that maps each domain to its resources. Writers hold an exclusive lock on the
+    file and bump the generation after the document is written. Readers only need to compare the
+    generation to know if anything changed, which is a single read from the mapped memory.
+
+    A separate refresh lock makes sure that only one worker at a time refreshes a domain from the
+    OIDC provider while the others keep serving what is in the store.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 4 * 1024 * 1024,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the SharedJwksStore. Raises OSError if the store cannot be opened.
+
+        Args:
+            path:         The path of the file backing the store. It is created if it is missing.
+            size:         The size in bytes of the file backing the store.
+            debug_logger: A callable, that if provided, will allow debug logging. Should be passed
+                          as a logger method like `logger.debug`
+        """
+        if fcntl is None:
+            raise OSError("A shared store requires fcntl file locking")
+
+        self.path = path
+        self.size = size
+        self.debug_logger = debug_logger if debug_logger else noop
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._refresh_fd = os.open(f"{self.path}.refresh", os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+            self._mmap = mmap.mmap(self._fd, self.size)
+            (magic, _, _) = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                self.debug_logger(f"Initializing shared store at {self.path}")
+                HEADER.pack_into(self._mmap, 0, MAGIC, 0, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reopen(self):
+        """
+        Reopen the file descriptors and memory map. Used to reset the store in a forked child.
+        """
+        self.close()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._open()
+
+    def close(self):
+        """
+        Close the memory map and file descriptors of the store.
+        """
+        self._mmap.close()
+        os.close(self._fd)
+        os.close(self._refresh_fd)
+
+    @property
+    def generation(self) -> int:
+        """
+        The generation counter of the store. It is bumped on every write.
+        """
+        return struct.unpack_from("<Q", self._mmap, GENERATION_OFFSET)[0]
+
+    def read(self) -> Dict[str, Any]:
+        """
+        Read the resources of all domains from the store.
+        """
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                return self._read_unlocked()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, domain: str) -> Optional[Dict[str, Any]]:
+        """
+        Read the resources of a single domain from the store.
+        """
+        return self.read().get(domain)
+
+    def put(self, domain: str, entry: Dict[str, Any]):
+        """
+        Write the resources of a domain to the store and bump its generation.
+
+        Raises ValueError if the resources of all domains do not fit in the store.
+        """
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                (_, generation, _) = HEADER.unpack_from(self._mmap, 0)
+                data = self._read_unlocked()
+                data[domain] = entry
+                encoded = json.dumps(data, separators=(",", ":")).encode("utf-8")
+                if HEADER.size + len(encoded) > self.size:
+                    raise ValueError(f"Shared store at {self.path} is too small for {domain}")
+                self._mmap[HEADER.size : HEADER.size + len(encoded)] = encoded
+                HEADER.pack_into(self._mmap, 0, MAGIC, generation + 1, len(encoded))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def try_acquire_refresh(self) -> bool:
+        """
+        Try to become the worker that refreshes from the OIDC provider. Does not block.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            fcntl.flock(self._refresh_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._refresh_lock.release()
+            return False
+        return True
+
+    def release_refresh(self):
+        """
+        Release the refresh lock acquired with `try_acquire_refresh()`.
+        """
+        fcntl.flock(self._refresh_fd, fcntl.LOCK_UN)
+        self._refresh_lock.release()
+
+    def _read_unlocked(self) -> Dict[str, Any]:
+        (_, _, length) = HEADER.unpack_from(self._mmap, 0)
+        if length == 0:
+            return dict()
+        return json.loads(self._mmap[HEADER.size : HEADER.size + length])
+
+
+_open_stores: Dict[str, Optional[SharedJwksStore]] = dict()
+
+
+def open_shared_store(path: str) -> Optional[SharedJwksStore]:
+    """
+    Open the SharedJwksStore for a path once per process. Returns None if it is unavailable so that
+    callers fall back to fetching from the OIDC provider directly.
+    """
+    if path not in _open_stores:
+        try:
+            _open_stores[path] = SharedJwksStore(path)
+        except OSError:
+            _open_stores[path] = None
+    return _open_stores[path]
+
+
+def _reopen_shared_stores():
+    """
+    Reopen the stores in a forked child. File locks are held per open file, so a child that kept
+    its parent's descriptors would share the parent's refresh lock.
+    """
+    for store in _open_stores.values():
+        if store is not None:
+            try:
+                store.reopen()
+            except OSError:
+                pass
+
+
+os.register_at_fork(after_in_child=_reopen_shared_stores)
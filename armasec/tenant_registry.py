@@ -0,0 +1,265 @@
+"""
+This module provides a TenantRegistry that resolves managers on demand for a templated domain.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Optional
+
+from armasec.exceptions import AuthenticationError
+from armasec.schemas import DomainConfig
+from armasec.utilities import noop
+
+if TYPE_CHECKING:
+    from armasec.token_security import ManagerConfig
+
+
+TENANT_PLACEHOLDER = "{tenant}"
+
+# A tenant may not start with a dot, so that it cannot be "." or ".." in the issuer's path
+TENANT_PATTERN = "[A-Za-z0-9_-][A-Za-z0-9._-]*"
+
+
+class TenantRegistry:
+    """
+    Resolve and cache the managers for the tenants of a templated domain.
+
+    A templated domain, like `auth.example.com/realms/{tenant}`, describes many OIDC issuers that
+    share the same configuration. Managers are only loaded for a tenant when a token issued by it
+    is seen. The least recently used tenants are evicted when the registry is full or when they
+    have been idle for too long.
+
+    Since tenants are named by the tokens of anonymous clients, a tenant that fails to load is not
+    loaded again for `tenant_failure_ttl` seconds, and at most `max_tenant_loads` tenants are loaded
+    at once. Requests for other tenants are rejected until a load finishes.
+    """
+
+    def __init__(
+        self,
+        domain_config: DomainConfig,
+        build_manager_config: Callable[[DomainConfig], "ManagerConfig"],
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes a TenantRegistry.
+
+        Args:
+            domain_config:        The templated DomainConfig. Its `domain` must contain the
+                                  `{tenant}` placeholder.
+            build_manager_config: A callable that loads the ManagerConfig for a tenant's
+                                  DomainConfig.
+            debug_logger:         A callable, that if provided, will allow debug logging. Should be
+                                  passed as a logger method like `logger.debug`
+        """
+        AuthenticationError.require_condition(
+            TENANT_PLACEHOLDER in domain_config.domain,
+            f"Domain {domain_config.domain} is not templated with {TENANT_PLACEHOLDER}",
+        )
+        self.domain_config = domain_config
+        self.build_manager_config = build_manager_config
+        self.debug_logger = debug_logger if debug_logger else noop
+
+        # Counts "hits", "misses", "evictions", "rejected" and "failed" tenant loads, along with
+        # the loads "suppressed" after a recent failure and "throttled" by the concurrency cap
+        self.stats: Counter = Counter()
+
+        protocol = "https" if domain_config.use_https else "http"
+        (prefix, suffix) = domain_config.domain.split(TENANT_PLACEHOLDER, 1)
+        self._issuer_pattern = re.compile(
+            f"{protocol}://{re.escape(prefix)}(?P<tenant>{TENANT_PATTERN}){re.escape(suffix)}/?"
+        )
+        self._tenant_pattern = re.compile(TENANT_PATTERN)
+        self._managers: OrderedDict[str, "ManagerConfig"] = OrderedDict()
+        self._last_used: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+        self._tenant_locks: Dict[str, threading.Lock] = dict()
+        self._failed: OrderedDict[str, float] = OrderedDict()
+        self._load_slots = threading.BoundedSemaphore(domain_config.max_tenant_loads)
+
+    def tenant_from_issuer(self, issuer: Optional[str]) -> Optional[str]:
+        """
+        Extract the tenant from a token's `iss` claim. Returns None if it does not match the
+        templated domain.
+        """
+        if not issuer:
+            return None
+        match = self._issuer_pattern.fullmatch(issuer)
+        return match.group("tenant") if match else None
+
+    def resolve_issuer(self, issuer: Optional[str]) -> Optional["ManagerConfig"]:
+        """
+        Resolve the manager for the tenant that issued a token. Returns None if the issuer does not
+        belong to the templated domain or if the tenant's manager could not be loaded.
+        """
+        tenant = self.tenant_from_issuer(issuer)
+        if tenant is None:
+            return None
+        try:
+            return self.get(tenant)
+        except AuthenticationError as err:
+            self.debug_logger(f"Failed to load tenant {tenant}: {err}")
+            return None
+
+    def get(self, tenant: str) -> "ManagerConfig":
+        """
+        Get the manager for a tenant, loading it if it is not resident.
+
+        Concurrent loads of the same tenant are single-flighted. Raises an AuthenticationError
+        without loading the tenant if it failed to load recently or if too many tenants are
+        already loading.
+        """
+        return self._get(tenant, wait_for_slot=False)
+
+    def _get(self, tenant: str, wait_for_slot: bool) -> "ManagerConfig":
+        AuthenticationError.require_condition(
+            self._tenant_pattern.fullmatch(tenant), f"Invalid tenant {tenant!r}"
+        )
+        with self._lock:
+            self._evict_idle()
+            manager_config = self._touch(tenant)
+            if manager_config is not None:
+                self.stats["hits"] += 1
+                return manager_config
+            tenant_lock = self._tenant_locks.setdefault(tenant, threading.Lock())
+
+        with tenant_lock:
+            with self._lock:
+                manager_config = self._touch(tenant)
+            if manager_config is not None:
+                self.stats["hits"] += 1
+                return manager_config
+
+            self.stats["misses"] += 1
+            try:
+                with self._lock:
+                    self._check_failed(tenant)
+                if not self._load_slots.acquire(blocking=wait_for_slot):
+                    self.stats["throttled"] += 1
+                    raise AuthenticationError(f"Too many tenants are loading to load {tenant}")
+                try:
+                    manager_config = self._load(tenant)
+                except AuthenticationError:
+                    with self._lock:
+                        self._remember_failure(tenant)
+                    raise
+                finally:
+                    self._load_slots.release()
+                with self._lock:
+                    self._managers[tenant] = manager_config
+                    self._last_used[tenant] = time.monotonic()
+                    self._evict_overflow()
+            finally:
+                with self._lock:
+                    self._tenant_locks.pop(tenant, None)
+
+        return manager_config
+
+    def prefetch(self, tenants: Iterable[str]):
+        """
+        Load the managers for hot tenants ahead of their first request.
+
+        Loads run concurrently, bounded by the domain's `prefetch_concurrency`. Tenants that fail
+        to load are skipped.
+        """
+        with ThreadPoolExecutor(
+            max_workers=self.domain_config.prefetch_concurrency,
+            thread_name_prefix="armasec-prefetch",
+        ) as executor:
+            futures = [executor.submit(self._get, tenant, True) for tenant in tenants]
+            for future in futures:
+                try:
+                    future.result()
+                except AuthenticationError as err:
+                    self.debug_logger(f"Failed to prefetch tenant: {err}")
+
+    def after_fork(self):
+        """
+        Replace the locks that may have been held by another thread when the process forked and
+        reset the resident tenants' loaders.
+        """
+        self._lock = threading.Lock()
+        self._tenant_locks = dict()
+        self._load_slots = threading.BoundedSemaphore(self.domain_config.max_tenant_loads)
+        for manager_config in self._managers.values():
+            if manager_config.loader is not None:
+                manager_config.loader.after_fork()
+
+    def metrics(self) -> dict:
+        """
+        Report the number of resident tenants and the registry's counters.
+        """
+        return dict(
+            domain=self.domain_config.domain,
+            resident_tenants=len(self._managers),
+            **self.stats,
+        )
+
+    def _load(self, tenant: str) -> "ManagerConfig":
+        self.debug_logger(f"Loading manager for tenant {tenant}")
+        tenant_config = self.domain_config.model_copy(
+            update=dict(domain=self.domain_config.domain.replace(TENANT_PLACEHOLDER, tenant)),
+        )
+        with AuthenticationError.handle_errors(f"Failed to load manager for tenant {tenant}"):
+            manager_config = self.build_manager_config(tenant_config)
+
+        key_count = len(manager_config.manager.token_decoder.jwks.keys)
+        if key_count > self.domain_config.max_keys_per_tenant:
+            self.stats["rejected"] += 1
+            raise AuthenticationError(
+                f"Tenant {tenant} has {key_count} keys which exceeds the maximum of "
+                f"{self.domain_config.max_keys_per_tenant}"
+            )
+        return manager_config
+
+    def _check_failed(self, tenant: str):
+        retry_at = self._failed.get(tenant)
+        if retry_at is None:
+            return
+        if retry_at > time.monotonic():
+            self.stats["suppressed"] += 1
+            raise AuthenticationError(f"Tenant {tenant} failed to load recently")
+        del self._failed[tenant]
+
+    def _remember_failure(self, tenant: str):
+        """
+        Keep a tenant that failed to load from being loaded again until the failure TTL elapses.
+        The failures are bounded like the resident tenants, so the oldest ones are forgotten first.
+        """
+        self.stats["failed"] += 1
+        self._failed.pop(tenant, None)
+        self._failed[tenant] = time.monotonic() + self.domain_config.tenant_failure_ttl
+        while len(self._failed) > self.domain_config.max_tenants:
+            self._failed.popitem(last=False)
+
+    def _touch(self, tenant: str) -> Optional["ManagerConfig"]:
+        manager_config = self._managers.get(tenant)
+        if manager_config is not None:
+            self._managers.move_to_end(tenant)
+            self._last_used[tenant] = time.monotonic()
+        return manager_config
+
+    def _evict_overflow(self):
+        while len(self._managers) > self.domain_config.max_tenants:
+            (tenant, _) = self._managers.popitem(last=False)
+            self._last_used.pop(tenant, None)
+            self.stats["evictions"] += 1
+            self.debug_logger(f"Evicted least recently used tenant {tenant}")
+
+    def _evict_idle(self):
+        idle_timeout = self.domain_config.tenant_idle_timeout
+        if idle_timeout is None:
+            return
+        cutoff = time.monotonic() - idle_timeout
+        while self._managers:
+            tenant = next(iter(self._managers))
+            if self._last_used[tenant] > cutoff:
+                break
+            self._managers.popitem(last=False)
+            self._last_used.pop(tenant)
+            self.stats["evictions"] += 1
+            self.debug_logger(f"Evicted idle tenant {tenant}")
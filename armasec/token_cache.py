@@ -0,0 +1,419 @@
+"""
+This module provides a TokenCache with pluggable backends for verified token payloads.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from armasec.utilities import noop
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+ENTRY_HEADER = struct.Struct("<d")
+
+
+def encode_entry(payload: Dict[str, Any], expires_at: float) -> bytes:
+    """
+    Serialize a payload into a compact entry that carries its expiry.
+    """
+    return ENTRY_HEADER.pack(expires_at) + json.dumps(payload, separators=(",", ":")).encode()
+
+
+def decode_entry(entry: bytes) -> Tuple[float, Dict[str, Any]]:
+    """
+    Deserialize an entry produced by `encode_entry()` into its expiry and payload.
+    """
+    (expires_at,) = ENTRY_HEADER.unpack_from(entry, 0)
+    payload = json.loads(entry[ENTRY_HEADER.size :])
+    if not isinstance(payload, dict):
+        raise ValueError("A token cache entry must hold an object")
+    return (expires_at, payload)
+
+
+class TokenCacheBackend(ABC):
+    """
+    Base class for the stores that hold verified token payloads.
+
+    Backends store opaque entries that should not be returned after their expiry.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Retrieve an entry. Returns None if it is missing or expired.
+        """
+
+    @abstractmethod
+    def set(self, key: str, entry: bytes, expires_at: float):
+        """
+        Store an entry until its expiry.
+        """
+
+    def delete(self, key: str):
+        """
+        Remove an entry, like one that could not be decoded. Backends that cannot remove entries
+        leave them to expire.
+        """
+
+    def reset(self):
+        """
+        Reset any process-local state such as connections or locks. Called in forked children.
+        """
+
+
+class InMemoryTokenCache(TokenCacheBackend):
+    """
+    An in-process, least recently used store.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        """
+        Initializes the InMemoryTokenCache.
+
+        Args:
+            max_entries: The maximum number of entries to hold before evicting the least recently
+                         used one.
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            (expires_at, entry) = item
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: bytes, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def reset(self):
+        self._lock = threading.Lock()
+
+
+class SharedMemoryTokenCache(TokenCacheBackend):
+    """
+    A host-local store held in a memory-mapped file that is shared by all worker processes.
+
+    The file is a direct-mapped table of fixed-size slots. Each slot holds the hashed key, the
+    expiry, and the entry. A new entry overwrites whatever occupies its slot, so the store never
+    grows beyond its file. Entries that do not fit in a slot are not stored.
+    """
+
+    SLOT_HEADER = struct.Struct("<32sdI")
+
+    def __init__(self, path: str, slots: int = 4096, slot_size: int = 2048):
+        """
+        Initializes the SharedMemoryTokenCache. Raises OSError if the file cannot be opened.
+
+        Args:
+            path:      The path of the file backing the store. It is created if it is missing.
+            slots:     The number of slots in the table.
+            slot_size: The size in bytes of each slot, including its header.
+        """
+        if fcntl is None:
+            raise OSError("A shared memory token cache requires fcntl file locking")
+
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._open()
+
+    def _open(self):
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.slots * self.slot_size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+
+    def _locate(self, key: str) -> Tuple[bytes, int]:
+        digest = hashlib.sha256(key.encode()).digest()
+        return (digest, (int.from_bytes(digest[:8], "little") % self.slots) * self.slot_size)
+
+    def get(self, key: str) -> Optional[bytes]:
+        (digest, offset) = self._locate(key)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                (slot_digest, expires_at, length) = self.SLOT_HEADER.unpack_from(self._mmap, offset)
+                if slot_digest != digest or expires_at <= time.time():
+                    return None
+                start = offset + self.SLOT_HEADER.size
+                return self._mmap[start : start + length]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def set(self, key: str, entry: bytes, expires_at: float):
+        if self.SLOT_HEADER.size + len(entry) > self.slot_size:
+            return
+        (digest, offset) = self._locate(key)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                start = offset + self.SLOT_HEADER.size
+                self._mmap[start : start + len(entry)] = entry
+                self.SLOT_HEADER.pack_into(self._mmap, offset, digest, expires_at, len(entry))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def delete(self, key: str):
+        (digest, offset) = self._locate(key)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                (slot_digest, _, _) = self.SLOT_HEADER.unpack_from(self._mmap, offset)
+                if slot_digest == digest:
+                    self.SLOT_HEADER.pack_into(self._mmap, offset, bytes(32), 0.0, 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reset(self):
+        self._mmap.close()
+        os.close(self._fd)
+        self._open()
+
+
+class RedisTokenCache(TokenCacheBackend):
+    """
+    A store that speaks the Redis protocol (RESP) to a Redis compatible server.
+
+    Entries are written with `SET key value PX ttl` so the server expires them along with the
+    token. The connection is opened lazily and re-opened after any error.
+
+    Commands are sent over a blocking socket. On an event loop, each call blocks the loop until
+    the server answers or the socket `timeout` elapses. A call that exceeds the TokenCache's
+    latency budget bypasses the backend for a cooldown period, so a slow server stalls the loop
+    for at most `timeout` seconds per cooldown. Keep the server on the same host or network and
+    the timeout close to the latency budget.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        timeout: float = 0.05,
+        prefix: str = "armasec:",
+    ):
+        """
+        Initializes the RedisTokenCache.
+
+        Args:
+            host:    The host of the Redis compatible server.
+            port:    The port of the Redis compatible server.
+            timeout: The socket timeout in seconds for connecting and for each command.
+            prefix:  A prefix added to every key stored in the server.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._reader: Any = None
+
+    def _connect(self):
+        if self._socket is None:
+            self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._reader = self._socket.makefile("rb")
+
+    def _command(self, *args: bytes) -> Optional[bytes]:
+        request = b"*%d\r\n" % len(args) + b"".join(
+            b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in args
+        )
+        with self._lock:
+            try:
+                self._connect()
+                assert self._socket is not None
+                self._socket.sendall(request)
+                return self._read_reply()
+            except Exception:
+                self.reset()
+                raise
+
+    def _read_reply(self) -> Optional[bytes]:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection to the Redis server was closed")
+        (kind, rest) = (line[:1], line[1:-2])
+        if kind == b"-":
+            raise ConnectionError(f"Redis server error: {rest.decode()}")
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._reader.read(length + 2)[:-2]
+        return rest
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command(b"GET", (self.prefix + key).encode())
+
+    def set(self, key: str, entry: bytes, expires_at: float):
+        ttl = int((expires_at - time.time()) * 1000)
+        if ttl <= 0:
+            return
+        self._command(b"SET", (self.prefix + key).encode(), entry, b"PX", str(ttl).encode())
+
+    def delete(self, key: str):
+        self._command(b"DEL", (self.prefix + key).encode())
+
+    def reset(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+
+class TokenCache:
+    """
+    Cache verified token payloads in a TokenCacheBackend.
+
+    Keys are hashed from the token, the claims it was verified against, and a namespace that
+    identifies the decoder. If a backend call fails or takes longer than the latency budget, the
+    backend is bypassed for a cooldown period so that a slow cache never slows down verification.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[TokenCacheBackend] = None,
+        latency_budget: float = 0.005,
+        bypass_cooldown: float = 30.0,
+        max_ttl: Optional[float] = None,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the TokenCache.
+
+        Args:
+            backend:         The backend that stores the entries. Defaults to an
+                             InMemoryTokenCache.
+            latency_budget:  The number of seconds a backend call may take before the backend is
+                             bypassed. Backend calls are synchronous, so a remote backend like
+                             the RedisTokenCache blocks the event loop for the duration of a call.
+            bypass_cooldown: The number of seconds the backend is bypassed after a slow or failed
+                             call.
+            max_ttl:         Optional maximum number of seconds to cache a payload. If not
+                             provided, payloads are cached until the token expires.
+            debug_logger:    A callable, that if provided, will allow debug logging. Should be
+                             passed as a logger method like `logger.debug`
+        """
+        self.backend = backend if backend is not None else InMemoryTokenCache()
+        self.latency_budget = latency_budget
+        self.bypass_cooldown = bypass_cooldown
+        self.max_ttl = max_ttl
+        self.debug_logger = debug_logger if debug_logger else noop
+
+        # Counts "hits", "misses", "sets", "errors", "slow" calls, "bypassed" calls and "corrupt"
+        # entries
+        self.stats: Counter = Counter()
+        self._bypass_until = 0.0
+
+    @staticmethod
+    def build_key(namespace: str, token: str, claims: Dict[str, Any]) -> str:
+        """
+        Build a cache key for a token verified against the given claims.
+        """
+        material = "\0".join([namespace, json.dumps(claims, sort_keys=True, default=str), token])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    @property
+    def bypassed(self) -> bool:
+        """
+        Indicate if the backend is currently bypassed.
+        """
+        return time.monotonic() < self._bypass_until
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve a cached payload. Returns None on a miss or if the backend is bypassed.
+        """
+        entry = self._call(self.backend.get, key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        try:
+            (expires_at, payload) = decode_entry(entry)
+        except Exception as err:
+            # A corrupt entry is a miss, and is dropped so that it is replaced by the next set
+            self.stats["corrupt"] += 1
+            self.stats["misses"] += 1
+            self.debug_logger(f"Dropping undecodable token cache entry: {err}")
+            self._call(self.backend.delete, key)
+            return None
+        if expires_at <= time.time():
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        return payload
+
+    def set(self, key: str, payload: Dict[str, Any], expires_at: Optional[float]):
+        """
+        Cache a payload until it expires. Payloads without an expiry are not cached.
+        """
+        if expires_at is None:
+            return
+        if self.max_ttl is not None:
+            expires_at = min(expires_at, time.time() + self.max_ttl)
+        self._call(self.backend.set, key, encode_entry(payload, expires_at), expires_at)
+        self.stats["sets"] += 1
+
+    def reset(self):
+        """
+        Reset the backend's process-local state. Called in forked children.
+        """
+        self.backend.reset()
+        self._bypass_until = 0.0
+
+    def _call(self, method: Callable[..., Any], *args: Any) -> Any:
+        if self.bypassed:
+            self.stats["bypassed"] += 1
+            return None
+
+        start = time.monotonic()
+        try:
+            return method(*args)
+        except Exception as err:
+            self.stats["errors"] += 1
+            self.debug_logger(f"Token cache backend failed. Bypassing it: {err}")
+            self._bypass_until = time.monotonic() + self.bypass_cooldown
+            return None
+        finally:
+            elapsed = time.monotonic() - start
+            if elapsed > self.latency_budget:
+                self.stats["slow"] += 1
+                self.debug_logger(f"Token cache backend took {elapsed}s. Bypassing it")
+                self._bypass_until = time.monotonic() + self.bypass_cooldown
@@ -7,10 +7,10 @@ from __future__ import annotations
 from functools import partial
 from typing import Callable
 
-from jose import jwt
-
 from armasec.exceptions import AuthenticationError, PayloadMappingError
+from armasec.role_map import RoleMap
 from armasec.schemas.jwks import JWKs
+from armasec.token_cache import TokenCache
 from armasec.token_payload import TokenPayload
 from armasec.utilities import log_error, noop
 
@@ -21,6 +21,7 @@ class TokenDecoder:
     """
 
     algorithm: str
+    _decode_keys: dict[str, dict]
 
     def __init__(
         self,
@@ -29,6 +30,9 @@ class TokenDecoder:
         debug_logger: Callable[..., None] | None = None,
         decode_options_override: dict | None = None,
         permission_extractor: Callable[[dict], list[str]] | None = None,
+        token_cache: TokenCache | None = None,
+        cache_namespace: str = "",
+        role_map: RoleMap | None = None,
     ):
         """
         Initializes a TokenDecoder.
@@ -76,12 +80,37 @@ class TokenDecoder:
                                          resource_key = decoded_token["azp"]
                                          return decoded_token["resource_access"][resource_key]["roles"]
                                      ```
+            token_cache:             Optional TokenCache used to skip verification of tokens that
+                                     were already verified by this decoder.
+            cache_namespace:         Identifies the decoder in the keys of the token cache so that
+                                     payloads verified by one decoder are never served by another.
+            role_map:                Optional RoleMap that expands the permissions, after the
+                                     permission_extractor is applied, into the roles and
+                                     permissions they grant.
         """
         self.algorithm = algorithm
         self.jwks = jwks
         self.debug_logger = debug_logger if debug_logger else noop
         self.decode_options_override = decode_options_override if decode_options_override else {}
         self.permission_extractor = permission_extractor
+        self.token_cache = token_cache
+        self.cache_namespace = cache_namespace
+        self.role_map = role_map
+
+    @property
+    def jwks(self) -> JWKs:
+        """
+        The JSON web keys used for decoding.
+        """
+        return self._jwks
+
+    @jwks.setter
+    def jwks(self, jwks: JWKs):
+        """
+        Replace the JSON web keys and prepare the decode keys indexed by their 'kid'.
+        """
+        self._jwks = jwks
+        self._decode_keys = {jwk.kid: jwk.model_dump() for jwk in jwks.keys}
 
     def get_decode_key(self, token: str) -> dict:
         """
@@ -93,6 +122,9 @@ class TokenDecoder:
         Args:
             token: The token to match against available JWKs.
         """
+        # Deferred so that importing armasec does not import python-jose
+        from jose import jwt
+
         self.debug_logger("Getting decode key from JWKs")
         unverified_header = jwt.get_unverified_header(token)
         self.debug_logger(f"Extraced unverified header: {unverified_header}")
@@ -102,13 +134,14 @@ class TokenDecoder:
             "Unverified header doesn't contain 'kid'...not sure how this happened",
         )
 
-        for jwk in self.jwks.keys:
-            self.debug_logger(f"Checking key in jwk: {jwk}")
-            if jwk.kid == kid:
-                self.debug_logger("Key matches unverified header. Using as decode secret.")
-                return jwk.model_dump()
+        decode_key = self._decode_keys.get(kid)
+        AuthenticationError.require_condition(decode_key, "Could not find a matching jwk")
+        self.debug_logger("Key matches unverified header. Using as decode secret.")
+
+        # make static type analyzer happy :)
+        assert decode_key is not None
 
-        raise AuthenticationError("Could not find a matching jwk")
+        return decode_key
 
     def decode(self, token: str, **claims) -> TokenPayload:
         """
@@ -118,8 +151,20 @@ class TokenDecoder:
             token:  The token to decode.
             claims: Additional claims to verify in the token.
         """
+        # Deferred so that importing armasec does not import python-jose
+        from jose import jwt
+
         self.debug_logger(f"Attempting to decode '{token}'")
         self.debug_logger(f"  checking claims: {claims}")
+
+        cache_key = None
+        if self.token_cache is not None:
+            cache_key = self.token_cache.build_key(self.cache_namespace, token, claims)
+            cached_payload = self.token_cache.get(cache_key)
+            if cached_payload is not None:
+                self.debug_logger("Found verified payload in token cache")
+                return self._build_payload(cached_payload, token)
+
         with AuthenticationError.handle_errors(
             "Failed to decode token string",
             do_except=partial(log_error, self.debug_logger),
@@ -135,6 +180,22 @@ class TokenDecoder:
             )
             self.debug_logger(f"Raw payload dictionary is {payload_dict}")
 
+        token_payload = self.map_claims(payload_dict, token)
+
+        if self.token_cache is not None and cache_key is not None:
+            self.token_cache.set(cache_key, payload_dict, expires_at=payload_dict.get("exp"))
+
+        return token_payload
+
+    def map_claims(self, payload_dict: dict, token: str) -> TokenPayload:
+        """
+        Map verified claims, like those of a decoded token or an introspection response, to a
+        TokenPayload. The permissions are extracted into the payload dictionary in place.
+
+        Args:
+            payload_dict: The verified claims.
+            token:        The token the claims were verified from.
+        """
         with PayloadMappingError.handle_errors(
             "Failed to map decoded token to TokenPayload",
             do_except=partial(log_error, self.debug_logger),
@@ -147,12 +208,27 @@ class TokenDecoder:
                 )
 
             self.debug_logger("Attempting to convert to TokenPayload")
-            token_payload = TokenPayload(
-                **payload_dict,
-                original_token=token,
-            )
+            token_payload = self._build_payload(payload_dict, token)
             self.debug_logger(f"Built token_payload as {token_payload}")
-            return token_payload
+        return token_payload
+
+    def _build_payload(self, payload_dict: dict, token: str) -> TokenPayload:
+        """
+        Build a TokenPayload, expanding its permissions through the role map if there is one.
+
+        The payload dictionary is left unexpanded so that cached payloads pick up a reloaded map.
+        """
+        if self.role_map is None:
+            return TokenPayload(**payload_dict, original_token=token)
+
+        expansion = self.role_map.expand(payload_dict.get("permissions", ()))
+        token_payload = TokenPayload(
+            **{**payload_dict, "permissions": list(expansion)},
+            original_token=token,
+        )
+        # The expansion is cached, so its frozenset is shared instead of built again
+        token_payload._permission_set = expansion
+        return token_payload
 
 
 def extract_keycloak_permissions(decoded_token: dict) -> list[str]:
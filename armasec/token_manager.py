@@ -2,16 +2,13 @@
 This module defines a TokenManager that can be used to extract token payloads from request headers.
 """
 
-from typing import Callable, Optional, Union
-
-from fastapi.security.utils import get_authorization_scheme_param
-from starlette.datastructures import Headers
+from typing import Callable, Mapping, Optional
 
 from armasec.exceptions import AuthenticationError
 from armasec.schemas import OpenidConfig
 from armasec.token_decoder import TokenDecoder
 from armasec.token_payload import TokenPayload
-from armasec.utilities import noop
+from armasec.utilities import get_authorization_scheme_param, noop
 
 
 class TokenManager:
@@ -51,7 +48,7 @@ class TokenManager:
         self.openid_config = openid_config
         self.token_decoder = token_decoder
 
-    def unpack_token_from_header(self, headers: Union[Headers, dict]) -> str:
+    def unpack_token_from_header(self, headers: Mapping[str, str]) -> str:
         """
         Unpack a JWT from a request header.
 
@@ -79,7 +76,7 @@ class TokenManager:
         )
         return token
 
-    def extract_token_payload(self, headers: Union[Headers, dict]) -> TokenPayload:
+    def extract_token_payload(self, headers: Mapping[str, str]) -> TokenPayload:
         """
         Retrieve a token from a request header and decode it into a TokenPayload.
 
@@ -2,10 +2,13 @@
 This module defines a pydantic schema for the payload of a jwt.
 """
 
+import hashlib
 from datetime import datetime
-from typing import List, Optional
+from typing import FrozenSet, List, Optional, Tuple
 
-from pydantic import ConfigDict, BaseModel, Field, AliasChoices
+from pydantic import ConfigDict, BaseModel, Field, AliasChoices, PrivateAttr
+
+from armasec.permission_registry import permission_registry
 
 
 class TokenPayload(BaseModel):
@@ -27,6 +30,56 @@ class TokenPayload(BaseModel):
     original_token: Optional[str] = None
     model_config = ConfigDict(extra="allow")
 
+    _permission_set: Optional[FrozenSet[str]] = PrivateAttr(None)
+    _token_digest: Optional[bytes] = PrivateAttr(None)
+    _permission_mask: Tuple[int, int] = PrivateAttr((-1, 0))
+
+    @property
+    def permission_set(self) -> FrozenSet[str]:
+        """
+        The permissions as a frozenset. Built once per payload so that repeated checks are cheap.
+        """
+        if self._permission_set is None:
+            self._permission_set = frozenset(self.permissions)
+        return self._permission_set
+
+    @property
+    def permission_mask(self) -> int:
+        """
+        The permissions as a bitmask of the app-wide PermissionRegistry. Only rebuilt if
+        permissions were interned since it was last built.
+        """
+        # Read the private attributes directly since pydantic resolves them in a slow __getattr__
+        private = self.__pydantic_private__
+        assert private is not None  # make static type analyzer happy
+        (version, mask) = private["_permission_mask"]
+        if version != permission_registry.version:
+            version = permission_registry.version
+            mask = permission_registry.mask(self.permissions)
+            private["_permission_mask"] = (version, mask)
+        return mask
+
+    def which(self, *permissions: str) -> FrozenSet[str]:
+        """
+        Get the permissions from a group of permissions that the token has, like the features a
+        user may use. The whole group is tested with a single mask operation.
+        """
+        query = permission_registry.compile(permissions)
+        held = self.permission_mask & query
+        if held == query:
+            return frozenset(permissions)
+        return frozenset(permission_registry.decode(held))
+
+    @property
+    def token_digest(self) -> Optional[bytes]:
+        """
+        A digest of the original token that identifies it in caches without holding the token.
+        None if the payload was not decoded from a token.
+        """
+        if self._token_digest is None and self.original_token is not None:
+            self._token_digest = hashlib.sha256(self.original_token.encode()).digest()
+        return self._token_digest
+
     def to_dict(self):
         """
         Convert a TokenPayload to the equivalent dictionary returned by `jwt.decode()`.
@@ -2,51 +2,47 @@
 This module defines a TokenSecurity injectable that can be used enforce access on FastAPI routes.
 """
 
-from typing import Callable, Iterable, List, Optional
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Mapping, Optional
 
-from auto_name_enum import AutoNameEnum, auto
-from fastapi import HTTPException, status
+from fastapi import Depends, HTTPException, WebSocketException, status
 from fastapi.openapi.models import APIKey, APIKeyIn
 from fastapi.security.api_key import APIKeyBase
-from pydantic import ConfigDict, BaseModel
-from snick import unwrap
-from starlette.requests import Request
-
-from armasec.exceptions import AuthenticationError, AuthorizationError
-from armasec.openid_config_loader import OpenidConfigLoader
-from armasec.pluggable import plugin_manager
+from starlette.requests import HTTPConnection
+from starlette.websockets import WebSocket, WebSocketState
+
+from armasec.claims_envelope import ClaimsEnvelope
+from armasec.decision_cache import MISS, DecisionCache
+from armasec.exceptions import ArmasecError, AuthenticationError, PluginTimeoutError
+from armasec.permissions import PermissionMode
+from armasec.pluggable import PluginRunner
+from armasec.policy import Policy
+from armasec.revocation import RevocationList
 from armasec.schemas import DomainConfig
-from armasec.token_decoder import TokenDecoder
+from armasec.tenant_registry import TenantRegistry
 from armasec.token_manager import TokenManager
 from armasec.token_payload import TokenPayload
+from armasec.token_session import TokenSession
 from armasec.utilities import noop
+from armasec.verifier import ManagerConfig, Verifier, build_manager_config
 
+__all__ = ["ManagerConfig", "PermissionMode", "TokenSecurity", "build_manager_config"]
 
-class ManagerConfig(BaseModel):
-    """
-    Model class to represent a TokenManager instance and its domain configuration for easier mapping
 
-    Attributes:
-        manager: The TokenManager instance to use for decoding tokens.
-        domain_config: The DomainConfig for the openid server.
+async def _cancel_token_session(connection: HTTPConnection) -> AsyncIterator[None]:
     """
+    Cancel the TokenSession of a websocket once its endpoint returns.
 
-    manager: TokenManager
-    domain_config: DomainConfig
-    model_config = ConfigDict(arbitrary_types_allowed=True)
-
-
-class PermissionMode(AutoNameEnum):
+    This is a sub-dependency of TokenSecurity, so FastAPI runs the cleanup after the endpoint
+    returns, whether the client disconnected or the endpoint failed. Otherwise the timer handle of
+    the session would keep the session and its websocket alive until the token expires.
     """
-    Endpoint permissions.
-
-    Attributes:
-        ALL:  Require all listed permissions.
-        SOME: Require at least one of the listed permissions.
-    """
-
-    ALL = auto()
-    SOME = auto()
+    try:
+        yield
+    finally:
+        token_session = getattr(connection.state, "token_session", None)
+        if token_session is not None:
+            token_session.cancel()
 
 
 class TokenSecurity(APIKeyBase):
@@ -67,6 +63,17 @@ class TokenSecurity(APIKeyBase):
         debug_logger: Optional[Callable[..., None]] = None,
         debug_exceptions: bool = False,
         skip_plugins: bool = False,
+        verifier: Optional[Verifier] = None,
+        reauth_grace: float = 0.0,
+        claims_envelope: Optional[ClaimsEnvelope] = None,
+        plugin_runner: Optional[PluginRunner] = None,
+        plugins: Optional[Iterable[str]] = None,
+        plugin_tags: Optional[Iterable[str]] = None,
+        requires: Optional[str] = None,
+        match_keys: Optional[Mapping[str, Any]] = None,
+        decision_cache: Optional[DecisionCache] = None,
+        wildcard_scopes: bool = False,
+        revocation_list: Optional[RevocationList] = None,
     ):
         """
         Initializes the TokenSecurity instance.
@@ -80,14 +87,64 @@ class TokenSecurity(APIKeyBase):
             debug_exceptions: If True, raise original exceptions. Should only be used in a testing
                               or debugging context.
             skip_plugins:     If True, do not evaluate plugin validators.
+            verifier:         Optional Verifier to share with other TokenSecurity instances. One
+                              is built for the domain_configs if it is not supplied.
+            reauth_grace:     Seconds a websocket may stay open after its token expires while it
+                              waits for an in-band token refresh. If 0, it is closed at expiry.
+            claims_envelope:  Optional ClaimsEnvelope. If supplied, a valid envelope minted by an
+                              upstream service is accepted in place of verifying the token if
+                              it was issued by one of the domains for its audience. Falls back to
+                              full verification if the envelope is missing or invalid.
+            plugin_runner:    Optional PluginRunner that runs the plugin checks. Configure one
+                              to bound plugin checks with a timeout or to offload sync plugins to
+                              threads. By default, plugins run without a timeout.
+            plugins:          The names of the plugins to run for the route. If neither plugins
+                              nor plugin_tags are supplied, all registered plugins run.
+            plugin_tags:      Run the plugins that declare any of these tags for the route.
+            requires:         A boolean scope expression the token's permissions must satisfy,
+                              like `admin or (read:x and tenant:y)`. Applied along with scopes.
+            match_keys:       Key-value pairs the token payload must contain for the route, with
+                              the same semantics as the `match_keys` of a DomainConfig.
+            decision_cache:   Optional DecisionCache for the decisions made for each token on the
+                              route. Plugins that do not opt in to it run on every request.
+            wildcard_scopes:  If True, token permissions like `jobs:*`, `*:read` or `admin` grant
+                              the scopes they match, like `jobs:read` or `admin:users`.
+            revocation_list:  Optional RevocationList. If supplied, tokens whose `jti`, `sid` or
+                              `sub` were revoked are rejected on every request, before any cached
+                              decision is used.
         """
         self.domain_configs = domain_configs
         self.scopes = scopes
         self.permission_mode = permission_mode
 
+        # Compiled once so that each request only costs a few set operations
+        self.policy = Policy(
+            scopes,
+            permission_mode,
+            requires=requires,
+            match_keys=match_keys,
+            wildcard_scopes=wildcard_scopes,
+        )
+
         self.debug_logger = debug_logger if debug_logger else noop
         self.debug_exceptions = debug_exceptions
         self.skip_plugins = skip_plugins
+        self.reauth_grace = reauth_grace
+        self.claims_envelope = claims_envelope
+        self.revocation_list = revocation_list
+        self.plugin_runner = (
+            plugin_runner
+            if plugin_runner is not None
+            else PluginRunner(debug_logger=self.debug_logger)
+        )
+        self.plugin_selection = self.plugin_runner.select(plugins, plugin_tags)
+
+        # Routes with the same policy and plugin selection share their cached decisions
+        self.decision_cache = decision_cache
+        self.decision_key = (
+            self.policy.key,
+            None if skip_plugins else (self.plugin_selection.names, self.plugin_selection.tags),
+        )
 
         # Settings needed for FastAPI's APIKeyBase
         self.model: APIKey = APIKey(
@@ -97,178 +154,221 @@ class TokenSecurity(APIKeyBase):
         )
         self.scheme_name = self.__class__.__name__
 
-        # This will be lazy loaded at the first request call
-        self.managers: List[ManagerConfig] = list()
+        self.verifier = (
+            verifier
+            if verifier is not None
+            else Verifier(
+                domain_configs,
+                debug_logger=self.debug_logger,
+                debug_exceptions=debug_exceptions,
+            )
+        )
+
+        # Identifies the domain set when memoizing verified payloads on a request
+        self._domains_key = tuple(id(domain_config) for domain_config in domain_configs)
 
-    async def __call__(self, request: Request) -> TokenPayload:
+    async def __call__(
+        self,
+        connection: HTTPConnection,
+        _token_session_cleanup: None = Depends(_cancel_token_session),
+    ) -> TokenPayload:
         """
         This method is called by FastAPI's dependency injection system when a TokenSecurity instance
         is injected to a route endpoint via the Depends() method. Lazily loads the OIDC config,
         the TokenDecoder, and the TokenManager if they are not already initialized.
 
+        WebSocket connections are verified once when they connect. A TokenSession is attached to
+        `websocket.state.token_session` that closes the connection when the token expires unless
+        it is refreshed in-band first. The session is cancelled when the endpoint returns.
+
         Args:
-            request: The FastAPI request to check for secure access.
+            connection: The FastAPI request or websocket to check for secure access.
         """
 
         try:
-            token_payload = self._extract_token_payload_from_manager(request)
+            token_payload = await self._extract_memoized_token_payload(connection)
         except AttributeError:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+            raise self._build_rejection(connection, status.HTTP_403_FORBIDDEN, "Not authorized")
         except Exception as err:
             if self.debug_exceptions:
                 raise err
             else:
-                raise HTTPException(
-                    status_code=getattr(err, "status_code", status.HTTP_401_UNAUTHORIZED),
-                    detail=getattr(err, "detail", "Not authenticated"),
-                    headers={"WWW-Authenticate": "Bearer"},
+                raise self._build_rejection(
+                    connection,
+                    getattr(err, "status_code", status.HTTP_401_UNAUTHORIZED),
+                    getattr(err, "detail", "Not authenticated"),
                 )
 
-        if self.scopes:
-            token_permissions = set(token_payload.permissions)
-            my_permissions = set(self.scopes)
-
-            self.debug_logger(
-                unwrap(
-                    f"""
-                    Checking my permissions {my_permissions} against token_permissions
-                    {token_permissions} using PermissionMode {self.permission_mode}
-                    """
+        try:
+            await self._authorize(connection, token_payload)
+        except Exception as err:
+            if self.debug_exceptions:
+                raise err
+            else:
+                raise self._build_rejection(
+                    connection,
+                    getattr(err, "status_code", status.HTTP_403_FORBIDDEN),
+                    getattr(err, "detail", "Not authorized"),
                 )
+
+        if isinstance(connection, WebSocket) and not hasattr(connection.state, "token_session"):
+            connection.state.token_session = TokenSession(
+                self.verifier,
+                token_payload,
+                on_expire=partial(self._close_expired, connection),
+                authorize=partial(self._authorize, connection),
+                reauth_grace=self.reauth_grace,
+                debug_logger=self.debug_logger,
             )
-            try:
-                if self.permission_mode == PermissionMode.ALL:
-                    message = unwrap(
-                        f"""
-                        Token permissions {token_permissions} missing some required permissions
-                        {my_permissions - token_permissions}
-                        """
-                    )
-                    AuthorizationError.require_condition(
-                        my_permissions - token_permissions == set(),
-                        message,
-                    )
-                elif self.permission_mode == PermissionMode.SOME:
-                    message = unwrap(
-                        f"""
-                        Token permissions {token_permissions} missing at least
-                        one required permissions
-                        {my_permissions}
-                        """
-                    )
-                    AuthorizationError.require_condition(
-                        token_permissions & my_permissions,
-                        message,
-                    )
-                else:
-                    raise AuthorizationError(f"Unknown permission_mode: {self.permission_mode}")
-
-            except Exception as err:
-                if self.debug_exceptions:
-                    raise err
-                else:
-                    raise HTTPException(
-                        status_code=getattr(err, "status_code", status.HTTP_403_FORBIDDEN),
-                        detail=getattr(err, "detail", "Not authorized"),
-                        headers={"WWW-Authenticate": "Bearer"},
-                    )
 
-        if not self.skip_plugins:
-            self.debug_logger("Applying plugin checks")
-            try:
-                plugin_manager.hook.armasec_plugin_check(
-                    request=request,
-                    token_payload=token_payload,
-                    debug_logger=self.debug_logger,
+        return token_payload
+
+    async def _authorize(self, connection: HTTPConnection, token_payload: TokenPayload):
+        """
+        Check the scopes and the plugins of the TokenSecurity against a verified token payload.
+
+        If there is a decision cache, the policy and the plugins that opt in to it are only checked
+        the first time a token is seen for the route's decision key. Revocation is checked first
+        and is never cached.
+        """
+        if self.revocation_list is not None:
+            self.revocation_list.check(token_payload)
+
+        token_digest = token_payload.token_digest
+        if self.decision_cache is None or token_digest is None:
+            if not self.policy.is_empty:
+                self.policy.check(token_payload, debug_logger=self.debug_logger)
+            if not self.skip_plugins:
+                self.debug_logger("Applying plugin checks")
+                await self.plugin_runner.check(
+                    connection, token_payload, self.debug_logger, self.plugin_selection
                 )
-            except Exception as err:
-                if self.debug_exceptions:
-                    raise err
-                else:
-                    raise HTTPException(
-                        status_code=getattr(err, "status_code", status.HTTP_403_FORBIDDEN),
-                        detail=getattr(err, "detail", "Not authorized"),
-                        headers={"WWW-Authenticate": "Bearer"},
-                    )
+            return
+
+        cache_key = (token_digest, self.decision_key)
+        decision = self.decision_cache.get(cache_key)
+        if decision is MISS:
+            decision = await self._decide(connection, token_payload)
+            expire = token_payload.expire
+            self.decision_cache.set(
+                cache_key, decision, expire.timestamp() if expire is not None else None
+            )
+        else:
+            self.debug_logger("Using cached authorization decision")
+        if decision is not None:
+            raise decision
 
-        return token_payload
+        if not self.skip_plugins:
+            self.debug_logger("Applying plugin checks that are not cached")
+            await self.plugin_runner.check(
+                connection,
+                token_payload,
+                self.debug_logger,
+                self.plugin_selection,
+                decision_cacheable=False,
+            )
 
-    def _load_all_managers(self) -> None:
-        if len(self.managers) == 0:
-            for domain_config in self.domain_configs:
-                try:
-                    manager = self._load_manager(domain_config)
-                    self.managers.append(
-                        ManagerConfig(manager=manager, domain_config=domain_config)
-                    )
-                except AuthenticationError:
-                    self.debug_logger(f"Failed to match JWK against domain {domain_config.domain}")
-                except Exception as err:
-                    if self.debug_exceptions:
-                        self.debug_logger(f"Exception caught: {err.__class__.__name__}")
-
-        AuthenticationError.require_condition(
-            len(self.managers) > 0,
-            "Not authenticated: couldn't load any TokenManager instance",
+    async def _decide(
+        self, connection: HTTPConnection, token_payload: TokenPayload
+    ) -> Optional[ArmasecError]:
+        """
+        Check the policy and the plugins that opt in to the decision cache. Returns the error that
+        denied the token, or None if it was allowed. Timeouts and errors that are not
+        ArmasecErrors, like a failed plugin backend, are raised instead of being cached.
+        """
+        try:
+            if not self.policy.is_empty:
+                self.policy.check(token_payload, debug_logger=self.debug_logger)
+            if not self.skip_plugins:
+                self.debug_logger("Applying plugin checks that may be cached")
+                await self.plugin_runner.check(
+                    connection,
+                    token_payload,
+                    self.debug_logger,
+                    self.plugin_selection,
+                    decision_cacheable=True,
+                )
+        except PluginTimeoutError:
+            raise
+        except ArmasecError as err:
+            return err
+        return None
+
+    def _build_rejection(
+        self, connection: HTTPConnection, status_code: int, detail: str
+    ) -> Exception:
+        """
+        Build the exception that rejects a connection in the form its protocol expects.
+        """
+        if isinstance(connection, WebSocket):
+            return WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=detail)
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"WWW-Authenticate": "Bearer"},
         )
 
-    def _load_manager(self, domain_config: DomainConfig) -> TokenManager:
-        self.debug_logger(f"Lazy loading TokenManager for domain {domain_config.domain}")
-        loader = OpenidConfigLoader(
-            domain_config.domain, use_https=domain_config.use_https, debug_logger=self.debug_logger
-        )
-        decoder = TokenDecoder(
-            loader.jwks,
-            domain_config.algorithm,
-            debug_logger=self.debug_logger,
-            permission_extractor=domain_config.permission_extractor,
-        )
-        return TokenManager(
-            loader.config,
-            decoder,
-            audience=domain_config.audience,
-            debug_logger=self.debug_logger,
-        )
+    @staticmethod
+    async def _close_expired(websocket: WebSocket, session: TokenSession):
+        """
+        Close a websocket whose token expired if it is still open.
+        """
+        if WebSocketState.DISCONNECTED in (websocket.application_state, websocket.client_state):
+            return
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
 
-    def _extract_token_payload_from_manager(self, request: Request) -> TokenPayload:
-        token_payload = None
+    @property
+    def managers(self) -> List[ManagerConfig]:
+        """
+        The managers of the statically configured domains loaded by the verifier.
+        """
+        return self.verifier.managers
 
-        self._load_all_managers()
+    @property
+    def tenant_registries(self) -> Dict[str, TenantRegistry]:
+        """
+        The registries that resolve the managers of templated domains.
+        """
+        return self.verifier.tenant_registries
 
-        for manager_config in self.managers:
-            try:
-                token_payload = manager_config.manager.extract_token_payload(request.headers)
-            except Exception as err:
-                self.debug_logger(f"Exception caught: {err.__class__.__name__}")
-            else:
-                AuthenticationError.require_condition(
-                    token_payload is not None,
-                    "Not authenticated: could not find matching JWK"
-                    " with any input domain or token is malformed",
-                )
-                message = "Not authorized: token doesn't contain necessary key-value pairs"
-                for key_to_match, value_to_match in manager_config.domain_config.match_keys.items():
-                    if isinstance(value_to_match, bool):
-                        AuthorizationError.require_condition(
-                            getattr(token_payload, key_to_match) is value_to_match, message
-                        )
-                    elif isinstance(value_to_match, (str, int, float)):
-                        AuthorizationError.require_condition(
-                            getattr(token_payload, key_to_match) == value_to_match,
-                            message,
-                        )
-                    else:
-                        AuthorizationError.require_condition(
-                            set(getattr(token_payload, key_to_match)) & set(value_to_match),
-                            message,
-                        )
-                break
-
-        # make static type analyzer happy :)
-        assert token_payload is not None
+    def _load_all_managers(self) -> None:
+        self.verifier.load_managers()
+
+    async def _extract_memoized_token_payload(self, connection: HTTPConnection) -> TokenPayload:
+        """
+        Extract the token payload once per request and domain set.
 
+        The verified payload is memoized on `connection.state` so that other TokenSecurity
+        dependencies on the same request with the same domains only need to check their scopes
+        and plugins.
+        """
+        payloads = getattr(connection.state, "armasec_payloads", None)
+        if payloads is None:
+            payloads = dict()
+            connection.state.armasec_payloads = payloads
+
+        authorization = connection.headers.get(TokenManager.header_key)
+        envelope = (
+            connection.headers.get(self.claims_envelope.header_name)
+            if self.claims_envelope is not None
+            else None
+        )
+        key = (authorization, envelope, self._domains_key)
+        token_payload = payloads.get(key)
+        if token_payload is None:
+            token_payload = await self._extract_token_payload(authorization, envelope)
+            payloads[key] = token_payload
+        else:
+            self.debug_logger("Using token payload verified earlier in the request")
         return token_payload
+
+    async def _extract_token_payload(
+        self, authorization: Optional[str], envelope: Optional[str]
+    ) -> TokenPayload:
+        if self.claims_envelope is not None and envelope:
+            try:
+                token_payload = self.claims_envelope.verify(envelope, authorization)
+                return self.verifier.check_forwarded(token_payload)
+            except AuthenticationError as err:
+                self.debug_logger(f"Falling back to full verification: {err}")
+        return await self.verifier.verify_async(authorization)
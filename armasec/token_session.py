@@ -0,0 +1,164 @@
+"""
+This module defines a TokenSession that tracks the token of a long-lived connection until expiry.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from armasec.exceptions import AuthenticationError, AuthorizationError
+from armasec.token_payload import TokenPayload
+from armasec.utilities import noop
+from armasec.verifier import Verifier
+
+
+class TokenSession:
+    """
+    Track the token of a long-lived connection, like a WebSocket or a server-sent event stream.
+
+    The token is verified once when the connection is made. Instead of verifying the token again on
+    every message, the session schedules a single timer on the event loop at the token's expiry.
+    Idle connections cost one timer handle each and no running task, so a worker can hold tens of
+    thousands of them.
+
+    When the timer fires, the session is marked `expired`. If there is no re-auth grace period,
+    the `on_expire` callback is called right away to close the connection. Otherwise the client
+    has `reauth_grace` seconds to send a refreshed token in-band before it is called.
+    """
+
+    __slots__ = (
+        "verifier",
+        "token_payload",
+        "on_expire",
+        "authorize",
+        "reauth_grace",
+        "debug_logger",
+        "expired",
+        "closed",
+        "_handle",
+        "_task",
+    )
+
+    refresh_message_type = "token_refresh"
+
+    def __init__(
+        self,
+        verifier: Verifier,
+        token_payload: TokenPayload,
+        on_expire: Optional[Callable[["TokenSession"], Awaitable[None]]] = None,
+        authorize: Optional[Callable[[TokenPayload], Awaitable[None]]] = None,
+        reauth_grace: float = 0.0,
+        debug_logger: Optional[Callable[..., None]] = None,
+    ):
+        """
+        Initializes the TokenSession and schedules its expiry. Must be called in a running event
+        loop.
+
+        Args:
+            verifier:      The Verifier used to check refreshed tokens.
+            token_payload: The verified payload of the token the connection was made with.
+            on_expire:     An async callback that closes the connection once its token has
+                           expired and the re-auth grace period has passed.
+            authorize:     An optional async callback that checks a refreshed payload, like the
+                           scopes of the endpoint. It should raise an ArmasecError if the check
+                           fails.
+            reauth_grace:  Seconds to wait for an in-band refresh after the token expires before
+                           calling `on_expire`.
+            debug_logger:  A callable, that if provided, will allow debug logging. Should be
+                           passed as a logger method like `logger.debug`
+        """
+        self.verifier = verifier
+        self.token_payload = token_payload
+        self.on_expire = on_expire
+        self.authorize = authorize
+        self.reauth_grace = reauth_grace
+        self.debug_logger = debug_logger if debug_logger else noop
+        self.expired = False
+        self.closed = False
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self._schedule()
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """
+        The number of seconds until the token expires, or None if it has no expiry.
+        """
+        if self.token_payload.expire is None:
+            return None
+        return self.token_payload.expire.timestamp() - time.time()
+
+    async def refresh(self, token: str) -> TokenPayload:
+        """
+        Replace the token of the session with a refreshed one and reschedule its expiry.
+
+        The refreshed token must be verified, belong to the same subject, and pass the `authorize`
+        check. Otherwise an ArmasecError is raised and the session keeps its original expiry.
+
+        Args:
+            token: The refreshed token, without the auth scheme.
+        """
+        AuthenticationError.require_condition(not self.closed, "Token session is closed")
+        token_payload = self.verifier.verify(f"Bearer {token}")
+        AuthorizationError.require_condition(
+            token_payload.sub == self.token_payload.sub,
+            "Refreshed token does not belong to the subject of the session",
+        )
+        if self.authorize is not None:
+            await self.authorize(token_payload)
+
+        self.debug_logger(f"Refreshed token session for {token_payload.sub}")
+        self.token_payload = token_payload
+        self.expired = False
+        self._schedule()
+        return token_payload
+
+    async def handle_message(self, message: Any) -> bool:
+        """
+        Handle an in-band refresh message like `{"type": "token_refresh", "token": "..."}`.
+
+        Returns True if the message was a refresh message and was handled, so the caller can skip
+        it. Returns False for any other message. Raises an ArmasecError if the refresh fails.
+
+        Args:
+            message: A decoded message received on the connection.
+        """
+        if not isinstance(message, dict) or message.get("type") != self.refresh_message_type:
+            return False
+        await self.refresh(str(message.get("token", "")))
+        return True
+
+    def cancel(self):
+        """
+        Cancel the expiry timer. Should be called when the connection ends before its token expires.
+        TokenSecurity does this for the websockets it verifies once their endpoint returns.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self.closed = True
+
+    def _schedule(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        remaining = self.remaining
+        if remaining is None:
+            return
+        loop = asyncio.get_running_loop()
+        self._handle = loop.call_at(loop.time() + max(remaining, 0.0), self._expire)
+
+    def _expire(self):
+        self._handle = None
+        if not self.expired and self.reauth_grace > 0:
+            self.debug_logger(f"Token expired for {self.token_payload.sub}; waiting for refresh")
+            self.expired = True
+            self._handle = asyncio.get_running_loop().call_later(self.reauth_grace, self._expire)
+            return
+
+        self.debug_logger(f"Token expired for {self.token_payload.sub}; closing session")
+        self.expired = True
+        self.closed = True
+        if self.on_expire is not None:
+            self._task = asyncio.get_running_loop().create_task(self.on_expire(self))
@@ -3,7 +3,7 @@ Provides some utility functions.
 """
 
 from traceback import format_tb
-from typing import Callable
+from typing import Callable, Optional, Tuple
 
 from buzz import DoExceptParams
 from snick import dedent
@@ -16,6 +16,19 @@ def noop(*args, **kwargs):
     pass
 
 
+def get_authorization_scheme_param(authorization: Optional[str]) -> Tuple[str, str]:
+    """
+    Split the value of an Authorization header into its scheme and its credentials.
+
+    Returns empty strings if the header is missing. Mirrors the helper of the same name in FastAPI
+    so that token extraction does not depend on a web framework.
+    """
+    if not authorization:
+        return "", ""
+    scheme, _, param = authorization.partition(" ")
+    return scheme, param
+
+
 def log_error(logger: Callable[..., None], dep: DoExceptParams):
     """
     Logs an en error with the supplied message, a string representation of the error, and its
@@ -0,0 +1,437 @@
+"""
+This module defines a framework-neutral Verifier that turns an Authorization header into a verified
+TokenPayload.
+"""
+
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+
+from armasec.circuit_breaker import CircuitBreaker
+from armasec.exceptions import ArmasecError, AuthenticationError, AuthorizationError
+from armasec.hedging import HedgedFetcher
+from armasec.introspection import IntrospectionClient
+from armasec.openid_config_loader import OpenidConfigLoader
+from armasec.permissions import MATCH_KEYS_MESSAGE, compile_match_keys
+from armasec.schemas import DomainConfig
+from armasec.shared_store import open_shared_store
+from armasec.tenant_registry import TenantRegistry
+from armasec.token_cache import TokenCache
+from armasec.token_decoder import TokenDecoder
+from armasec.token_manager import TokenManager
+from armasec.token_payload import TokenPayload
+from armasec.utilities import get_authorization_scheme_param, noop
+
+
+class ManagerConfig(BaseModel):
+    """
+    Model class to represent a TokenManager instance and its domain configuration for easier mapping
+
+    Attributes:
+        manager: The TokenManager instance to use for decoding tokens.
+        domain_config: The DomainConfig for the openid server.
+        loader: The OpenidConfigLoader used to load and refresh the manager's resources.
+        introspector: The IntrospectionClient for opaque tokens, if the domain supports them.
+    """
+
+    manager: TokenManager
+    domain_config: DomainConfig
+    loader: Optional[OpenidConfigLoader] = None
+    introspector: Optional[IntrospectionClient] = None
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _match_keys_check: Optional[Callable[[TokenPayload], bool]] = PrivateAttr(None)
+
+    def model_post_init(self, __context: Any):
+        self._match_keys_check = compile_match_keys(self.domain_config.match_keys)
+
+    def check_match_keys(self, token_payload: TokenPayload):
+        """
+        Check a token payload against the `match_keys` of the domain, compiled when the manager
+        config was built. Raise AuthorizationError if the check fails.
+        """
+        if self._match_keys_check is not None:
+            AuthorizationError.require_condition(
+                self._match_keys_check(token_payload), MATCH_KEYS_MESSAGE
+            )
+
+
+def build_manager_config(
+    domain_config: DomainConfig,
+    debug_logger: Optional[Callable[..., None]] = None,
+    token_cache: Optional[TokenCache] = None,
+) -> ManagerConfig:
+    """
+    Load the OIDC resources for a domain and build its TokenManager.
+
+    Args:
+        domain_config: The DomainConfig for the openid server.
+        debug_logger:  A callable, that if provided, will allow debug logging. Should be passed as
+                       a logger method like `logger.debug`
+        token_cache:   Optional TokenCache for the payloads verified by the domain's decoder.
+    """
+    debug_logger = debug_logger if debug_logger else noop
+    loader = OpenidConfigLoader(
+        domain_config.domain,
+        use_https=domain_config.use_https,
+        debug_logger=debug_logger,
+        refresh_interval=domain_config.refresh_interval,
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=domain_config.failure_threshold,
+            reset_timeout=domain_config.reset_timeout,
+            debug_logger=debug_logger,
+        ),
+        max_staleness=domain_config.max_staleness,
+        mirrors=domain_config.mirrors,
+        jwks_uri_mirrors=domain_config.jwks_uri_mirrors,
+        hedged_fetcher=HedgedFetcher(
+            percentile=domain_config.hedge_percentile,
+            debug_logger=debug_logger,
+        ),
+        shared_store=(
+            open_shared_store(domain_config.shared_store_path)
+            if domain_config.shared_store_path
+            else None
+        ),
+    )
+    decoder = TokenDecoder(
+        loader.jwks,
+        domain_config.algorithm,
+        debug_logger=debug_logger,
+        permission_extractor=domain_config.resolved_permission_extractor,
+        role_map=domain_config.role_map,
+        token_cache=token_cache,
+        cache_namespace=domain_config.domain,
+    )
+    manager = TokenManager(
+        loader.config,
+        decoder,
+        audience=domain_config.audience,
+        debug_logger=debug_logger,
+    )
+    introspector = None
+    if domain_config.introspection:
+        endpoint = domain_config.introspection_endpoint or (loader.config.model_extra or {}).get(
+            "introspection_endpoint"
+        )
+        AuthenticationError.require_condition(
+            endpoint, f"No introspection endpoint was found for domain {domain_config.domain}"
+        )
+        assert endpoint is not None  # make static type analyzer happy
+        introspector = IntrospectionClient(
+            endpoint,
+            client_id=domain_config.introspection_client_id,
+            client_secret=domain_config.introspection_client_secret,
+            max_ttl=domain_config.introspection_max_ttl,
+            debug_logger=debug_logger,
+        )
+    return ManagerConfig(
+        manager=manager, domain_config=domain_config, loader=loader, introspector=introspector
+    )
+
+
+class Verifier:
+    """
+    Verify the token in an Authorization header against a set of domains.
+
+    The Verifier has no dependency on any web framework. It lazily loads a TokenManager for each
+    domain on first use and then matches incoming tokens against them. TokenSecurity and the
+    TokenAuthMiddleware are both built on top of it.
+    """
+
+    def __init__(
+        self,
+        domain_configs: List[DomainConfig],
+        debug_logger: Optional[Callable[..., None]] = None,
+        debug_exceptions: bool = False,
+        token_cache: Optional[TokenCache] = None,
+    ):
+        """
+        Initializes the Verifier.
+
+        Args:
+            domain_configs:   List of domain configuration to authenticate the tokens against.
+            debug_logger:     A callable, that if provided, will allow debug logging. Should be
+                              passed as a logger method like `logger.debug`
+            debug_exceptions: If True, log the class of unexpected exceptions raised while loading
+                              managers. Should only be used in a testing or debugging context.
+            token_cache:      Optional TokenCache used to skip verification of tokens that were
+                              already verified.
+        """
+        self.domain_configs = domain_configs
+        self.debug_logger = debug_logger if debug_logger else noop
+        self.debug_exceptions = debug_exceptions
+        self.token_cache = token_cache
+
+        # This will be lazy loaded at the first verification
+        self.managers: List[ManagerConfig] = list()
+
+        self.tenant_registries: Dict[str, TenantRegistry] = {
+            domain_config.domain: TenantRegistry(
+                domain_config,
+                partial(
+                    build_manager_config,
+                    debug_logger=self.debug_logger,
+                    token_cache=self.token_cache,
+                ),
+                debug_logger=self.debug_logger,
+            )
+            for domain_config in domain_configs
+            if domain_config.is_templated
+        }
+
+    def verify(self, authorization: Optional[str]) -> TokenPayload:
+        """
+        Verify the token in the value of an Authorization header and return its payload.
+
+        Raises AuthenticationError if the token cannot be verified by any domain, and
+        AuthorizationError if it does not contain the key-value pairs required by its domain.
+
+        Args:
+            authorization: The raw value of the Authorization header, like `Bearer <token>`.
+        """
+        self.load_managers()
+        AuthenticationError.require_condition(
+            authorization,
+            f"Could not find auth header at {TokenManager.header_key}",
+        )
+
+        # make static type analyzer happy :)
+        assert authorization is not None
+
+        headers = {TokenManager.header_key: authorization}
+
+        for manager_config in self._candidate_managers(authorization):
+            if not self._refresh_manager(manager_config):
+                domain = manager_config.domain_config.domain
+                self.debug_logger(f"Skipping expired jwks for domain {domain}")
+                continue
+            try:
+                token_payload = manager_config.manager.extract_token_payload(headers)
+            except Exception as err:
+                self.debug_logger(f"Exception caught: {err.__class__.__name__}")
+            else:
+                manager_config.check_match_keys(token_payload)
+                return token_payload
+
+        raise AuthenticationError(
+            "Not authenticated: could not find matching JWK"
+            " with any input domain or token is malformed"
+        )
+
+    async def verify_async(self, authorization: Optional[str]) -> TokenPayload:
+        """
+        Verify the token in the value of an Authorization header like `verify()`. If it cannot be
+        verified locally, like an opaque reference token, introspect it with the domains that
+        support introspection.
+
+        Args:
+            authorization: The raw value of the Authorization header, like `Bearer <token>`.
+        """
+        try:
+            return self.verify(authorization)
+        except AuthenticationError:
+            introspecting = [
+                manager_config
+                for manager_config in self.managers
+                if manager_config.introspector is not None
+            ]
+            if not introspecting:
+                raise
+
+        (_, token) = get_authorization_scheme_param(authorization or "")
+        AuthenticationError.require_condition(token, "Not authenticated: no token to introspect")
+        for manager_config in introspecting:
+            assert manager_config.introspector is not None  # make static type analyzer happy
+            domain = manager_config.domain_config.domain
+            try:
+                claims = await manager_config.introspector.introspect(token)
+                audience = manager_config.domain_config.audience
+                if audience is not None:
+                    AuthenticationError.require_condition(
+                        _has_audience(claims.get("aud"), audience),
+                        f"Introspected token is not for audience {audience}",
+                    )
+                token_payload = manager_config.manager.token_decoder.map_claims(claims, token)
+            except ArmasecError as err:
+                self.debug_logger(f"Failed to introspect token with domain {domain}: {err}")
+            else:
+                manager_config.check_match_keys(token_payload)
+                return token_payload
+
+        raise AuthenticationError("Not authenticated: token could not be verified or introspected")
+
+    def check_forwarded(self, token_payload: TokenPayload) -> TokenPayload:
+        """
+        Check a payload that was verified by another service, like the claims of a ClaimsEnvelope,
+        against the domains that would have to verify its token here.
+
+        The payload must name the issuer of one of the domains in its `iss`. If it carries an
+        `aud`, like the token it was verified from, it must include the domain's audience. Raises
+        AuthenticationError if no domain accepts the payload, and AuthorizationError if it does not
+        contain the key-value pairs required by its domain.
+
+        Args:
+            token_payload: The payload verified by the other service.
+        """
+        self.load_managers()
+        issuer = getattr(token_payload, "iss", None)
+        AuthenticationError.require_condition(
+            isinstance(issuer, str), "Forwarded claims do not name an issuer"
+        )
+        assert isinstance(issuer, str)  # make static type analyzer happy
+        token_audience = getattr(token_payload, "aud", None)
+
+        candidates = list(self.managers)
+        for registry in self.tenant_registries.values():
+            manager_config = registry.resolve_issuer(issuer)
+            if manager_config is not None:
+                candidates.append(manager_config)
+
+        for manager_config in candidates:
+            if str(manager_config.manager.openid_config.issuer).rstrip("/") != issuer.rstrip("/"):
+                continue
+            audience = manager_config.domain_config.audience
+            # Tokens without an `aud` are accepted by the decoder too, so the same goes for them
+            if audience is not None and token_audience is not None:
+                if not _has_audience(token_audience, audience):
+                    continue
+            manager_config.check_match_keys(token_payload)
+            return token_payload
+
+        raise AuthenticationError(
+            f"Not authenticated: forwarded claims were not issued by {issuer} for any input domain"
+        )
+
+    def load_managers(self):
+        """
+        Load the managers of the statically configured domains if they are not loaded yet.
+        """
+        if len(self.managers) == 0:
+            for domain_config in self.domain_configs:
+                if domain_config.is_templated:
+                    continue
+                try:
+                    self.debug_logger(
+                        f"Lazy loading TokenManager for domain {domain_config.domain}"
+                    )
+                    self.managers.append(
+                        build_manager_config(
+                            domain_config,
+                            debug_logger=self.debug_logger,
+                            token_cache=self.token_cache,
+                        )
+                    )
+                except AuthenticationError:
+                    self.debug_logger(f"Failed to match JWK against domain {domain_config.domain}")
+                except Exception as err:
+                    if self.debug_exceptions:
+                        self.debug_logger(f"Exception caught: {err.__class__.__name__}")
+
+        AuthenticationError.require_condition(
+            len(self.managers) > 0 or len(self.tenant_registries) > 0,
+            "Not authenticated: couldn't load any TokenManager instance",
+        )
+
+    def prefetch_tenants(self, domain: str, tenants: Iterable[str]):
+        """
+        Load the managers for hot tenants of a templated domain ahead of their first request.
+
+        Args:
+            domain:  The templated domain, like `auth.example.com/realms/{tenant}`.
+            tenants: The tenants to load. Loads run with bounded concurrency.
+        """
+        registry = self.tenant_registries.get(domain)
+        if registry is None:
+            raise ArmasecError(f"Domain {domain} is not templated")
+        registry.prefetch(tenants)
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Report the health of the OIDC resources for each loaded domain for use in a health probe.
+
+        The report is unhealthy if any domain is serving jwks that have exceeded their maximum
+        staleness or if its circuit breaker is open.
+        """
+        domains = [
+            manager_config.loader.health()
+            for manager_config in self.managers
+            if manager_config.loader is not None
+        ]
+        healthy = all(
+            not domain["jwks_expired"] and domain["breaker_state"] != "OPEN" for domain in domains
+        )
+        tenants = [registry.metrics() for registry in self.tenant_registries.values()]
+        token_cache = dict(self.token_cache.stats) if self.token_cache is not None else None
+        return dict(healthy=healthy, domains=domains, tenants=tenants, token_cache=token_cache)
+
+    def after_fork(self):
+        """
+        Reset the process-local state inherited from the parent process in a forked child.
+        """
+        for manager_config in self.managers:
+            if manager_config.loader is not None:
+                manager_config.loader.after_fork()
+            if manager_config.introspector is not None:
+                manager_config.introspector.reset()
+        for registry in self.tenant_registries.values():
+            registry.after_fork()
+        if self.token_cache is not None:
+            self.token_cache.reset()
+
+    def _candidate_managers(self, authorization: str) -> Iterator[ManagerConfig]:
+        """
+        Yield the statically configured managers followed by the manager of the tenant that
+        issued the token, if it belongs to a templated domain.
+        """
+        yield from self.managers
+
+        if not self.tenant_registries:
+            return
+
+        (_, token) = get_authorization_scheme_param(authorization)
+        if not token:
+            return
+
+        # Deferred so that importing armasec does not import python-jose
+        from jose import JWTError, jwt
+
+        try:
+            issuer = jwt.get_unverified_claims(token).get("iss")
+        except JWTError:
+            return
+
+        for registry in self.tenant_registries.values():
+            manager_config = registry.resolve_issuer(issuer)
+            if manager_config is not None:
+                yield manager_config
+
+    def _refresh_manager(self, manager_config: ManagerConfig) -> bool:
+        """
+        Refresh the manager's jwks if they are due. Returns False if the manager's jwks have
+        exceeded their maximum staleness and should not be used.
+        """
+        loader = manager_config.loader
+        if loader is None:
+            return True
+
+        if loader.sync_from_store():
+            self.debug_logger(f"Adopted new jwks from shared store for domain {loader.domain}")
+            manager_config.manager.token_decoder.jwks = loader.jwks
+
+        if loader.refresh_due:
+            try:
+                if loader.refresh():
+                    self.debug_logger(f"Loaded new jwks for domain {loader.domain}")
+                    manager_config.manager.token_decoder.jwks = loader.jwks
+            except AuthenticationError:
+                self.debug_logger(f"Failed to refresh jwks for domain {loader.domain}")
+
+        return not loader.jwks_expired
+
+
+def _has_audience(token_audience: Any, audience: str) -> bool:
+    return audience == token_audience or (
+        isinstance(token_audience, list) and audience in token_audience
+    )
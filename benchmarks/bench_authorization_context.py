@@ -0,0 +1,24 @@
+"""
+Measure the cost of field-level checks for a large GraphQL query.
+"""
+
+from armasec.authorization_context import AuthorizationContext
+from armasec.permissions import PermissionMode, check_permissions
+from armasec.token_payload import TokenPayload
+
+
+async def test_thousand_field_query(measure):
+    token_payload = TokenPayload(sub="me", permissions=[f"read:{i}" for i in range(50)])
+    fields = [((f"read:{i % 20}", f"read:{i % 7}"), PermissionMode.ALL) for i in range(1000)]
+
+    async def _with_context():
+        context = AuthorizationContext(token_payload)
+        for scopes, mode in fields:
+            context.require(scopes, mode)
+
+    async def _without_context():
+        for scopes, mode in fields:
+            check_permissions(token_payload.permissions, scopes, mode)
+
+    await measure("1000 fields with AuthorizationContext", _with_context, iterations=500)
+    await measure("1000 fields with check_permissions", _without_context, iterations=500)
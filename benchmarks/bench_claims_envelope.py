@@ -0,0 +1,35 @@
+"""
+Compare the per-hop CPU cost of verifying a token with accepting a claims envelope.
+"""
+
+from armasec.claims_envelope import ClaimsEnvelope
+from armasec.verifier import Verifier
+
+
+async def test_envelope_vs_full_verification(
+    rs256_domain_config, mock_openid_server, build_rs256_token, measure
+):
+    verifier = Verifier([rs256_domain_config])
+    authorization = f"Bearer {build_rs256_token(claim_overrides=dict(jti='abc'))}"
+    token_payload = verifier.verify(authorization)
+    envelope = ClaimsEnvelope(b"internal-secret", allow_unbound=True)
+    minted = envelope.mint(token_payload)
+
+    async def _verify():
+        return verifier.verify(authorization)
+
+    async def _mint():
+        return envelope.mint(token_payload)
+
+    async def _accept():
+        return envelope.verify(minted)
+
+    async def _accept_bound():
+        return verifier.check_forwarded(envelope.verify(minted, authorization))
+
+    full = await measure("Full RS256 verification per hop", _verify)
+    await measure("Mint envelope at the edge", _mint)
+    accepted = await measure("Accept envelope per hop", _accept)
+    bound = await measure("Accept envelope bound to forwarded token", _accept_bound)
+    print(f"\nPer-hop CPU saved: {(1 - accepted / full):.0%} ({(1 - bound / full):.0%} when bound)")
+    assert accepted < full
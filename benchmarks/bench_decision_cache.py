@@ -0,0 +1,57 @@
+"""
+Measure the cost of authorizing a token that was already authorized for a route's policy.
+"""
+
+import time
+
+import pluggy
+from starlette.requests import Request
+
+from armasec.decision_cache import DecisionCache
+from armasec.pluggable import PluginRunner, hookimpl, hookspecs
+from armasec.token_payload import TokenPayload
+from armasec.token_security import TokenSecurity
+
+from benchmarks.conftest import build_http_scope
+
+
+class TenantPlugin:
+    armasec_decision_cacheable = True
+
+    @hookimpl
+    def armasec_plugin_check(self, token_payload):
+        assert token_payload.org == "acme"
+
+
+async def test_repeat_decision(measure, rs256_domain_config):
+    manager = pluggy.PluginManager("armasec")
+    manager.add_hookspecs(hookspecs)
+    manager.register(TenantPlugin())
+    runner = PluginRunner(manager)
+
+    request = Request(build_http_scope())
+    token_payload = TokenPayload(
+        sub="me",
+        permissions=[f"read:{i}" for i in range(50)],
+        exp=time.time() + 3600,
+        org="acme",
+        original_token="header.payload.signature",
+    )
+
+    options = dict(
+        scopes=["read:1", "read:2"],
+        requires="admin or (read:3 and read:4)",
+        match_keys=dict(org="acme"),
+        plugin_runner=runner,
+    )
+    uncached = TokenSecurity([rs256_domain_config], **options)
+    cached = TokenSecurity([rs256_domain_config], decision_cache=DecisionCache(), **options)
+
+    async def _uncached():
+        await uncached._authorize(request, token_payload)
+
+    async def _cached():
+        await cached._authorize(request, token_payload)
+
+    await measure("policy and plugin without DecisionCache", _uncached, iterations=20000)
+    await measure("policy and plugin with DecisionCache", _cached, iterations=20000)
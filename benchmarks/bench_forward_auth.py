@@ -0,0 +1,52 @@
+"""
+Measure in-process throughput of the forward-auth app against a local stand-in provider.
+"""
+
+import json
+
+import pytest
+
+from armasec.forward_auth import ForwardAuthApp
+from armasec.token_cache import InMemoryTokenCache, TokenCache
+from armasec.verifier import Verifier
+
+from benchmarks.conftest import asgi_caller, build_http_scope
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["uncached", "cached"])
+async def test_forward_auth(
+    cached, rs256_domain_config, mock_openid_server, build_rs256_token, measure
+):
+    token_cache = TokenCache(InMemoryTokenCache()) if cached else None
+    app = ForwardAuthApp(Verifier([rs256_domain_config], token_cache=token_cache))
+    app.verifier.load_managers()
+    token = build_rs256_token(claim_overrides=dict(permissions=["read:x"]))
+    scope = build_http_scope(
+        "/verify", headers={"Authorization": f"Bearer {token}", "X-Armasec-Scopes": "read:x"}
+    )
+
+    per_call = await measure(f"Forward-auth subrequest ({cached=})", asgi_caller(app, scope))
+    print(f"{'':<48} {1 / per_call:10.0f} verifications/s")
+
+    messages = await asgi_caller(app, scope)()
+    assert messages[0]["status"] == 200
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["uncached", "cached"])
+async def test_bulk_verify(
+    cached, rs256_domain_config, mock_openid_server, build_rs256_token, measure
+):
+    batch_size = 100
+    token_cache = TokenCache(InMemoryTokenCache()) if cached else None
+    app = ForwardAuthApp(Verifier([rs256_domain_config], token_cache=token_cache))
+    app.verifier.load_managers()
+    tokens = [build_rs256_token(claim_overrides=dict(sub=f"user-{i}")) for i in range(batch_size)]
+    body = json.dumps(dict(tokens=tokens)).encode("utf-8")
+
+    async def _call():
+        return app.bulk_verify(body)
+
+    per_call = await measure(
+        f"Bulk verify of {batch_size} tokens ({cached=})", _call, iterations=50, warmup=5
+    )
+    print(f"{'':<48} {batch_size / per_call:10.0f} verifications/s")
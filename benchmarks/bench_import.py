@@ -0,0 +1,62 @@
+"""
+Measure the time it takes to import armasec's modules in a fresh interpreter.
+
+Uses `python -X importtime` so the numbers match what a worker boot or a CLI invocation pays.
+"""
+
+import statistics
+import subprocess
+import sys
+
+import pytest
+
+RUNS = 7
+
+
+def import_time(module: str) -> float:
+    """
+    Import a module in a fresh interpreter and return its cumulative import time in seconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in reversed(result.stderr.splitlines()):
+        (_, _, cumulative, name) = [part.strip() for part in line.replace(":", "|", 1).split("|")]
+        if name == module:
+            return int(cumulative) / 1e6
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "armasec",
+        "armasec.pluggable",
+        "armasec.verifier",
+        "armasec.middleware",
+        "armasec.token_security",
+        "armasec.armasec",
+    ],
+)
+def test_import_time(module):
+    median = statistics.median(import_time(module) for _ in range(RUNS))
+    print(f"\nimport {module:<42} {median * 1e3:10.1f} ms")
+
+
+def test_import_does_not_load_plugins_or_httpx():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, armasec.pluggable, armasec.verifier; "
+            "from armasec.pluggable import discovery; "
+            "print(discovery.loaded, 'httpx' in sys.modules, 'starlette' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == ["False", "False", "False"]
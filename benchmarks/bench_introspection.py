@@ -0,0 +1,47 @@
+"""
+Measure the introspection of opaque tokens against an endpoint with 2ms of latency, with and
+without the response cache, and a burst of concurrent lookups of the same token.
+"""
+
+import asyncio
+import time
+
+import httpx
+import respx
+
+from armasec.introspection import IntrospectionClient
+
+ENDPOINT = "https://my.domain/protocol/openid-connect/token/introspect"
+
+
+async def answer(request):
+    await asyncio.sleep(0.002)
+    return httpx.Response(200, json=dict(active=True, sub="me", exp=time.time() + 3600))
+
+
+async def test_introspect(measure):
+    cached = IntrospectionClient(ENDPOINT)
+    uncached = IntrospectionClient(ENDPOINT, max_ttl=0)
+
+    async def _uncached():
+        return await uncached.introspect("opaque-token")
+
+    async def _cached():
+        return await cached.introspect("opaque-token")
+
+    async def _burst():
+        # Fifty requests with the same fresh token arriving together
+        cached.clear()
+        return await asyncio.gather(*(cached.introspect("opaque-token") for _ in range(50)))
+
+    with respx.mock:
+        route = respx.post(ENDPOINT).mock(side_effect=answer)
+        await measure("introspect without cache", _uncached, iterations=50, warmup=5)
+        await measure("introspect with cache", _cached, iterations=20000)
+
+        calls = route.call_count
+        await measure("burst of 50 lookups with single-flight", _burst, iterations=50, warmup=5)
+        assert route.call_count - calls == 55
+
+    await cached.aclose()
+    await uncached.aclose()
@@ -0,0 +1,59 @@
+"""
+Compare authentication through the TokenSecurity dependency with the TokenAuthMiddleware.
+"""
+
+import fastapi
+import pytest
+from starlette.requests import Request
+
+from armasec import Armasec, TokenAuthMiddleware
+from armasec.token_cache import InMemoryTokenCache, TokenCache
+
+from benchmarks.conftest import asgi_caller, build_http_scope
+
+
+async def bare_app(scope, receive, send):
+    await send(dict(type="http.response.start", status=200, headers=[]))
+    await send(dict(type="http.response.body", body=scope["state"]["token_payload"].sub.encode()))
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["uncached", "cached"])
+async def test_dependency_vs_middleware(
+    cached, rs256_domain_config, mock_openid_server, build_rs256_token, measure
+):
+    token_cache = TokenCache(InMemoryTokenCache()) if cached else None
+    armasec = Armasec(domain_configs=[rs256_domain_config], token_cache=token_cache)
+    armasec.preload()
+    scope = build_http_scope(headers=dict(Authorization=f"Bearer {build_rs256_token()}"))
+
+    dependency_app = fastapi.FastAPI()
+
+    @dependency_app.get("/secure", dependencies=[fastapi.Depends(armasec.lockdown())])
+    async def _():
+        return dict(good="to go")
+
+    middleware_app = fastapi.FastAPI()
+
+    @middleware_app.get("/secure")
+    async def _(request: Request):
+        return dict(good="to go")
+
+    middleware_app.add_middleware(TokenAuthMiddleware, verifier=armasec.verifier)
+
+    results = dict(
+        dependency=await measure(
+            f"FastAPI + TokenSecurity dependency ({cached=})",
+            asgi_caller(dependency_app, scope),
+        ),
+        middleware=await measure(
+            f"FastAPI + TokenAuthMiddleware ({cached=})",
+            asgi_caller(middleware_app, scope),
+        ),
+        bare=await measure(
+            f"Bare ASGI + TokenAuthMiddleware ({cached=})",
+            asgi_caller(TokenAuthMiddleware(bare_app, armasec.verifier), scope),
+        ),
+    )
+    for messages in [await asgi_caller(app, scope)() for app in (dependency_app, middleware_app)]:
+        assert messages[0]["status"] == 200
+    assert results["bare"] < results["dependency"]
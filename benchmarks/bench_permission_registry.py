@@ -0,0 +1,76 @@
+"""
+Measure bulk permission queries and route checks on permission masks against the set-based path.
+"""
+
+import tracemalloc
+
+from armasec.permissions import PermissionMode, check_permissions
+from armasec.policy import Policy
+from armasec.token_payload import TokenPayload
+
+
+def build_payload(count: int) -> TokenPayload:
+    return TokenPayload(sub="me", permissions=[f"feature:{i}" for i in range(0, 2 * count, 2)])
+
+
+def allocated(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+async def test_which_features(measure):
+    features = [f"feature:{i}" for i in range(0, 1600, 11)][:150]
+    token_payload = build_payload(800)
+    token_payload.which(*features)
+
+    async def _with_sets():
+        permissions = set(build_payload(800).permissions)
+        return {feature for feature in features if feature in permissions}
+
+    async def _with_masks():
+        return build_payload(800).which(*features)
+
+    assert await _with_sets() == await _with_masks()
+
+    # A fresh payload per call, like one verified payload per page load
+    await measure("150 features of 800 permissions with sets", _with_sets, iterations=500)
+    await measure("150 features of 800 permissions with masks", _with_masks, iterations=500)
+
+    warm_payload = build_payload(800)
+    warm_payload.permission_mask
+
+    async def _warm_with_sets():
+        permissions = warm_payload.permission_set
+        return {feature for feature in features if feature in permissions}
+
+    async def _warm_with_masks():
+        return warm_payload.which(*features)
+
+    await measure("repeat query with cached set", _warm_with_sets, iterations=5000)
+    await measure("repeat query with cached mask", _warm_with_masks, iterations=5000)
+
+    set_bytes = allocated(lambda: frozenset(token_payload.permissions))
+    mask_bytes = allocated(lambda: token_payload.permission_mask | 1 << 1600)
+    print(f"\n{'memory of 800 permissions as a frozenset':<48} {set_bytes:10d} bytes")
+    print(f"{'memory of 800 permissions as a mask':<48} {mask_bytes:10d} bytes")
+
+
+async def test_route_check(measure):
+    scopes = [f"feature:{i}" for i in range(0, 40, 4)]
+    token_payload = build_payload(800)
+    policy = Policy(scopes=scopes, permission_mode=PermissionMode.ALL)
+    token_payload.permission_mask
+
+    async def _with_sets():
+        check_permissions(token_payload.permission_set, scopes, PermissionMode.ALL)
+
+    async def _with_masks():
+        policy.check(token_payload)
+
+    await measure("10 scopes ALL with sets", _with_sets, iterations=20000)
+    await measure("10 scopes ALL with masks", _with_masks, iterations=20000)
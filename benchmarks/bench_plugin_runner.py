@@ -0,0 +1,70 @@
+"""
+Measure the time spent on plugin checks that wait on I/O when run sequentially and concurrently.
+"""
+
+import asyncio
+
+import pluggy
+
+from armasec.pluggable import PluginRunner, hookimpl, hookspecs
+from armasec.token_payload import TokenPayload
+
+
+def io_plugin(delay: float):
+    class Plugin:
+        @hookimpl
+        async def armasec_plugin_check_async(self):
+            await asyncio.sleep(delay)
+
+    return Plugin()
+
+
+async def test_five_io_bound_plugins(measure):
+    manager = pluggy.PluginManager("armasec")
+    manager.add_hookspecs(hookspecs)
+    for _ in range(5):
+        manager.register(io_plugin(0.005))
+
+    runner = PluginRunner(manager, timeout=1.0)
+    token_payload = TokenPayload(sub="me")
+
+    async def _sequential():
+        for tier in runner.all_plugins.plan():
+            for check in tier:
+                await check.function()
+
+    async def _concurrent():
+        await runner.check(None, token_payload)
+
+    await measure("5 x 5ms plugins sequential", _sequential, iterations=100, warmup=5)
+    await measure("5 x 5ms plugins with PluginRunner", _concurrent, iterations=100, warmup=5)
+
+
+def lookup_plugin(delay: float, ttl: float):
+    class Plugin:
+        armasec_cache_ttl = ttl
+
+        @staticmethod
+        def armasec_cache_key(request, token_payload):
+            return token_payload.sub
+
+        @hookimpl
+        async def armasec_plugin_check_async(self):
+            await asyncio.sleep(delay)
+
+    return Plugin()
+
+
+async def test_cached_plugin_decisions(measure):
+    for ttl in (0, 300):
+        manager = pluggy.PluginManager("armasec")
+        manager.add_hookspecs(hookspecs)
+        manager.register(lookup_plugin(0.001, ttl))
+        runner = PluginRunner(manager)
+        token_payloads = [TokenPayload(sub=f"user-{i}") for i in range(100)]
+        counter = iter(range(10**9))
+
+        async def _check():
+            await runner.check(None, token_payloads[next(counter) % 100])
+
+        await measure(f"1ms lookup plugin, cache ttl={ttl}", _check, iterations=500, warmup=100)
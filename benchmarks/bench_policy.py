@@ -0,0 +1,34 @@
+"""
+Measure the cost of checking a token against a compiled route policy.
+"""
+
+from armasec.permissions import PermissionMode, check_match_keys, check_permissions
+from armasec.policy import Policy
+from armasec.token_payload import TokenPayload
+
+
+async def test_policy_check(measure):
+    token_payload = TokenPayload(
+        sub="me",
+        permissions=[f"read:{i}" for i in range(50)],
+        org="acme",
+        groups=["staff", "admins"],
+    )
+    scopes = ("read:1", "read:2", "read:3")
+    match_keys = dict(org="acme", groups=["admins"])
+    policy = Policy(scopes=scopes, match_keys=match_keys)
+    expression_policy = Policy(requires="admin or (read:1 and read:2 and read:3)")
+
+    async def _with_policy():
+        policy.check(token_payload)
+
+    async def _with_expression():
+        expression_policy.check(token_payload)
+
+    async def _without_policy():
+        check_permissions(token_payload.permissions, scopes, PermissionMode.ALL)
+        check_match_keys(token_payload, match_keys)
+
+    await measure("scopes and match_keys with Policy", _with_policy, iterations=20000)
+    await measure("scope expression with Policy", _with_expression, iterations=20000)
+    await measure("scopes and match_keys without Policy", _without_policy, iterations=20000)
@@ -0,0 +1,53 @@
+"""
+Measure revocation checks against a large RevocationList, and incremental syncs against reloading
+the whole list.
+"""
+
+from armasec.revocation import MemoryRevocationSource, RevocationList
+from armasec.token_payload import TokenPayload
+
+
+def build_source():
+    """
+    Build a source with 100,000 revoked tokens.
+    """
+    source = MemoryRevocationSource()
+    for i in range(100000):
+        source.revoke(f"token-{i}")
+    return source
+
+
+async def test_check_revocation(measure):
+    revocation_list = RevocationList(build_source(), sync_interval=None)
+    allowed = TokenPayload(sub="someone", jti="token-allowed", sid="session-1")
+    revoked = TokenPayload(sub="someone", jti="token-5", sid="session-1")
+
+    async def _allowed():
+        return revocation_list.is_revoked(allowed)
+
+    async def _revoked():
+        return revocation_list.is_revoked(revoked)
+
+    assert not await _allowed()
+    assert await _revoked()
+
+    await measure("check an allowed token against 100k revocations", _allowed, iterations=100000)
+    await measure("check a revoked token against 100k revocations", _revoked, iterations=100000)
+
+
+async def test_sync_revocations(measure):
+    source = build_source()
+    revocation_list = RevocationList(source, sync_interval=None)
+    counter = iter(range(10**9))
+
+    async def _incremental():
+        for _ in range(100):
+            source.revoke(f"new-token-{next(counter)}")
+        revocation_list.sync()
+
+    async def _full():
+        revocation_list._cursor = None
+        revocation_list.sync()
+
+    await measure("sync 100 new revocations incrementally", _incremental, iterations=50)
+    await measure("reload 100k revocations", _full, iterations=50)
@@ -0,0 +1,35 @@
+"""
+Measure the cost of holding idle long-lived connections with a TokenSession each.
+"""
+
+import asyncio
+import time
+import tracemalloc
+from unittest.mock import MagicMock
+
+from armasec.token_payload import TokenPayload
+from armasec.token_session import TokenSession
+
+
+async def test_idle_sessions():
+    count = 50_000
+    token_payload = TokenPayload(sub="me", exp=time.time() + 3600)
+    verifier = MagicMock()
+
+    start = time.perf_counter()
+    sessions = [TokenSession(verifier, token_payload) for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    for session in sessions:
+        session.cancel()
+
+    tracemalloc.start()
+    sessions = [TokenSession(verifier, token_payload) for _ in range(count)]
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"\nCreated {count} sessions in {elapsed * 1e3:.1f} ms")
+    print(f"Memory per idle session: {memory / count:.0f} bytes")
+    print(f"Tasks running: {len(asyncio.all_tasks())}")
+
+    for session in sessions:
+        session.cancel()
@@ -0,0 +1,77 @@
+"""
+Provide helpers shared by the benchmarks.
+
+The benchmarks use the fixtures from the armasec pytest extension to mock an OIDC provider and to
+build tokens. Run them with `make benchmark`.
+"""
+
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List
+
+import pytest
+
+
+def build_http_scope(path: str = "/secure", headers: Dict[str, str] = {}) -> Dict[str, Any]:
+    """
+    Build the scope of an HTTP GET request for driving an ASGI app directly.
+    """
+    return dict(
+        type="http",
+        asgi=dict(version="3.0"),
+        http_version="1.1",
+        method="GET",
+        scheme="http",
+        server=("test", 80),
+        client=("127.0.0.1", 1234),
+        root_path="",
+        path=path,
+        raw_path=path.encode("latin-1"),
+        query_string=b"",
+        headers=[(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+    )
+
+
+def asgi_caller(app, scope: Dict[str, Any]) -> Callable[[], Awaitable[List[dict]]]:
+    """
+    Build a callable that sends one request to an ASGI app and returns the messages it sent.
+
+    Bypasses any HTTP client so that the benchmark measures only the app and its auth layer.
+    """
+
+    async def receive():
+        return dict(type="http.request", body=b"", more_body=False)
+
+    async def _call():
+        messages: List[dict] = []
+
+        async def send(message):
+            messages.append(message)
+
+        await app(dict(scope), receive, send)
+        return messages
+
+    return _call
+
+
+@pytest.fixture
+def measure():
+    """
+    Provide a helper that times an async callable and prints a report line for it.
+    """
+
+    async def _helper(
+        label: str,
+        func: Callable[[], Awaitable[Any]],
+        iterations: int = 2000,
+        warmup: int = 100,
+    ) -> float:
+        for _ in range(warmup):
+            await func()
+        start = perf_counter()
+        for _ in range(iterations):
+            await func()
+        per_call = (perf_counter() - start) / iterations
+        print(f"\n{label:<48} {per_call * 1e6:10.1f} us/op {1 / per_call:10.0f} ops/s")
+        return per_call
+
+    return _helper
@@ -0,0 +1,40 @@
+import os
+
+import strawberry
+from armasec import Armasec
+from armasec.authorization_context import AuthorizationContext
+from fastapi import Depends, FastAPI
+from strawberry.fastapi import GraphQLRouter
+from strawberry.types import Info
+
+
+armasec = Armasec(
+    domain=os.environ.get("ARMASEC_DOMAIN"),
+    audience=os.environ.get("ARMASEC_AUDIENCE"),
+)
+
+
+async def get_context(token_payload=Depends(armasec.lockdown())):
+    return dict(auth=AuthorizationContext(token_payload))
+
+
+@strawberry.type
+class Stuff:
+    name: str
+
+    @strawberry.field
+    def secret(self, info: Info) -> str:
+        info.context["auth"].require(("read:secrets",))
+        return f"The secret of {self.name}"
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    def stuff(self, info: Info) -> list[Stuff]:
+        info.context["auth"].require(("read:stuff", "admin"), "SOME")
+        return [Stuff(name=f"thing-{i}") for i in range(100)]
+
+
+app = FastAPI()
+app.include_router(GraphQLRouter(strawberry.Schema(query=Query), context_getter=get_context), prefix="/graphql")
@@ -2,6 +2,11 @@
 Test the Armasec convenience class.
 """
 
+import gc
+import os
+import weakref
+from unittest import mock
+
 import asgi_lifespan
 import fastapi
 import httpx
@@ -12,6 +17,9 @@ from fastapi import HTTPException
 from plummet import frozen_time
 
 from armasec import Armasec, TokenSecurity
+from armasec.armasec import _instances, _reset_instances_in_child
+from armasec.pytest_extension import build_mock_openid_server
+from armasec.schemas import OpenidConfig
 
 
 @pytest.fixture
@@ -427,3 +435,168 @@ async def test_lockdown__test_match_keys__check_if_cannot_authorize(
 
     response = await client.get("/secured-no-scopes", headers={"Authorization": f"bearer {token}"})
     assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+
+
+@frozen_time("2021-09-20 11:02:00")
+async def test_health__reports_loaded_domains(
+    mock_openid_server,
+    rs256_domain,
+    build_rs256_token,
+    build_secure_endpoint,
+    app,
+    client,
+):
+    """
+    Test that the health probe reports the state of each loaded domain and that the managers are
+    shared by all the TokenSecurity instances built by lockdown.
+    """
+    armasec = Armasec(domain=rs256_domain, audience="https://this.api")
+    assert armasec.health() == dict(
+        healthy=True, domains=[], tenants=[], token_cache=None, plugins={}
+    )
+
+    exp = pendulum.parse("2021-09-21 11:02:00", tz="UTC")
+    token = build_rs256_token(claim_overrides=dict(sub="me", exp=exp.timestamp()))
+    build_secure_endpoint("/secured-one", armasec.lockdown())
+    build_secure_endpoint("/secured-two", armasec.lockdown_some("read:stuff"))
+
+    response = await client.get("/secured-one", headers={"Authorization": f"bearer {token}"})
+    assert response.status_code == starlette.status.HTTP_200_OK
+    await client.get("/secured-two", headers={"Authorization": f"bearer {token}"})
+    assert mock_openid_server.jwks_route.call_count == 1
+
+    health = armasec.health()
+    assert health["healthy"] is True
+    assert [domain["domain"] for domain in health["domains"]] == [rs256_domain]
+    assert health["domains"][0]["breaker_state"] == "CLOSED"
+
+
+@frozen_time("2021-09-20 11:02:00")
+async def test_lockdown__with_templated_domain(
+    rs256_jwk,
+    build_rs256_token,
+    build_secure_endpoint,
+    app,
+    client,
+):
+    """
+    Test that lockdown resolves the manager for the tenant that issued the token when the domain
+    is templated.
+    """
+    build_mock_server = build_mock_openid_server(
+        "armasec.dev/realms/acme",
+        OpenidConfig(
+            issuer="https://armasec.dev/realms/acme",
+            jwks_uri="https://armasec.dev/realms/acme/certs",
+        ),
+        rs256_jwk,
+        "https://armasec.dev/realms/acme/certs",
+    )
+    armasec = Armasec(domain="armasec.dev/realms/{tenant}", audience="https://this.api")
+    build_secure_endpoint("/secured-tenant", armasec.lockdown("read:stuff"))
+
+    exp = pendulum.parse("2021-09-21 11:02:00", tz="UTC")
+    with build_mock_server() as mock_server:
+        token = build_rs256_token(
+            claim_overrides=dict(
+                iss="https://armasec.dev/realms/acme",
+                exp=exp.timestamp(),
+                permissions=["read:stuff"],
+            )
+        )
+        response = await client.get("/secured-tenant", headers={"Authorization": f"bearer {token}"})
+        assert response.status_code == starlette.status.HTTP_200_OK
+
+        response = await client.get("/secured-tenant", headers={"Authorization": f"bearer {token}"})
+        assert response.status_code == starlette.status.HTTP_200_OK
+        assert mock_server.jwks_route.call_count == 1
+
+        token = build_rs256_token(
+            claim_overrides=dict(
+                iss="https://elsewhere.dev/realms/acme",
+                exp=exp.timestamp(),
+                permissions=["read:stuff"],
+            )
+        )
+        response = await client.get("/secured-tenant", headers={"Authorization": f"bearer {token}"})
+        assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+
+    assert armasec.health()["tenants"][0]["resident_tenants"] == 1
+
+
+def test_preload__forked_workers_make_no_provider_calls(
+    mock_openid_server,
+    rs256_domain,
+    build_rs256_token,
+):
+    """
+    Test that managers preloaded in a parent process are used by forked children without any
+    calls to the OIDC provider.
+    """
+    armasec = Armasec(domain=rs256_domain, audience="https://this.api")
+    armasec.preload()
+    assert len(armasec.managers) == 1
+    assert mock_openid_server.openid_config_route.call_count == 1
+    assert mock_openid_server.jwks_route.call_count == 1
+
+    token = build_rs256_token(claim_overrides=dict(sub="me", aud="https://this.api"))
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            security = armasec.lockdown()
+            security._load_all_managers()
+            payload = security.managers[0].manager.extract_token_payload(
+                {"Authorization": f"bearer {token}"}
+            )
+            calls = (
+                mock_openid_server.openid_config_route.call_count
+                + mock_openid_server.jwks_route.call_count
+            )
+            if payload.sub == "me" and calls == 2:
+                exit_code = 0
+        finally:
+            os._exit(exit_code)
+
+    (_, status) = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_lockdown__memoizes_plugin_selection(rs256_domain):
+    """
+    Test that lockdown accepts lists of plugin names and tags, memoizes the TokenSecurity built for
+    them, and shares the plugin runner across routes.
+    """
+    armasec = Armasec(domain=rs256_domain, audience="https://this.api")
+
+    security = armasec.lockdown("read:stuff", plugins=["subscription"], plugin_tags=["admin"])
+    assert security is armasec.lockdown(
+        "read:stuff", plugins=["subscription"], plugin_tags=["admin"]
+    )
+    assert security.plugin_selection.names == {"subscription"}
+    assert security.plugin_selection.tags == {"admin"}
+    assert security.plugin_runner is armasec.lockdown("read:other").plugin_runner
+    assert armasec.lockdown_some("read:stuff", plugins=["audit"]).plugin_selection.names == {
+        "audit"
+    }
+
+
+def test_init__tracks_instances_for_a_single_fork_hook(rs256_domain):
+    """
+    Test that instances are reset by the module's fork hook without registering one each, and
+    that memoized lockdowns do not keep a discarded instance alive.
+    """
+    with mock.patch("os.register_at_fork") as register_at_fork:
+        armasec = Armasec(domain=rs256_domain, audience="https://this.api")
+    register_at_fork.assert_not_called()
+    assert armasec in _instances
+
+    armasec.lockdown("read:stuff")
+    with mock.patch.object(armasec.verifier, "after_fork") as after_fork:
+        _reset_instances_in_child()
+    after_fork.assert_called_once()
+
+    reference = weakref.ref(armasec)
+    del armasec
+    gc.collect()
+    assert reference() is None
@@ -0,0 +1,62 @@
+"""
+Verify that the AuthorizationContext answers and memoizes field-level checks.
+"""
+
+import pytest
+
+from armasec.authorization_context import AuthorizationContext
+from armasec.exceptions import AuthorizationError
+from armasec.permissions import PermissionMode
+from armasec.token_payload import TokenPayload
+
+
+@pytest.fixture
+def context():
+    return AuthorizationContext(
+        TokenPayload(
+            sub="me", permissions=["read:x", "read:y"], azp="web", groups=["admins", "devs"]
+        )
+    )
+
+
+def test_allows__applies_permission_modes(context):
+    assert context.allows("read:x")
+    assert context.allows(("read:x", "read:y"))
+    assert not context.allows(("read:x", "write:x"))
+    assert context.allows(("read:x", "write:x"), PermissionMode.SOME)
+    assert context.allows(["write:x", "read:y"], "SOME")
+    assert not context.allows(["write:x", "write:y"], PermissionMode.SOME)
+
+
+def test_allows__memoizes_decisions(context):
+    for _ in range(100):
+        assert context.allows(("read:x", "read:y"))
+        assert not context.allows(["write:x"], PermissionMode.SOME)
+
+    assert len(context._decisions) == 2
+
+
+def test_require__raises_same_error_as_token_security(context):
+    context.require("read:x")
+    context.require(["write:x", "read:x"], PermissionMode.SOME)
+
+    with pytest.raises(AuthorizationError, match="missing some required permissions"):
+        context.require(("read:x", "write:x"))
+    with pytest.raises(AuthorizationError, match="missing at least"):
+        context.require(("write:x",), PermissionMode.SOME)
+
+
+def test_require__denies_scopes_supplied_as_a_generator(context):
+    context.require(scope for scope in ["read:x"])
+
+    with pytest.raises(AuthorizationError, match="missing some required permissions"):
+        context.require(scope for scope in ["admin"])
+    with pytest.raises(AuthorizationError, match="missing at least"):
+        context.require((scope for scope in ["admin", "write:x"]), PermissionMode.SOME)
+
+
+def test_require_claims__uses_match_keys_semantics(context):
+    context.require_claims(dict(client_id="web", groups=["devs", "ops"]))
+
+    with pytest.raises(AuthorizationError, match="key-value pairs"):
+        context.require_claims(dict(client_id="cli"))
@@ -0,0 +1,76 @@
+"""
+Test the circuit_breaker module.
+"""
+
+from unittest import mock
+
+from armasec.circuit_breaker import BreakerState, CircuitBreaker
+
+
+def test_breaker__opens_after_failure_threshold():
+    """
+    Verify that the breaker opens after the configured number of consecutive failures and then
+    rejects calls.
+    """
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state is BreakerState.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state is BreakerState.OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats["rejected"] == 1
+
+
+def test_breaker__success_resets_failures():
+    """
+    Verify that a success resets the count of consecutive failures.
+    """
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state is BreakerState.CLOSED
+
+
+def test_breaker__half_open_probe_is_single_flighted():
+    """
+    Verify that only one probe is allowed through once the reset timeout has elapsed and that its
+    outcome decides the next state.
+    """
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    with mock.patch("armasec.circuit_breaker.time.monotonic", return_value=100.0):
+        breaker.record_failure()
+
+    with mock.patch("armasec.circuit_breaker.time.monotonic", return_value=111.0):
+        assert breaker.allow_request()
+        assert breaker.state is BreakerState.HALF_OPEN
+        assert not breaker.allow_request()
+
+        breaker.record_failure()
+        assert breaker.state is BreakerState.OPEN
+        assert not breaker.allow_request()
+
+    with mock.patch("armasec.circuit_breaker.time.monotonic", return_value=122.0):
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state is BreakerState.CLOSED
+        assert breaker.allow_request()
+
+
+def test_breaker__after_fork_replaces_held_locks():
+    """
+    Verify that locks held when the process forked are replaced and a half-open probe is
+    abandoned.
+    """
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert breaker.state is BreakerState.HALF_OPEN
+
+    breaker._lock.acquire()
+    breaker.after_fork()
+    assert breaker.state is BreakerState.OPEN
+    assert not breaker._lock.locked()
+    assert breaker.allow_request()
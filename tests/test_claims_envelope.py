@@ -0,0 +1,119 @@
+"""
+Verify that claims envelopes are minted, verified and bound to their tokens.
+"""
+
+import pendulum
+import pytest
+from plummet import frozen_time
+
+from armasec.claims_envelope import ClaimsEnvelope
+from armasec.exceptions import ArmasecError, AuthenticationError
+from armasec.token_payload import TokenPayload
+
+
+@pytest.fixture
+def token_payload():
+    return TokenPayload(
+        sub="me",
+        permissions=["read:x"],
+        azp="edge",
+        jti="abc-123",
+        org="acme",
+        iss="https://auth.my.domain",
+        exp=pendulum.parse("2021-09-16 21:56:00", tz="UTC").int_timestamp,
+    )
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_verify__returns_minted_claims(token_payload):
+    envelope = ClaimsEnvelope(b"secret", include_claims=["org"], allow_unbound=True)
+
+    verified = envelope.verify(envelope.mint(token_payload))
+
+    assert verified.sub == "me"
+    assert verified.permissions == ["read:x"]
+    assert verified.client_id == "edge"
+    assert verified.jti == "abc-123"
+    assert verified.org == "acme"
+    assert verified.iss == "https://auth.my.domain"
+    assert verified.original_token is None
+    assert verified.expire == token_payload.expire
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_verify__rejects_tampered_envelope(token_payload):
+    envelope = ClaimsEnvelope(b"secret")
+    (body, _, signature) = envelope.mint(token_payload).partition(".")
+    forged = ClaimsEnvelope(b"other-secret").mint(
+        TokenPayload(sub="me", permissions=["admin"], exp=token_payload.expire)
+    )
+
+    with pytest.raises(AuthenticationError, match="signature"):
+        envelope.verify(f"{forged.partition('.')[0]}.{signature}")
+    with pytest.raises(AuthenticationError, match="signature"):
+        envelope.verify(forged)
+    with pytest.raises(AuthenticationError, match="Malformed"):
+        envelope.verify(body)
+    with pytest.raises(AuthenticationError, match="signature"):
+        envelope.verify(f"{body}.ünicode")
+
+
+def test_verify__rejects_expired_envelope(token_payload):
+    envelope = ClaimsEnvelope(b"secret", ttl=30, allow_unbound=True)
+    with frozen_time("2021-09-16 20:56:00"):
+        minted = envelope.mint(token_payload)
+    with frozen_time("2021-09-16 20:56:29"):
+        assert envelope.verify(minted).sub == "me"
+    with frozen_time("2021-09-16 20:56:31"):
+        with pytest.raises(AuthenticationError, match="expired"):
+            envelope.verify(minted)
+
+
+def test_mint__never_outlives_the_token(token_payload):
+    envelope = ClaimsEnvelope(b"secret", ttl=3600 * 24)
+    with frozen_time("2021-09-16 21:55:00"):
+        minted = envelope.mint(token_payload)
+    with frozen_time("2021-09-16 21:57:00"):
+        with pytest.raises(AuthenticationError, match="expired"):
+            envelope.verify(minted)
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_verify__checks_binding_to_forwarded_token(token_payload, build_rs256_token):
+    envelope = ClaimsEnvelope(b"secret")
+    minted = envelope.mint(token_payload)
+    exp = token_payload.expire.timestamp()
+
+    bound = build_rs256_token(claim_overrides=dict(jti="abc-123", exp=exp))
+    verified = envelope.verify(minted, f"Bearer {bound}")
+    assert verified.sub == "me"
+    assert verified.original_token == bound
+    assert verified.token_digest is not None
+
+    rescoped = envelope.mint(token_payload.model_copy(update=dict(permissions=["other"])))
+    assert envelope.verify(rescoped, f"Bearer {bound}").token_digest != verified.token_digest
+
+    other = build_rs256_token(claim_overrides=dict(jti="xyz-789", exp=exp))
+    with pytest.raises(AuthenticationError, match="not bound"):
+        envelope.verify(minted, f"Bearer {other}")
+
+    with pytest.raises(AuthenticationError, match="not forwarded with its token"):
+        envelope.verify(minted)
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_verify__accepts_previous_secrets_during_rotation(token_payload):
+    minted = ClaimsEnvelope(b"old-secret").mint(token_payload)
+
+    rotated = ClaimsEnvelope(b"new-secret", previous_secrets=[b"old-secret"], allow_unbound=True)
+
+    assert rotated.verify(minted).sub == "me"
+    assert rotated.mint(token_payload) != minted
+    with pytest.raises(AuthenticationError):
+        ClaimsEnvelope(b"new-secret", allow_unbound=True).verify(minted)
+
+
+def test_init__rejects_empty_secret():
+    with pytest.raises(ArmasecError, match="must not be empty") as err_info:
+        ClaimsEnvelope(b"")
+    assert not isinstance(err_info.value, AuthenticationError)
@@ -0,0 +1,82 @@
+"""
+Tests for the DecisionCache.
+"""
+
+import time
+
+from armasec.decision_cache import MISS, DecisionCache
+from armasec.exceptions import AuthorizationError
+
+
+def test_get__returns_stored_decisions_until_they_expire():
+    """
+    Test that allow and deny decisions are returned until the token expires.
+    """
+    cache = DecisionCache()
+    error = AuthorizationError("Denied")
+
+    cache.set("allow", None, time.time() + 60)
+    cache.set("deny", error, time.time() + 60)
+    cache.set("expired", None, time.time() - 1)
+
+    assert cache.get("allow") is None
+    denial = cache.get("deny")
+    assert isinstance(denial, AuthorizationError)
+    assert denial.message == "Denied"
+    assert denial is not error
+    assert cache.get("expired") is MISS
+    assert cache.get("unknown") is MISS
+    assert cache.metrics() == dict(entries=3, hit_rate=0.5, hits=2, misses=2, sets=3)
+
+
+def test_get__raises_a_new_error_for_each_denial():
+    """
+    Test that every lookup of a deny builds its own error, so that raising one does not leak its
+    traceback or context into the next.
+    """
+    cache = DecisionCache()
+    cache.set("deny", AuthorizationError("Denied"), time.time() + 60)
+
+    first = cache.get("deny")
+    try:
+        raise first
+    except AuthorizationError:
+        pass
+    second = cache.get("deny")
+
+    assert second is not first
+    assert second.__traceback__ is None
+    assert second.args == first.args
+
+
+def test_set__skips_tokens_without_expiry_and_applies_max_ttl():
+    """
+    Test that decisions for tokens without an expiry are not stored, and that max_ttl bounds the
+    lifetime of a decision.
+    """
+    cache = DecisionCache(max_ttl=-1)
+    cache.set("no-expiry", None, None)
+    cache.set("long-lived", None, time.time() + 3600)
+
+    assert cache.get("no-expiry") is MISS
+    assert cache.get("long-lived") is MISS
+    assert cache.metrics()["entries"] == 1
+
+
+def test_set__evicts_expired_decisions_before_the_oldest_ones():
+    """
+    Test that a full cache drops expired decisions first, then the oldest ones.
+    """
+    cache = DecisionCache(max_entries=3)
+    cache.set("expired", None, time.time() - 1)
+    cache.set("old", None, time.time() + 60)
+    cache.set("new", None, time.time() + 60)
+
+    cache.set("newer", None, time.time() + 60)
+    assert cache.stats["evictions"] == 1
+    assert cache.get("old") is None
+
+    cache.set("newest", None, time.time() + 60)
+    assert cache.stats["evictions"] == 2
+    assert cache.get("old") is MISS
+    assert cache.get("newest") is None
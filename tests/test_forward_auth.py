@@ -0,0 +1,133 @@
+"""
+Verify that the forward-auth app answers reverse proxy subrequests.
+"""
+
+import json
+
+import httpx
+import pytest
+import starlette.status
+from plummet import frozen_time
+
+from armasec.forward_auth import ForwardAuthApp, RoutePolicy, create_app
+from armasec.verifier import Verifier
+
+
+@pytest.fixture
+async def client(rs256_domain_config, mock_openid_server):
+    app = ForwardAuthApp(Verifier([rs256_domain_config]))
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_verify__returns_claim_headers(client, build_rs256_token):
+    token = build_rs256_token(claim_overrides=dict(sub="me", azp="cli", permissions=["a", "b"]))
+
+    response = await client.get("/verify", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert response.headers["x-auth-subject"] == "me"
+    assert response.headers["x-auth-client-id"] == "cli"
+    assert response.headers["x-auth-permissions"] == "a,b"
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_verify__rejects_missing_or_bad_token(client):
+    response = await client.get("/verify")
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+    assert response.headers["www-authenticate"] == "Bearer"
+
+    response = await client.get("/verify", headers={"Authorization": "Bearer garbage"})
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_verify__checks_upstream_scopes(client, build_rs256_token):
+    token = build_rs256_token(claim_overrides=dict(permissions=["read:x"]))
+    headers = {"Authorization": f"Bearer {token}", "X-Armasec-Scopes": "read:x, write:x"}
+
+    response = await client.get("/verify", headers=headers)
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+
+    response = await client.get("/verify", headers={**headers, "X-Armasec-Permission-Mode": "some"})
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_verify__applies_configured_route_policies(
+    rs256_domain_config, mock_openid_server, build_rs256_token
+):
+    """
+    Test that a named route applies its configured policy, which the headers of the original
+    request cannot weaken, and that the permission mode header is only honored if it is trusted.
+    """
+    routes = dict(
+        jobs=RoutePolicy(scopes=("read:x", "write:x")),
+        reports=RoutePolicy(scopes=("read:x", "write:x"), permission_mode="SOME"),
+    )
+    token = build_rs256_token(claim_overrides=dict(permissions=["read:x"]))
+    headers = {"Authorization": f"Bearer {token}"}
+    untrusted = {**headers, "X-Armasec-Scopes": "read:x", "X-Armasec-Permission-Mode": "SOME"}
+
+    app = ForwardAuthApp(Verifier([rs256_domain_config]), routes=routes)
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        response = await client.get("/verify/jobs", headers=untrusted)
+        assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+        response = await client.get("/verify/reports", headers=headers)
+        assert response.status_code == starlette.status.HTTP_200_OK
+        response = await client.get("/verify/unknown", headers=headers)
+        assert response.status_code == starlette.status.HTTP_404_NOT_FOUND
+
+    app = ForwardAuthApp(Verifier([rs256_domain_config]), trust_policy_headers=True)
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        response = await client.get(
+            "/verify", headers={**untrusted, "X-Armasec-Scopes": "read:x, write:x"}
+        )
+        assert response.status_code == starlette.status.HTTP_200_OK
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_bulk_verify__returns_result_per_token(client, build_rs256_token):
+    tokens = [
+        build_rs256_token(claim_overrides=dict(sub="one", permissions=["a"])),
+        "garbage",
+        build_rs256_token(claim_overrides=dict(sub="two", permissions=["b"])),
+    ]
+
+    response = await client.post("/verify/bulk", json=dict(tokens=tokens, scopes=["a"]))
+
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert [result["status"] for result in response.json()["results"]] == [200, 401, 403]
+    assert response.json()["results"][0]["claims"] == dict(sub="one", permissions=["a"])
+
+    response = await client.post("/verify/bulk", content=b"not json")
+    assert response.status_code == starlette.status.HTTP_400_BAD_REQUEST
+
+
+async def test_health__reports_verifier_health(client):
+    response = await client.get("/health")
+
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert response.json()["healthy"] is True
+
+
+def test_create_app__reads_environment(monkeypatch, rs256_domain):
+    monkeypatch.setenv("ARMASEC_DOMAIN_CONFIGS", json.dumps([dict(domain=rs256_domain)]))
+    monkeypatch.setenv("ARMASEC_CLAIM_HEADERS", json.dumps({"X-User": "sub"}))
+    monkeypatch.setenv("ARMASEC_ROUTES", json.dumps(dict(jobs=dict(scopes=["read:jobs"]))))
+
+    app = create_app()
+
+    assert isinstance(app, ForwardAuthApp)
+    assert app.verifier.domain_configs[0].domain == rs256_domain
+    assert app.verifier.token_cache is not None
+    assert app.claim_headers == [(b"x-user", "sub")]
+    assert app.routes == {"/verify/jobs": RoutePolicy(scopes=("read:jobs",))}
+    assert app.trust_policy_headers is False
@@ -0,0 +1,130 @@
+"""
+Test the hedging module.
+"""
+
+import time
+
+import httpx
+import pytest
+import respx
+import starlette
+
+from armasec.exceptions import AuthenticationError
+from armasec.hedging import HedgedFetcher, LatencyStats
+
+
+def test_latency_stats__percentile():
+    """
+    Verify that percentiles are computed from the rolling window of samples.
+    """
+    stats = LatencyStats(window=10)
+    assert stats.percentile(0.5) is None
+    for sample in range(20):
+        stats.record(float(sample))
+    assert stats.percentile(0.0) == 10.0
+    assert stats.percentile(0.95) == 19.0
+    assert stats.successes == 20
+
+
+def test_hedge_delay__uses_percentile_after_min_samples():
+    """
+    Verify that the hedge delay falls back to the default until a mirror has enough samples.
+    """
+    fetcher = HedgedFetcher(percentile=0.5, default_delay=0.25, min_samples=3)
+    assert fetcher.hedge_delay("https://mirror.one") == 0.25
+
+    stats = fetcher.stats.setdefault("https://mirror.one", LatencyStats())
+    stats.record(0.01)
+    stats.record(0.02)
+    assert fetcher.hedge_delay("https://mirror.one") == 0.25
+
+    stats.record(0.03)
+    assert fetcher.hedge_delay("https://mirror.one") == 0.02
+
+
+def test_get__hedges_to_faster_mirror():
+    """
+    Verify that a slow first mirror is hedged and the first valid response wins.
+    """
+
+    def slow(_):
+        time.sleep(0.5)
+        return httpx.Response(starlette.status.HTTP_200_OK, json=dict(mirror="one"))
+
+    fetcher = HedgedFetcher(default_delay=0.01)
+    with respx.mock:
+        respx.get("https://mirror.one/jwks").mock(side_effect=slow)
+        respx.get("https://mirror.two/jwks").return_value = httpx.Response(
+            starlette.status.HTTP_200_OK,
+            json=dict(mirror="two"),
+        )
+        start = time.perf_counter()
+        (url, response) = fetcher.get(
+            ["https://mirror.one/jwks", "https://mirror.two/jwks"],
+            lambda _: dict(),
+        )
+        assert time.perf_counter() - start < 0.4
+
+    assert url == "https://mirror.two/jwks"
+    assert response.json() == dict(mirror="two")
+    assert fetcher.summary()["https://mirror.two/jwks"]["wins"] == 1
+
+
+def test_get__skips_failing_mirror():
+    """
+    Verify that a mirror with a server error is skipped in favor of the next one.
+    """
+    fetcher = HedgedFetcher(default_delay=10)
+    with respx.mock:
+        respx.get("https://mirror.one/jwks").return_value = httpx.Response(
+            starlette.status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        respx.get("https://mirror.two/jwks").return_value = httpx.Response(
+            starlette.status.HTTP_200_OK,
+            json=dict(mirror="two"),
+        )
+        (url, _) = fetcher.get(
+            ["https://mirror.one/jwks", "https://mirror.two/jwks"],
+            lambda _: dict(),
+        )
+
+    assert url == "https://mirror.two/jwks"
+    assert fetcher.stats["https://mirror.one/jwks"].errors == 1
+
+
+def test_get__skips_mirror_that_does_not_serve_the_resource():
+    """
+    Verify that a mirror answering with a client error, like a 404, does not win over a mirror
+    that serves the resource.
+    """
+    fetcher = HedgedFetcher(default_delay=10)
+    with respx.mock:
+        respx.get("https://mirror.one/jwks").return_value = httpx.Response(
+            starlette.status.HTTP_404_NOT_FOUND
+        )
+        respx.get("https://mirror.two/jwks").return_value = httpx.Response(
+            starlette.status.HTTP_200_OK,
+            json=dict(mirror="two"),
+        )
+        (url, response) = fetcher.get(
+            ["https://mirror.one/jwks", "https://mirror.two/jwks"],
+            lambda _: dict(),
+        )
+
+    assert url == "https://mirror.two/jwks"
+    assert response.json() == dict(mirror="two")
+    assert fetcher.stats["https://mirror.one/jwks"].errors == 1
+
+
+def test_get__raises_if_all_mirrors_fail():
+    """
+    Verify that an AuthenticationError is raised if none of the mirrors answer successfully.
+    """
+    fetcher = HedgedFetcher(default_delay=0.01)
+    with respx.mock:
+        respx.get("https://mirror.one/jwks").mock(side_effect=httpx.ConnectError("BOOM!"))
+        respx.get("https://mirror.two/jwks").return_value = httpx.Response(
+            starlette.status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+        with pytest.raises(AuthenticationError, match="All mirrors failed"):
+            fetcher.get(["https://mirror.one/jwks", "https://mirror.two/jwks"], lambda _: dict())
@@ -0,0 +1,156 @@
+"""
+Tests for the IntrospectionClient and the introspection of opaque tokens by the Verifier.
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+import respx
+from plummet import frozen_time
+from starlette import status
+
+from armasec.exceptions import AuthenticationError
+from armasec.introspection import IntrospectionClient
+from armasec.schemas import DomainConfig
+from armasec.verifier import Verifier
+
+
+@pytest.fixture
+def introspection_domain_config(rs256_domain, mock_introspection_server):
+    return DomainConfig(
+        domain=rs256_domain,
+        introspection=True,
+        introspection_endpoint=mock_introspection_server.endpoint,
+        introspection_client_id="resource-server",
+        introspection_client_secret="secret",
+    )
+
+
+async def test_introspect__caches_active_tokens_until_they_expire(mock_introspection_server):
+    """
+    Test that the claims of an active token are cached, but never past the token's `exp`.
+    """
+    client = IntrospectionClient(mock_introspection_server.endpoint, max_ttl=60)
+    token = mock_introspection_server.issue(sub="me", scope="read:x write:x", exp=time.time() + 60)
+    short_token = mock_introspection_server.issue(client_id="worker", exp=time.time() - 1)
+
+    claims = await client.introspect(token)
+    assert claims["sub"] == "me"
+    assert claims["permissions"] == ["read:x", "write:x"]
+    assert "active" not in claims
+    assert await client.introspect(token) == claims
+
+    assert (await client.introspect(short_token))["sub"] == "worker"
+    await client.introspect(short_token)
+    assert mock_introspection_server.route.call_count == 3
+    assert client.metrics() == dict(entries=1, hits=1, misses=3, calls=3)
+    await client.aclose()
+
+
+async def test_introspect__caches_inactive_tokens():
+    """
+    Test that an inactive token is rejected and is not introspected again while it is cached.
+    """
+    client = IntrospectionClient("https://my.domain/introspect")
+    with respx.mock:
+        route = respx.post("https://my.domain/introspect")
+        route.return_value = httpx.Response(status.HTTP_200_OK, json=dict(active=False))
+        for _ in range(2):
+            with pytest.raises(AuthenticationError, match="Token is not active"):
+                await client.introspect("revoked-token")
+        assert route.call_count == 1
+    await client.aclose()
+
+
+async def test_introspect__does_not_cache_failures():
+    """
+    Test that a failed call to the endpoint is raised and retried by the next lookup.
+    """
+    client = IntrospectionClient("https://my.domain/introspect")
+    with respx.mock:
+        route = respx.post("https://my.domain/introspect")
+        route.side_effect = [
+            httpx.Response(status.HTTP_503_SERVICE_UNAVAILABLE),
+            httpx.Response(status.HTTP_200_OK, json=dict(active=True, sub="me")),
+        ]
+        with pytest.raises(AuthenticationError, match="Failed to introspect token"):
+            await client.introspect("some-token")
+        assert (await client.introspect("some-token"))["sub"] == "me"
+        assert client.stats["failures"] == 1
+    await client.aclose()
+
+
+async def test_introspect__single_flights_concurrent_lookups(mock_introspection_server):
+    """
+    Test that concurrent lookups of the same token share one call to the endpoint.
+    """
+    mock_introspection_server.delay = 0.05
+    client = IntrospectionClient(mock_introspection_server.endpoint)
+    token = mock_introspection_server.issue(sub="me", exp=time.time() + 60)
+
+    results = await asyncio.gather(*(client.introspect(token) for _ in range(5)))
+    assert all(claims["sub"] == "me" for claims in results)
+    assert mock_introspection_server.route.call_count == 1
+    assert client.stats["joins"] == 4
+    await client.aclose()
+
+
+async def test_verify_async__introspects_opaque_tokens(
+    introspection_domain_config, mock_introspection_server
+):
+    """
+    Test that the Verifier introspects tokens that it cannot decode and maps the claims to a
+    TokenPayload.
+    """
+    verifier = Verifier([introspection_domain_config])
+    token = mock_introspection_server.issue(
+        sub="me", scope="read:x", client_id="my-client", exp=time.time() + 60
+    )
+
+    token_payload = await verifier.verify_async(f"Bearer {token}")
+    assert token_payload.sub == "me"
+    assert token_payload.permissions == ["read:x"]
+    assert token_payload.client_id == "my-client"
+    assert token_payload.original_token == token
+
+    request = mock_introspection_server.route.calls.last.request
+    assert request.headers["Authorization"].startswith("Basic ")
+
+    mock_introspection_server.revoke(token)
+    with pytest.raises(AuthenticationError, match="could not be verified or introspected"):
+        await verifier.verify_async("Bearer unknown-token")
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_verify_async__decodes_jwts_without_introspection(
+    introspection_domain_config, mock_introspection_server, build_rs256_token
+):
+    """
+    Test that tokens that can be verified locally never reach the introspection endpoint.
+    """
+    verifier = Verifier([introspection_domain_config])
+    token = build_rs256_token(claim_overrides=dict(sub="me", permissions=["a"]))
+
+    assert (await verifier.verify_async(f"Bearer {token}")).sub == "me"
+    assert mock_introspection_server.route.call_count == 0
+
+
+async def test_verify_async__checks_the_audience(rs256_domain, mock_introspection_server):
+    """
+    Test that an introspected token must be issued for the domain's audience if there is one.
+    """
+    domain_config = DomainConfig(
+        domain=rs256_domain,
+        audience="my-api",
+        introspection=True,
+        introspection_endpoint=mock_introspection_server.endpoint,
+    )
+    verifier = Verifier([domain_config])
+    good_token = mock_introspection_server.issue(sub="me", aud=["my-api", "account"])
+    bad_token = mock_introspection_server.issue(sub="me", aud="other-api")
+
+    assert (await verifier.verify_async(f"Bearer {good_token}")).sub == "me"
+    with pytest.raises(AuthenticationError):
+        await verifier.verify_async(f"Bearer {bad_token}")
@@ -0,0 +1,103 @@
+"""
+Verify that the TokenAuthMiddleware protects plain ASGI and Starlette apps.
+"""
+
+import httpx
+import pytest
+import starlette.status
+from plummet import frozen_time
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from armasec.middleware import TokenAuthMiddleware, get_authorization
+from armasec.verifier import Verifier
+
+
+async def bare_app(scope, receive, send):
+    """
+    A bare ASGI app that echoes the sub of the payload attached by the middleware.
+    """
+    token_payload = scope.get("state", {}).get("token_payload")
+    body = (token_payload.sub if token_payload else "anonymous").encode("utf-8")
+    await send(dict(type="http.response.start", status=200, headers=[]))
+    await send(dict(type="http.response.body", body=body))
+
+
+@pytest.fixture
+def verifier(rs256_domain_config, mock_openid_server):
+    return Verifier([rs256_domain_config])
+
+
+@pytest.fixture
+async def bare_client(verifier):
+    app = TokenAuthMiddleware(bare_app, verifier, exempt_paths=["/health"])
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+def test_get_authorization__reads_raw_headers():
+    scope = dict(headers=[(b"host", b"test"), (b"authorization", b"Bearer abc")])
+    assert get_authorization(scope) == "Bearer abc"
+    assert get_authorization(dict(headers=[])) is None
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_middleware__attaches_payload_to_scope(bare_client, build_rs256_token):
+    token = build_rs256_token(claim_overrides=dict(sub="me"))
+
+    response = await bare_client.get("/anything", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert response.text == "me"
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_middleware__rejects_unauthenticated_request(bare_client):
+    response = await bare_client.get("/anything")
+
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+    assert response.headers["www-authenticate"] == "Bearer"
+    assert response.json() == dict(detail="Not authenticated")
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_middleware__passes_exempt_paths_through(bare_client):
+    response = await bare_client.get("/health")
+
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert response.text == "anonymous"
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_middleware__works_with_starlette(verifier, build_rs256_token):
+    async def whoami(request: Request):
+        return JSONResponse(dict(sub=request.state.token_payload.sub))
+
+    async def echo(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.send_json(dict(sub=websocket.state.token_payload.sub))
+        await websocket.close()
+
+    app = Starlette(routes=[Route("/whoami", whoami), WebSocketRoute("/echo", echo)])
+    app.add_middleware(TokenAuthMiddleware, verifier=verifier)
+    token = build_rs256_token(claim_overrides=dict(sub="me"))
+
+    with TestClient(app) as client:
+        response = client.get("/whoami", headers={"Authorization": f"Bearer {token}"})
+        assert response.json() == dict(sub="me")
+
+        with client.websocket_connect(
+            "/echo", headers={"Authorization": f"Bearer {token}"}
+        ) as websocket:
+            assert websocket.receive_json() == dict(sub="me")
+
+        with pytest.raises(WebSocketDisconnect) as err_info:
+            with client.websocket_connect("/echo"):
+                pass
+        assert err_info.value.code == 1008
@@ -9,6 +9,7 @@ import pytest
 import respx
 import starlette
 
+from armasec.circuit_breaker import BreakerState, CircuitBreaker
 from armasec.exceptions import AuthenticationError
 from armasec.openid_config_loader import OpenidConfigLoader
 from armasec.schemas import JWKs
@@ -145,3 +146,129 @@ def test_jwks__fail_on_invalid_jwks(mock_openid_server, rs256_jwk, rs256_domain)
     )
     with pytest.raises(AuthenticationError, match="jwks data was invalid"):
         loader.jwks
+
+
+def test__load_openid_resource__stores_validators(mock_openid_server):
+    """
+    Verify that the helper method stores the ETag and Last-Modified validators of a response.
+    """
+    loader = OpenidConfigLoader("my.domain")
+    with respx.mock:
+        route = respx.get("https://my.domain/blah")
+        route.return_value = httpx.Response(
+            starlette.status.HTTP_200_OK,
+            json=dict(foo="bar"),
+            headers={"ETag": '"v1"', "Last-Modified": "Wed, 15 Sep 2021 20:56:00 GMT"},
+        )
+        loader._load_openid_resource("https://my.domain/blah")
+
+    assert loader._validators["https://my.domain/blah"] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 15 Sep 2021 20:56:00 GMT",
+    }
+
+
+def test_refresh__skips_parsing_on_not_modified(mock_openid_server, rs256_domain, rs256_jwk):
+    """
+    Verify that a refresh sends conditional requests and keeps the loaded resources when the
+    provider answers with a 304.
+    """
+    mock_openid_server.jwks_route.return_value = httpx.Response(
+        starlette.status.HTTP_200_OK,
+        json=JWKs(keys=[rs256_jwk]).model_dump(mode="json"),
+        headers={"ETag": '"jwks-v1"'},
+    )
+    loader = OpenidConfigLoader(rs256_domain)
+    jwks = loader.jwks
+
+    mock_openid_server.openid_config_route.return_value = httpx.Response(
+        starlette.status.HTTP_304_NOT_MODIFIED
+    )
+    mock_openid_server.jwks_route.return_value = httpx.Response(
+        starlette.status.HTTP_304_NOT_MODIFIED
+    )
+    with mock.patch.object(loader, "_parse_jwks") as mock_parse:
+        assert loader.refresh() is False
+        mock_parse.assert_not_called()
+
+    assert loader.jwks is jwks
+    assert mock_openid_server.jwks_route.calls.last.request.headers["If-None-Match"] == '"jwks-v1"'
+    assert loader.refresh_counts == {starlette.status.HTTP_304_NOT_MODIFIED: 2}
+
+
+def test_refresh__loads_changed_jwks(mock_openid_server, rs256_domain, rs256_jwk):
+    """
+    Verify that a refresh replaces the jwks when the provider returns new ones.
+    """
+    loader = OpenidConfigLoader(rs256_domain)
+    loader.jwks
+
+    new_jwk = rs256_jwk.model_copy(update=dict(kid="NEW_KID"))
+    mock_openid_server.jwks_route.return_value = httpx.Response(
+        starlette.status.HTTP_200_OK,
+        json=JWKs(keys=[new_jwk]).model_dump(mode="json"),
+    )
+    assert loader.refresh() is True
+    assert loader.jwks == JWKs(keys=[new_jwk])
+    assert loader.refresh_counts == {starlette.status.HTTP_200_OK: 2}
+
+
+def test_refresh_due():
+    """
+    Verify that a refresh is only due after the refresh interval has elapsed.
+    """
+    assert OpenidConfigLoader("my.domain").refresh_due is False
+    assert OpenidConfigLoader("my.domain", refresh_interval=60).refresh_due is False
+    assert OpenidConfigLoader("my.domain", refresh_interval=0).refresh_due is True
+
+
+def test_refresh__serves_stale_jwks_while_provider_fails(mock_openid_server, rs256_domain):
+    """
+    Verify that the last good jwks are served while the provider fails, that the circuit breaker
+    stops calling the provider, and that the failure is raised once the jwks are too stale.
+    """
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    loader = OpenidConfigLoader(rs256_domain, circuit_breaker=breaker, max_staleness=60)
+    jwks = loader.jwks
+
+    mock_openid_server.openid_config_route.return_value = httpx.Response(
+        starlette.status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    assert loader.refresh() is False
+    assert loader.jwks is jwks
+    assert loader.serving_stale
+    assert breaker.state is BreakerState.OPEN
+
+    call_count = mock_openid_server.openid_config_route.call_count
+    assert loader.refresh() is False
+    assert mock_openid_server.openid_config_route.call_count == call_count
+
+    loader._jwks_validated_at -= 61
+    assert loader.jwks_expired
+    assert loader.health()["jwks_expired"] is True
+    with pytest.raises(AuthenticationError, match="Circuit breaker is open"):
+        loader.refresh()
+
+
+def test_jwks__loads_from_mirrors(mock_openid_server, rs256_domain, rs256_jwk):
+    """
+    Verify that the jwks are loaded from a mirror when the primary jwks_uri fails.
+    """
+    mock_openid_server.jwks_route.return_value = httpx.Response(
+        starlette.status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    mirror_route = respx.get("https://mirror.armasec.dev/jwks.json")
+    mirror_route.return_value = httpx.Response(
+        starlette.status.HTTP_200_OK,
+        json=JWKs(keys=[rs256_jwk]).model_dump(mode="json"),
+        headers={"ETag": '"mirror-v1"'},
+    )
+
+    loader = OpenidConfigLoader(
+        rs256_domain,
+        jwks_uri_mirrors=["https://mirror.armasec.dev/jwks.json"],
+    )
+    assert loader.jwks == JWKs(keys=[rs256_jwk])
+    assert mirror_route.called
+    assert "https://mirror.armasec.dev/jwks.json" in loader._validators
+    assert "https://mirror.armasec.dev/jwks.json" in loader.health()["mirrors"]
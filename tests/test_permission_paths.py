@@ -0,0 +1,162 @@
+"""
+Tests for the declarative permission extractors compiled from claim paths.
+"""
+
+import pytest
+
+from armasec.exceptions import ArmasecError
+from armasec.permission_paths import (
+    AUTH0_PERMISSION_PATHS,
+    KEYCLOAK_PERMISSION_PATHS,
+    ClaimPath,
+    PermissionPaths,
+)
+from armasec.schemas import DomainConfig
+
+KEYCLOAK_CLAIMS = dict(
+    azp="jobs-api",
+    realm_access=dict(roles=["offline_access", "viewer"]),
+    resource_access={
+        "jobs-api": dict(roles=["jobs:read", "viewer", "jobs:write"]),
+        "account": dict(roles=["manage-account"]),
+    },
+)
+
+AUTH0_CLAIMS = dict(
+    permissions=["jobs:read", "jobs:write"],
+    scope="openid profile jobs:read",
+)
+
+
+def test_call__merges_keycloak_realm_and_client_roles():
+    """
+    Test that the roles of the realm and of the token's own client are merged without duplicates.
+    """
+    extractor = PermissionPaths(KEYCLOAK_PERMISSION_PATHS)
+    assert extractor(KEYCLOAK_CLAIMS) == ["offline_access", "viewer", "jobs:read", "jobs:write"]
+
+
+def test_call__merges_auth0_permissions_and_split_scopes():
+    """
+    Test that a `|split` path splits a space-delimited scope claim.
+    """
+    extractor = PermissionPaths(AUTH0_PERMISSION_PATHS)
+    assert extractor(AUTH0_CLAIMS) == ["jobs:read", "jobs:write", "openid", "profile"]
+
+
+def test_call__collects_every_key_matched_by_a_wildcard():
+    """
+    Test that a `*` key collects the values under every key of an object.
+    """
+    extractor = PermissionPaths(["resource_access.*.roles"])
+    assert sorted(extractor(KEYCLOAK_CLAIMS)) == [
+        "jobs:read",
+        "jobs:write",
+        "manage-account",
+        "viewer",
+    ]
+
+
+def test_call__supports_quoted_keys():
+    """
+    Test that a quoted key may contain dots, like a namespaced Auth0 claim.
+    """
+    extractor = PermissionPaths(['"https://my.app/claims".roles'])
+    assert extractor({"https://my.app/claims": dict(roles=["admin"])}) == ["admin"]
+
+
+def test_call__skips_missing_paths():
+    """
+    Test that paths that are not in a token, or that pass through a non-object, are skipped.
+    """
+    extractor = PermissionPaths(KEYCLOAK_PERMISSION_PATHS + ("scope.roles",))
+    assert extractor(dict(azp="other", scope="openid")) == []
+    assert extractor(dict(realm_access=dict(roles=["viewer"]))) == ["viewer"]
+
+
+def test_call__rejects_claims_that_are_not_strings_or_lists():
+    """
+    Test that a path leading to an object or a number raises an ArmasecError.
+    """
+    extractor = PermissionPaths(["realm_access"])
+    with pytest.raises(ArmasecError, match="realm_access holds a dict"):
+        extractor(KEYCLOAK_CLAIMS)
+
+
+def test_call__memoizes_each_distinct_set_of_raw_claims():
+    """
+    Test that tokens with the same raw claims share one extraction, and that the memo is bounded.
+    """
+    extractor = PermissionPaths(KEYCLOAK_PERMISSION_PATHS, max_entries=2)
+    first = extractor(KEYCLOAK_CLAIMS)
+    assert extractor(dict(KEYCLOAK_CLAIMS, sub="someone-else")) == first
+    assert len(extractor._memo) == 1
+
+    # A different client selects different roles, so it must not reuse the memoized result
+    assert extractor(dict(KEYCLOAK_CLAIMS, azp="account")) == [
+        "offline_access",
+        "viewer",
+        "manage-account",
+    ]
+    extractor(dict(KEYCLOAK_CLAIMS, azp="missing"))
+    assert len(extractor._memo) == 2
+
+    unmemoized = PermissionPaths(KEYCLOAK_PERMISSION_PATHS, max_entries=0)
+    assert unmemoized(KEYCLOAK_CLAIMS) == first
+    assert len(unmemoized._memo) == 0
+
+
+@pytest.mark.parametrize(
+    "spec, message",
+    [
+        ("", "Empty permission path"),
+        ("scope|lower", "Unknown operation 'lower'"),
+        ("realm_access..roles", "Malformed permission path"),
+        ('"unterminated.roles', "Malformed permission path"),
+    ],
+)
+def test_claim_path__rejects_malformed_specs(spec, message):
+    """
+    Test that malformed paths are rejected when they are compiled.
+    """
+    with pytest.raises(ArmasecError, match=message):
+        ClaimPath(spec)
+
+
+def test_domain_config__compiles_permission_paths_into_the_extractor():
+    """
+    Test that a DomainConfig compiles its `permission_paths` into the extractor it resolves,
+    without setting its `permission_extractor`.
+    """
+    domain_config = DomainConfig(domain="my.domain", permission_paths=list(AUTH0_PERMISSION_PATHS))
+    assert domain_config.permission_extractor is None
+    extractor = domain_config.resolved_permission_extractor
+    assert isinstance(extractor, PermissionPaths)
+    assert extractor(AUTH0_CLAIMS) == [
+        "jobs:read",
+        "jobs:write",
+        "openid",
+        "profile",
+    ]
+
+    with pytest.raises(ArmasecError, match="Only one of permission_paths"):
+        DomainConfig(
+            domain="my.domain",
+            permission_paths=["permissions"],
+            permission_extractor=lambda decoded_token: [],
+        )
+
+
+def test_domain_config__round_trips_with_permission_paths():
+    """
+    Test that a DomainConfig with `permission_paths` can be dumped, validated again and copied.
+    """
+    domain_config = DomainConfig(domain="x.io", permission_paths=["a.b"])
+
+    for copied in (
+        DomainConfig(**domain_config.model_dump()),
+        DomainConfig.model_validate_json(domain_config.model_dump_json()),
+        domain_config.model_copy(update=dict(domain="y.io")),
+    ):
+        assert copied.permission_paths == ["a.b"]
+        assert copied.resolved_permission_extractor(dict(a=dict(b=["read:x"]))) == ["read:x"]
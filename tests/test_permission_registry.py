@@ -0,0 +1,79 @@
+"""
+Tests for the PermissionRegistry and the permission masks of token payloads.
+"""
+
+from armasec.permission_registry import PermissionRegistry, permission_registry
+from armasec.token_payload import TokenPayload
+
+
+def test_intern__assigns_stable_bits():
+    """
+    Test that each permission gets its own bit, and keeps it when it is interned again.
+    """
+    registry = PermissionRegistry()
+    assert registry.intern("read:x") == 0b01
+    assert registry.intern("write:x") == 0b10
+    assert registry.intern("read:x") == 0b01
+    assert registry.version == 2
+    assert "write:x" in registry
+    assert "delete:x" not in registry
+
+
+def test_mask__leaves_out_permissions_that_were_not_interned():
+    """
+    Test that masks only include interned permissions and decode back to them.
+    """
+    registry = PermissionRegistry()
+    query = registry.compile(("a", "b", "c"))
+    assert query == 0b111
+
+    mask = registry.mask(["c", "a", "unknown"])
+    assert mask == 0b101
+    assert sorted(registry.decode(mask)) == ["a", "c"]
+    assert registry.decode(0) == []
+    assert "unknown" not in registry
+
+
+def test_compile__memoizes_masks_per_registry():
+    """
+    Test that compiled masks are memoized by each registry on its own, up to its maximum entries.
+    """
+    registry = PermissionRegistry(max_entries=2)
+    other = PermissionRegistry()
+    other.intern("z")
+
+    assert registry.compile(("a", "b")) == 0b11
+    assert other.compile(("a", "b")) == 0b110
+    assert registry.compile(("c",)) == 0b100
+    assert registry.compile(("a",)) == 0b1
+    assert list(registry._compiled) == [("c",), ("a",)]
+    assert list(other._compiled) == [("a", "b")]
+
+
+def test_permission_mask__is_rebuilt_after_permissions_are_interned():
+    """
+    Test that a payload's mask picks up permissions interned after it was first built.
+    """
+    payload = TokenPayload(sub="me", permissions=["test-mask:a", "test-mask:b"])
+    permission_registry.intern("test-mask:a")
+    first_mask = payload.permission_mask
+    assert permission_registry.decode(first_mask) == ["test-mask:a"]
+
+    permission_registry.intern("test-mask:b")
+    assert sorted(permission_registry.decode(payload.permission_mask)) == [
+        "test-mask:a",
+        "test-mask:b",
+    ]
+
+
+def test_which__returns_the_permissions_the_token_has():
+    """
+    Test that a bulk query returns the queried permissions held by the token.
+    """
+    payload = TokenPayload(sub="me", permissions=[f"feature:{i}" for i in range(0, 10, 2)])
+    features = [f"feature:{i}" for i in range(10)]
+
+    assert payload.which(*features) == {f"feature:{i}" for i in range(0, 10, 2)}
+    assert payload.which("feature:0", "feature:2") == {"feature:0", "feature:2"}
+    assert payload.which("feature:1") == frozenset()
+    assert payload.which() == frozenset()
@@ -0,0 +1,126 @@
+"""
+Tests for the deferred discovery of installed plugins.
+"""
+
+import json
+import subprocess
+import sys
+from importlib.metadata import EntryPoint
+
+import pytest
+
+from armasec.pluggable import PluginRunner, discovery, hookimpl, plugin_manager
+from armasec.token_payload import TokenPayload
+
+
+class DummyPlugin:
+    calls: list = []
+
+    @staticmethod
+    @hookimpl
+    def armasec_plugin_check(token_payload):
+        DummyPlugin.calls.append(token_payload.sub)
+
+
+@pytest.fixture
+def unloaded(mocker):
+    """
+    Mark the installed plugins as not yet discovered for the duration of a test.
+    """
+    mocker.patch.object(discovery, "loaded", False)
+    yield
+    if plugin_manager.get_plugin("dummy") is not None:
+        plugin_manager.unregister(name="dummy")
+
+
+def test_import__does_not_discover_plugins():
+    """
+    Test that importing armasec's plugin machinery does not scan entrypoints or import starlette.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from armasec.pluggable import discovery, hookimpl; "
+            "print(discovery.loaded, 'starlette' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_scan_entrypoints__reuses_cached_scan_until_path_changes(tmp_path, mocker):
+    """
+    Test that the scan is cached on disk and only repeated if the import path changes.
+    """
+    cache_path = str(tmp_path / "cache" / "entrypoints.json")
+    mock_entry_points = mocker.patch.object(
+        discovery,
+        "entry_points",
+        return_value=[EntryPoint(name="dummy", value="plugin.main", group="armasec")],
+    )
+    mocker.patch.object(discovery, "path_fingerprint", return_value="before")
+
+    assert discovery.scan_entrypoints(cache_path) == [("dummy", "plugin.main")]
+    assert discovery.scan_entrypoints(cache_path) == [("dummy", "plugin.main")]
+    assert mock_entry_points.call_count == 1
+    with open(cache_path) as cache_file:
+        assert json.load(cache_file)["fingerprint"] == "before"
+
+    mocker.patch.object(discovery, "path_fingerprint", return_value="after")
+    assert discovery.scan_entrypoints(cache_path) == [("dummy", "plugin.main")]
+    assert mock_entry_points.call_count == 2
+
+    with open(cache_path, "w") as cache_file:
+        cache_file.write("not json")
+    assert discovery.scan_entrypoints(cache_path) == [("dummy", "plugin.main")]
+    assert mock_entry_points.call_count == 3
+
+
+def test_load_plugins__registers_installed_plugins_once(unloaded, mocker):
+    """
+    Test that load_plugins registers the discovered plugins under their entrypoint names once.
+    """
+    mock_scan = mocker.patch.object(
+        discovery,
+        "scan_entrypoints",
+        return_value=[("dummy", "tests.test_plugin_discovery:DummyPlugin")],
+    )
+
+    assert discovery.load_plugins() == ["dummy"]
+    assert plugin_manager.get_plugin("dummy") is DummyPlugin
+    assert discovery.load_plugins() == []
+    assert mock_scan.call_count == 1
+
+
+async def test_check__discovers_plugins_on_first_check(unloaded, mocker):
+    """
+    Test that the first plugin check discovers the installed plugins.
+    """
+    mocker.patch.object(
+        discovery,
+        "scan_entrypoints",
+        return_value=[("dummy", "tests.test_plugin_discovery:DummyPlugin")],
+    )
+    DummyPlugin.calls.clear()
+
+    await PluginRunner().check(None, TokenPayload(sub="me"))
+    assert DummyPlugin.calls == ["me"]
+    assert discovery.loaded
+
+
+def test_default_cache_path__respects_environment(monkeypatch):
+    """
+    Test that the cache path can be overridden or disabled with ARMASEC_ENTRYPOINT_CACHE.
+    """
+    monkeypatch.setenv("ARMASEC_ENTRYPOINT_CACHE", "/tmp/armasec-entrypoints.json")
+    assert discovery.default_cache_path() == "/tmp/armasec-entrypoints.json"
+
+    monkeypatch.setenv("ARMASEC_ENTRYPOINT_CACHE", "")
+    assert discovery.default_cache_path() is None
+
+    monkeypatch.delenv("ARMASEC_ENTRYPOINT_CACHE")
+    monkeypatch.setenv("XDG_CACHE_HOME", "/var/cache/me")
+    assert discovery.default_cache_path().startswith("/var/cache/me/armasec/entrypoints-")
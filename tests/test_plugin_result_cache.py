@@ -0,0 +1,168 @@
+"""
+Tests for the PluginResultCache and the caching of plugin decisions by the PluginRunner.
+"""
+
+import asyncio
+import time
+
+import pluggy
+import pytest
+
+from armasec.exceptions import ArmasecError
+from armasec.pluggable import PluginResultCache, PluginRunner, hookimpl, hookspecs, route_path
+from armasec.pluggable.result_cache import MISS
+from armasec.token_payload import TokenPayload
+
+
+class DummyError(ArmasecError):
+    pass
+
+
+@pytest.fixture
+def manager():
+    """
+    Provide an isolated plugin manager so that test plugins do not leak into other tests.
+    """
+    manager = pluggy.PluginManager("armasec")
+    manager.add_hookspecs(hookspecs)
+    return manager
+
+
+def cacheable_plugin(calls: list, ttl: float = 60, error=None):
+    class Plugin:
+        armasec_cache_ttl = ttl
+
+        @staticmethod
+        def armasec_cache_key(request, token_payload):
+            return token_payload.sub if token_payload.sub != "anonymous" else None
+
+        @hookimpl
+        def armasec_plugin_check(self, token_payload):
+            calls.append(token_payload.sub)
+            if error is not None:
+                raise error
+
+    return Plugin()
+
+
+def test_get__returns_stored_decisions_until_they_expire():
+    """
+    Test that decisions are returned until the TTL passes or the token expires.
+    """
+    cache = PluginResultCache()
+    error = DummyError("Denied")
+
+    cache.set("pass", None, ttl=60)
+    cache.set("fail", error, ttl=60)
+    cache.set("short", None, ttl=-1)
+    cache.set("token-expired", None, ttl=60, token_expires_at=time.time() - 1)
+
+    assert cache.get("pass") is None
+    denial = cache.get("fail")
+    assert isinstance(denial, DummyError)
+    assert denial is not error
+    assert denial.args == error.args
+    assert cache.get("short") is MISS
+    assert cache.get("token-expired") is MISS
+    assert cache.get("missing") is MISS
+    assert cache.metrics() == dict(entries=2, hit_rate=0.4, hits=2, misses=3, sets=4)
+
+
+def test_set__evicts_least_recently_used_decisions():
+    """
+    Test that the cache stays within its bounds by evicting the least recently used decisions.
+    """
+    cache = PluginResultCache(max_entries=2)
+    cache.set("a", None, ttl=60)
+    cache.set("b", None, ttl=60)
+    cache.get("a")
+    cache.set("c", None, ttl=60)
+
+    assert cache.get("b") is MISS
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert cache.stats["evictions"] == 1
+
+
+def test_route_path__prefers_route_template(mocker):
+    """
+    Test that route_path returns the template of the matched route, or the path otherwise.
+    """
+    route = mocker.MagicMock(path="/items/{item_id}")
+    assert route_path(mocker.MagicMock(scope=dict(route=route, path="/items/1"))) == (
+        "/items/{item_id}"
+    )
+    assert route_path(mocker.MagicMock(scope=dict(path="/items/1"))) == "/items/1"
+
+
+async def test_check__skips_plugin_calls_for_cached_decisions(manager):
+    """
+    Test that a cacheable plugin is only called once per key and that failures are cached too.
+    """
+    calls: list = []
+    manager.register(cacheable_plugin(calls), name="tenant-active")
+    runner = PluginRunner(manager)
+
+    for _ in range(3):
+        await runner.check(None, TokenPayload(sub="me"))
+    assert calls == ["me"]
+
+    runner.result_cache.set(("tenant-active", "locked"), DummyError("Account locked"), ttl=60)
+    for _ in range(2):
+        with pytest.raises(DummyError, match="Account locked"):
+            await runner.check(None, TokenPayload(sub="locked"))
+    assert calls == ["me"]
+
+    stats = runner.metrics()["tenant-active"]
+    assert (stats["calls"], stats["cache_hits"], stats["cache_misses"]) == (1, 4, 1)
+    assert stats["cache_hit_rate"] == 0.8
+
+
+async def test_check__caches_failed_decisions(manager):
+    """
+    Test that a plugin that raises an ArmasecError is not called again while its decision is live.
+    """
+    calls: list = []
+    manager.register(cacheable_plugin(calls, error=DummyError("Tenant inactive")))
+    runner = PluginRunner(manager)
+
+    raised = []
+    for _ in range(3):
+        with pytest.raises(DummyError, match="Tenant inactive") as err_info:
+            await runner.check(None, TokenPayload(sub="me"))
+        raised.append(err_info.value)
+    assert calls == ["me"]
+    assert raised[1] is not raised[2]
+
+
+async def test_check__does_not_cache_unexpected_errors_or_uncacheable_requests(manager):
+    """
+    Test that errors other than ArmasecError and requests without a cache key are not cached.
+    """
+    calls: list = []
+    manager.register(cacheable_plugin(calls, error=RuntimeError("Database is down")))
+    runner = PluginRunner(manager)
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await runner.check(None, TokenPayload(sub="me"))
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await runner.check(None, TokenPayload(sub="anonymous"))
+    assert calls == ["me", "me", "anonymous", "anonymous"]
+
+
+async def test_check__expires_decisions_with_the_token(manager):
+    """
+    Test that a cached decision is not used after the token it was decided for expires.
+    """
+    calls: list = []
+    manager.register(cacheable_plugin(calls, ttl=60))
+    runner = PluginRunner(manager)
+    token_payload = TokenPayload(sub="me", exp=time.time() + 0.05)
+
+    await runner.check(None, token_payload)
+    await runner.check(None, token_payload)
+    await asyncio.sleep(0.06)
+    await runner.check(None, token_payload)
+    assert calls == ["me", "me"]
@@ -0,0 +1,255 @@
+"""
+Tests for the PluginRunner.
+"""
+
+import asyncio
+import threading
+from time import perf_counter
+
+import pluggy
+import pytest
+
+from armasec.exceptions import ArmasecError, PluginTimeoutError
+from armasec.pluggable import PluginRunner, hookimpl
+from armasec.pluggable import hookspecs
+from armasec.token_payload import TokenPayload
+
+
+class DummyError(ArmasecError):
+    pass
+
+
+@pytest.fixture
+def manager():
+    """
+    Provide an isolated plugin manager so that test plugins do not leak into other tests.
+    """
+    manager = pluggy.PluginManager("armasec")
+    manager.add_hookspecs(hookspecs)
+    return manager
+
+
+@pytest.fixture
+def token_payload():
+    return TokenPayload(sub="me", permissions=["a"])
+
+
+def sleeping_plugin(delay: float, calls: list):
+    class Plugin:
+        @hookimpl
+        async def armasec_plugin_check_async(self, token_payload):
+            await asyncio.sleep(delay)
+            calls.append(token_payload.sub)
+
+    return Plugin()
+
+
+async def test_check__runs_async_plugins_concurrently(manager, token_payload):
+    """
+    Test that async plugins run concurrently, so the total time is bounded by the slowest one.
+    """
+    calls: list = []
+    for delay in (0.1, 0.1, 0.1):
+        manager.register(sleeping_plugin(delay, calls))
+
+    start = perf_counter()
+    await PluginRunner(manager).check(None, token_payload)
+    assert perf_counter() - start < 0.25
+    assert calls == ["me", "me", "me"]
+
+
+async def test_check__raises_timeout_error_for_slow_plugins(manager, token_payload):
+    """
+    Test that plugins that exceed the timeout are cancelled and deny the request.
+    """
+    calls: list = []
+    manager.register(sleeping_plugin(1.0, calls))
+
+    with pytest.raises(PluginTimeoutError, match="1 plugin checks did not finish"):
+        await PluginRunner(manager, timeout=0.05).check(None, token_payload)
+    await asyncio.sleep(0)
+    assert calls == []
+
+
+async def test_check__fails_fast_on_first_error(manager, token_payload):
+    """
+    Test that the first failing plugin denies the request without waiting for the slow ones.
+    """
+
+    class FailingPlugin:
+        @hookimpl
+        async def armasec_plugin_check_async():
+            raise DummyError("Denied by failing plugin")
+
+    calls: list = []
+    manager.register(sleeping_plugin(1.0, calls))
+    manager.register(FailingPlugin)
+
+    start = perf_counter()
+    with pytest.raises(DummyError, match="Denied by failing plugin"):
+        await PluginRunner(manager).check(None, token_payload)
+    assert perf_counter() - start < 0.5
+
+
+async def test_check__calls_sync_plugins_inline(manager, token_payload):
+    """
+    Test that sync plugins are still called with only the arguments they accept.
+    """
+    calls: list = []
+
+    class SyncPlugin:
+        @hookimpl
+        def armasec_plugin_check(request, token_payload):
+            calls.append((request, token_payload.sub, threading.current_thread()))
+
+    manager.register(SyncPlugin)
+    await PluginRunner(manager).check("dummy-request", token_payload)
+    assert calls == [("dummy-request", "me", threading.current_thread())]
+
+
+async def test_check__offloads_sync_plugins_to_threads(manager, token_payload):
+    """
+    Test that offloaded sync plugins run in threads concurrently with the async plugins.
+    """
+    calls: list = []
+
+    class BlockingPlugin:
+        @hookimpl
+        def armasec_plugin_check():
+            threading.Event().wait(0.1)
+            calls.append(threading.current_thread())
+
+    manager.register(BlockingPlugin)
+    manager.register(sleeping_plugin(0.1, []))
+
+    start = perf_counter()
+    await PluginRunner(manager, offload_sync=True).check(None, token_payload)
+    assert perf_counter() - start < 0.18
+    assert calls[0] is not threading.current_thread()
+
+
+async def test_check__runs_sync_hook_with_wrappers_through_pluggy(manager, token_payload):
+    """
+    Test that the sync hook is called through pluggy when a plugin wraps it.
+    """
+    calls: list = []
+
+    class WrapperPlugin:
+        @hookimpl(wrapper=True)
+        def armasec_plugin_check():
+            calls.append("before")
+            yield
+            calls.append("after")
+
+    class SyncPlugin:
+        @hookimpl
+        def armasec_plugin_check():
+            calls.append("check")
+
+    manager.register(SyncPlugin)
+    manager.register(WrapperPlugin)
+    await PluginRunner(manager).check(None, token_payload)
+    assert calls == ["before", "check", "after"]
+
+
+def recording_plugin(calls: list, label: str, cost: float = 0, tags=(), fail: bool = False):
+    class Plugin:
+        armasec_cost = cost
+        armasec_tags = tags
+
+        @hookimpl
+        def armasec_plugin_check(self):
+            calls.append(label)
+            DummyError.require_condition(not fail, f"Denied by {label}")
+
+    return Plugin()
+
+
+async def test_check__runs_selected_plugins_by_name_or_tag(manager, token_payload):
+    """
+    Test that a selection only runs the plugins with the selected names or tags.
+    """
+    calls: list = []
+    manager.register(recording_plugin(calls, "subscription"), name="subscription")
+    manager.register(recording_plugin(calls, "admin", tags=("admin",)), name="admin")
+    manager.register(recording_plugin(calls, "audit"), name="audit")
+    runner = PluginRunner(manager)
+
+    await runner.check(None, token_payload, selection=runner.select(names=["subscription"]))
+    assert calls == ["subscription"]
+
+    calls.clear()
+    await runner.check(None, token_payload, selection=runner.select(tags=["admin"]))
+    assert calls == ["admin"]
+
+    calls.clear()
+    await runner.check(
+        None, token_payload, selection=runner.select(names=["audit"], tags=["admin"])
+    )
+    assert sorted(calls) == ["admin", "audit"]
+
+    calls.clear()
+    await runner.check(None, token_payload)
+    assert sorted(calls) == ["admin", "audit", "subscription"]
+
+
+async def test_check__runs_cheap_plugins_first_and_short_circuits(manager, token_payload):
+    """
+    Test that plugins run in order of their declared cost and that a failing cheap plugin denies
+    the request before the expensive plugins are called.
+    """
+    calls: list = []
+    manager.register(recording_plugin(calls, "expensive", cost=10), name="expensive")
+    manager.register(recording_plugin(calls, "cheap", cost=1), name="cheap")
+    manager.register(recording_plugin(calls, "medium", cost=5), name="medium")
+    runner = PluginRunner(manager)
+
+    await runner.check(None, token_payload)
+    assert calls == ["cheap", "medium", "expensive"]
+
+    calls.clear()
+    manager.register(recording_plugin(calls, "failing", cost=2, fail=True), name="failing")
+    with pytest.raises(DummyError, match="Denied by failing"):
+        await runner.check(None, token_payload)
+    assert calls == ["cheap", "failing"]
+
+
+async def test_check__resolves_plan_again_after_registration(manager, token_payload):
+    """
+    Test that a selection resolves its plan once and again only if the registered plugins change.
+    """
+    calls: list = []
+    runner = PluginRunner(manager)
+    selection = runner.select(names=["late"])
+
+    await runner.check(None, token_payload, selection=selection)
+    plan = selection.plan()
+    assert plan == []
+
+    manager.register(recording_plugin(calls, "late"), name="late")
+    await runner.check(None, token_payload, selection=selection)
+    assert calls == ["late"]
+    assert selection.plan() is selection.plan()
+
+
+async def test_check__records_plugin_metrics(manager, token_payload):
+    """
+    Test that the runner records the calls, failures, and latency of each plugin.
+    """
+    calls: list = []
+    manager.register(recording_plugin(calls, "passing"), name="passing")
+    manager.register(recording_plugin(calls, "failing", cost=1, fail=True), name="failing")
+    manager.register(sleeping_plugin(1.0, calls), name="slow")
+    runner = PluginRunner(manager, timeout=0.05)
+
+    for _ in range(2):
+        with pytest.raises(PluginTimeoutError):
+            await runner.check(None, token_payload)
+    await asyncio.sleep(0)
+
+    metrics = runner.metrics()
+    assert metrics["passing"]["calls"] == 2
+    assert metrics["passing"]["failures"] == 0
+    assert metrics["passing"]["mean_time"] >= 0
+    assert metrics["slow"]["cancelled"] == 2
+    assert "failing" not in metrics
@@ -0,0 +1,174 @@
+"""
+Tests for the compiled authorization policies.
+"""
+
+import pytest
+
+from armasec.exceptions import ArmasecError, AuthorizationError
+from armasec.permissions import PermissionMode, check_match_keys, compile_match_keys
+from armasec.policy import Policy, ScopeExpression
+from armasec.token_payload import TokenPayload
+
+
+@pytest.mark.parametrize(
+    "expression, permissions, expected",
+    [
+        ("admin", {"admin"}, True),
+        ("admin", {"read:x"}, False),
+        ('"admin" or ("read:x" and "tenant:y")', {"admin"}, True),
+        ('"admin" or ("read:x" and "tenant:y")', {"read:x", "tenant:y"}, True),
+        ('"admin" or ("read:x" and "tenant:y")', {"read:x"}, False),
+        ("admin or read:x and tenant:y", {"tenant:y", "read:x"}, True),
+        ("admin or read:x and tenant:y", {"tenant:y"}, False),
+        ("(admin or read:x) and tenant:y", {"admin"}, False),
+        ("(admin or read:x) and tenant:y", {"admin", "tenant:y"}, True),
+        ("read:x and not banned", {"read:x"}, True),
+        ("read:x and not banned", {"read:x", "banned"}, False),
+        ("not not admin", {"admin"}, True),
+        ("a and b and (c or d or not e)", {"a", "b", "e"}, False),
+        ("a and b and (c or d or not e)", {"a", "b", "d", "e"}, True),
+        ("'has space' AND other", {"has space", "other"}, True),
+        ('"and" or "or"', {"or"}, True),
+    ],
+)
+def test_scope_expression__evaluates_permissions(expression, permissions, expected):
+    """
+    Test that scope expressions follow boolean precedence and accept bare or quoted scopes.
+    """
+    assert ScopeExpression(expression)(frozenset(permissions)) is expected
+
+
+@pytest.mark.parametrize(
+    "expression, message",
+    [
+        ("admin or", "Unexpected end"),
+        ("(admin or read:x", "Unexpected end"),
+        ("admin read:x", "Unexpected 'read:x'"),
+        ("admin)", r"Unexpected '\)'"),
+        ("and admin", "Unexpected 'and'"),
+        ('"unterminated', "Malformed scope expression"),
+    ],
+)
+def test_scope_expression__rejects_malformed_expressions(expression, message):
+    """
+    Test that malformed expressions are rejected when they are compiled.
+    """
+    with pytest.raises(ArmasecError, match=message):
+        ScopeExpression(expression)
+
+
+def test_scope_expression__lists_its_scopes():
+    """
+    Test that a scope expression reports the scopes it refers to.
+    """
+    assert ScopeExpression("a or (b and not c)").scopes == {"a", "b", "c"}
+
+
+def test_policy__combines_scopes_expression_and_match_keys():
+    """
+    Test that a policy requires its scopes, its scope expression, and its match_keys together.
+    """
+    policy = Policy(
+        ["read:x"],
+        requires="admin or tenant:y",
+        match_keys=dict(org="acme"),
+    )
+    assert policy.allows(TokenPayload(sub="me", permissions=["read:x", "admin"], org="acme"))
+    assert not policy.allows(TokenPayload(sub="me", permissions=["admin"], org="acme"))
+    assert not policy.allows(TokenPayload(sub="me", permissions=["read:x"], org="acme"))
+    assert not policy.allows(TokenPayload(sub="me", permissions=["read:x", "admin"], org="other"))
+
+
+def test_policy__builds_error_for_failed_requirement():
+    """
+    Test that the error raised by a policy describes the requirement that failed.
+    """
+    policy = Policy(["read:x", "read:y"], requires="admin", match_keys=dict(org="acme"))
+
+    with pytest.raises(AuthorizationError, match="missing some required permissions"):
+        policy.check(TokenPayload(sub="me", permissions=["read:x"]))
+    with pytest.raises(AuthorizationError, match="do not satisfy the required scope expression"):
+        policy.check(TokenPayload(sub="me", permissions=["read:x", "read:y"]))
+    with pytest.raises(AuthorizationError, match="doesn't contain necessary key-value pairs"):
+        policy.check(TokenPayload(sub="me", permissions=["read:x", "read:y", "admin"], org="x"))
+
+    some_policy = Policy(["read:x", "read:y"], permission_mode=PermissionMode.SOME)
+    some_policy.check(TokenPayload(sub="me", permissions=["read:y"]))
+    with pytest.raises(AuthorizationError, match="missing at least"):
+        some_policy.check(TokenPayload(sub="me", permissions=["read:z"]))
+
+    with pytest.raises(AuthorizationError, match="Unknown permission_mode"):
+        Policy(["read:x"], permission_mode="BOGUS").check(  # type: ignore[arg-type]
+            TokenPayload(sub="me", permissions=["read:x"])
+        )
+
+
+def test_policy__is_empty_without_requirements():
+    """
+    Test that a policy without requirements allows every token.
+    """
+    policy = Policy()
+    assert policy.is_empty
+    assert policy.allows(TokenPayload(sub="me"))
+    assert not Policy(match_keys=dict(org="acme")).is_empty
+
+
+@pytest.mark.parametrize(
+    "match_keys, claims",
+    [
+        (dict(admin=True), dict(admin=True)),
+        (dict(admin=True), dict(admin=1)),
+        (dict(org="acme"), dict(org="acme")),
+        (dict(org="acme"), dict(org="other")),
+        (dict(level=3), dict(level=3.0)),
+        (dict(groups=["a", "b"]), dict(groups=["b", "c"])),
+        (dict(groups=["a", "b"]), dict(groups=["c"])),
+        (dict(org="acme", groups={"a"}), dict(org="acme", groups=["a"])),
+    ],
+)
+def test_compile_match_keys__matches_check_match_keys(match_keys, claims):
+    """
+    Test that compiled match_keys give the same decisions as check_match_keys.
+    """
+    token_payload = TokenPayload(sub="me", **claims)
+    try:
+        check_match_keys(token_payload, match_keys)
+        expected = True
+    except AuthorizationError:
+        expected = False
+
+    predicate = compile_match_keys(match_keys)
+    assert predicate is not None
+    assert predicate(token_payload) is expected
+    assert compile_match_keys({}) is None
+
+
+@pytest.mark.parametrize(
+    "permissions, allowed",
+    [
+        (["jobs:read", "tenant"], True),
+        (["jobs:*", "admin"], True),
+        (["*:read", "tenant"], True),
+        (["jobs:read"], False),
+        (["jobs:write", "admin"], False),
+    ],
+)
+def test_policy__matches_wildcard_scopes(permissions, allowed):
+    """
+    Test that a policy with wildcard_scopes accepts wildcard and hierarchical permissions for its
+    scopes and its scope expression, while one without them requires exact matches.
+    """
+    token_payload = TokenPayload(sub="me", permissions=permissions)
+    policy = Policy(
+        scopes=["jobs:read"], requires="admin:jobs or tenant:acme", wildcard_scopes=True
+    )
+    if allowed:
+        policy.check(token_payload)
+    else:
+        with pytest.raises(AuthorizationError):
+            policy.check(token_payload)
+
+    assert (
+        Policy(scopes=["jobs:read"], requires="admin:jobs or tenant:acme").allows(token_payload)
+        is False
+    )
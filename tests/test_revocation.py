@@ -0,0 +1,170 @@
+"""
+Tests for the RevocationList and its sources.
+"""
+
+import json
+import os
+import threading
+import time
+from unittest import mock
+
+import httpx
+import pytest
+import respx
+from starlette import status
+
+from armasec.exceptions import ArmasecError, AuthenticationError
+from armasec.revocation import (
+    FileRevocationSource,
+    HttpRevocationSource,
+    MemoryRevocationSource,
+    RevocationList,
+)
+from armasec.token_payload import TokenPayload
+
+
+def build_payload(**claims) -> TokenPayload:
+    return TokenPayload(**{"sub": "someone", **claims})
+
+
+def test_is_revoked__checks_each_identifying_claim():
+    """
+    Test that a token is revoked if its `jti`, `sid` or `sub` was revoked.
+    """
+    source = MemoryRevocationSource()
+    source.revoke("token-1")
+    source.revoke("session-1")
+    source.revoke("compromised")
+    revocation_list = RevocationList(source, sync_interval=None)
+
+    assert revocation_list.is_revoked(build_payload(jti="token-1"))
+    assert revocation_list.is_revoked(build_payload(jti="token-2", sid="session-1"))
+    assert revocation_list.is_revoked(build_payload(sub="compromised"))
+    assert not revocation_list.is_revoked(build_payload(jti="token-2", sid="session-2"))
+    assert revocation_list.metrics() == dict(revoked_identifiers=3, syncs=1, revoked=3)
+
+    with pytest.raises(AuthenticationError, match="Token has been revoked"):
+        revocation_list.check(build_payload(jti="token-1"))
+
+
+def test_sync__applies_incremental_changes():
+    """
+    Test that a sync only applies the changes made since the last one, including restored
+    identifiers, and forgets revocations that expired.
+    """
+    source = MemoryRevocationSource()
+    source.revoke("token-1")
+    revocation_list = RevocationList(source, sync_interval=None)
+    assert "token-1" in revocation_list
+
+    source.revoke("token-2")
+    source.revoke("token-3", expires_at=time.time() - 1)
+    source.restore("token-1")
+    assert source.fetch("1").revoked.keys() == {"token-2", "token-3"}
+
+    assert revocation_list.sync()
+    assert "token-1" not in revocation_list
+    assert "token-2" in revocation_list
+    assert "token-3" not in revocation_list
+    assert len(revocation_list) == 1
+
+
+def test_sync__keeps_the_last_list_on_failure(tmp_path):
+    """
+    Test that a file source is only reloaded when the file changed, and that a broken file keeps
+    the last synced list.
+    """
+    path = tmp_path / "revoked.json"
+    path.write_text(json.dumps({"token-1": None}))
+    revocation_list = RevocationList(FileRevocationSource(str(path)), sync_interval=None)
+    assert revocation_list.is_revoked(build_payload(jti="token-1"))
+
+    path.write_text(json.dumps({"token-2": None}))
+    os.utime(path, (0, 1))
+    revocation_list.sync()
+    assert not revocation_list.is_revoked(build_payload(jti="token-1"))
+    assert revocation_list.is_revoked(build_payload(jti="token-2"))
+
+    path.write_text("not json")
+    os.utime(path, (0, 2))
+    with pytest.raises(ArmasecError, match="Failed to sync the revocation list"):
+        revocation_list.sync()
+    assert revocation_list.is_revoked(build_payload(jti="token-2"))
+    assert revocation_list.stats["failures"] == 1
+
+
+def test_is_revoked__never_syncs_on_the_request_path():
+    """
+    Test that checks only look up the list in memory while a background thread syncs it.
+    """
+    source = MemoryRevocationSource()
+    revocation_list = RevocationList(source, sync_interval=0.01)
+    fetching_threads = set()
+
+    def _fetch(cursor):
+        fetching_threads.add(threading.current_thread().name)
+        return MemoryRevocationSource.fetch(source, cursor)
+
+    try:
+        with mock.patch.object(source, "fetch", side_effect=_fetch):
+            source.revoke("token-1")
+            deadline = time.monotonic() + 5
+            while not revocation_list.is_revoked(build_payload(jti="token-1")):
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+        assert fetching_threads == {"armasec-revocation-sync"}
+    finally:
+        revocation_list.close()
+
+
+def test_init__fails_closed_until_the_first_sync(tmp_path):
+    """
+    Test that a list whose source is down when it is built rejects every token until it syncs,
+    unless it was built to fail open.
+    """
+    path = tmp_path / "revoked.json"
+    revocation_list = RevocationList(FileRevocationSource(str(path)), sync_interval=None)
+    assert revocation_list.is_revoked(build_payload(jti="token-1"))
+    with pytest.raises(AuthenticationError, match="Token has been revoked"):
+        revocation_list.check(build_payload(jti="token-1"))
+    assert revocation_list.stats["unsynced"] == 2
+
+    fail_open = RevocationList(FileRevocationSource(str(path)), sync_interval=None, fail_open=True)
+    assert not fail_open.is_revoked(build_payload(jti="token-1"))
+
+    path.write_text(json.dumps({"token-2": None}))
+    revocation_list.sync()
+    assert not revocation_list.is_revoked(build_payload(jti="token-1"))
+    assert revocation_list.is_revoked(build_payload(jti="token-2"))
+
+
+def test_http_source__passes_the_cursor_of_the_last_sync():
+    """
+    Test that an HTTP source requests the changes since the cursor it was given last.
+    """
+    with respx.mock:
+        route = respx.get("https://revocations.my.domain/changes")
+        route.side_effect = [
+            httpx.Response(
+                status.HTTP_200_OK,
+                json=dict(revoked={"token-1": None}, cursor="c1", full=True),
+            ),
+            httpx.Response(
+                status.HTTP_200_OK,
+                json=dict(revoked={"token-2": None}, restored=["token-1"], cursor="c2"),
+            ),
+            httpx.Response(status.HTTP_503_SERVICE_UNAVAILABLE),
+        ]
+        revocation_list = RevocationList(
+            HttpRevocationSource("https://revocations.my.domain/changes"), sync_interval=None
+        )
+        assert "token-1" in revocation_list
+
+        revocation_list.sync()
+        assert route.calls[1].request.url.params["since"] == "c1"
+        assert "token-1" not in revocation_list
+        assert "token-2" in revocation_list
+
+        with pytest.raises(ArmasecError, match="Failed to sync the revocation list"):
+            revocation_list.sync()
+        assert "token-2" in revocation_list
@@ -0,0 +1,104 @@
+"""
+Tests for the RoleMap.
+"""
+
+import json
+import os
+
+import pytest
+
+from armasec.exceptions import ArmasecError
+from armasec.role_map import RoleMap
+from armasec.schemas import DomainConfig
+
+ROLES = dict(
+    admin=["editor", "users:delete"],
+    editor=["viewer", "jobs:write"],
+    viewer=["jobs:read"],
+    auditor=["logs:read"],
+)
+
+
+def test_expand__includes_the_transitive_closure_of_each_role():
+    """
+    Test that composite roles are expanded through every role they include.
+    """
+    role_map = RoleMap(ROLES)
+    assert role_map.expand(["admin"]) == {
+        "admin",
+        "editor",
+        "viewer",
+        "users:delete",
+        "jobs:write",
+        "jobs:read",
+    }
+    assert role_map.expand(["viewer", "auditor"]) == {"viewer", "auditor", "jobs:read", "logs:read"}
+    assert role_map.expand(["unknown"]) == {"unknown"}
+    assert role_map.expand([]) == frozenset()
+
+
+def test_expand__tolerates_cycles():
+    """
+    Test that roles that include each other expand to the union of their grants.
+    """
+    role_map = RoleMap(dict(a=["b", "x"], b=["a", "y"]))
+    assert role_map.expand(["a"]) == {"a", "b", "x", "y"}
+    assert role_map.expand(["b"]) == {"a", "b", "x", "y"}
+
+
+def test_expand__caches_each_distinct_role_tuple():
+    """
+    Test that the expansion of a role tuple is only built once.
+    """
+    role_map = RoleMap(ROLES)
+    expansion = role_map.expand(["editor", "auditor"])
+    assert role_map.expand(["editor", "auditor"]) is expansion
+    assert role_map.stats["hits"] == 1
+    assert role_map.stats["misses"] == 1
+
+
+def test_reload__only_rebuilds_affected_roles():
+    """
+    Test that a reload rebuilds the closures of changed roles and the roles that include them,
+    and only drops the cached expansions that use them.
+    """
+    role_map = RoleMap(ROLES)
+    admin = role_map.expand(["admin"])
+    auditor = role_map.expand(["auditor"])
+
+    affected = role_map.reload({**ROLES, "viewer": ["jobs:read", "jobs:list"]})
+    assert affected == {"viewer", "editor", "admin"}
+    assert role_map.expand(["auditor"]) is auditor
+    assert role_map.expand(["admin"]) == admin | {"jobs:list"}
+
+    assert role_map.reload({**ROLES, "viewer": ["jobs:read", "jobs:list"]}) == set()
+
+
+def test_load_file__reloads_a_changed_file(tmp_path):
+    """
+    Test that a map loaded from a file is reloaded once the file changes and the check interval
+    has passed, and that a broken file keeps the last good map.
+    """
+    path = tmp_path / "roles.json"
+    path.write_text(json.dumps(ROLES))
+    role_map = RoleMap(path=str(path), check_interval=0)
+    assert "jobs:read" in role_map.expand(["viewer"])
+
+    path.write_text(json.dumps({**ROLES, "viewer": ["jobs:list"]}))
+    os.utime(path, (0, 1))
+    assert role_map.expand(["viewer"]) == {"viewer", "jobs:list"}
+
+    path.write_text("not json")
+    os.utime(path, (0, 2))
+    assert role_map.expand(["viewer"]) == {"viewer", "jobs:list"}
+    with pytest.raises(ArmasecError, match="Failed to load the role map"):
+        role_map.load_file()
+
+
+def test_domain_config__builds_a_role_map_from_a_dict():
+    """
+    Test that a DomainConfig accepts a role map as a dictionary of lists.
+    """
+    domain_config = DomainConfig(domain="my.domain", role_map=ROLES)
+    assert isinstance(domain_config.role_map, RoleMap)
+    assert domain_config.role_map.expand(["viewer"]) == {"viewer", "jobs:read"}
@@ -0,0 +1,48 @@
+"""
+Tests for wildcard and hierarchical scope matching with the ScopeTrie.
+"""
+
+import pytest
+
+from armasec.permission_registry import permission_registry
+from armasec.scope_trie import ScopeTrie, scope_trie
+
+
+@pytest.mark.parametrize(
+    "permissions, scope, expected",
+    [
+        (["jobs:read"], "jobs:read", True),
+        (["jobs:read"], "jobs:write", False),
+        (["jobs:*"], "jobs:read", True),
+        (["jobs:*"], "jobs", False),
+        (["jobs:*"], "tasks:read", False),
+        (["*:read"], "jobs:read", True),
+        (["*:read"], "jobs:write", False),
+        (["admin"], "admin:users:delete", True),
+        (["admin"], "administrator", False),
+        (["admin:users"], "admin", False),
+        (["jobs:*"], "jobs:read:all", True),
+        (["*"], "anything:at:all", True),
+        (["jobs:read:all", "*:write"], "jobs:read", False),
+        (["jobs:read:all", "*:write"], "jobs:write", True),
+        ([], "jobs:read", False),
+    ],
+)
+def test_grants__matches_wildcards_and_hierarchies(permissions, scope, expected):
+    """
+    Test that permissions grant scopes by wildcard segments and by prefix.
+    """
+    assert ScopeTrie(permissions).grants(scope) is expected
+
+
+def test_scope_trie__is_cached_per_permission_set():
+    """
+    Test that tokens with the same permissions share a trie and that masks are memoized on it.
+    """
+    trie = scope_trie(frozenset(["jobs:*", "admin"]))
+    assert scope_trie(frozenset(["admin", "jobs:*"])) is trie
+    assert scope_trie(frozenset(["jobs:*"])) is not trie
+
+    scopes = ("jobs:read", "admin:users", "tasks:read")
+    assert trie.mask(scopes) == permission_registry.compile(("jobs:read", "admin:users"))
+    assert trie.mask(scopes) is trie.mask(scopes)
@@ -0,0 +1,135 @@
+"""
+Test the shared_store module.
+"""
+
+import time
+
+import pytest
+
+from armasec.openid_config_loader import OpenidConfigLoader
+from armasec.schemas import JWKs
+from armasec.shared_store import SharedJwksStore, open_shared_store
+
+
+def test_put_and_get__bumps_generation(tmp_path):
+    """
+    Verify that entries written by one store are read by another store on the same file and that
+    every write bumps the generation.
+    """
+    path = str(tmp_path / "jwks.store")
+    writer = SharedJwksStore(path, size=4096)
+    reader = SharedJwksStore(path, size=4096)
+    assert reader.generation == 0
+    assert reader.get("armasec.dev") is None
+
+    writer.put("armasec.dev", dict(foo="bar"))
+    writer.put("other.dev", dict(baz="qux"))
+    assert reader.generation == 2
+    assert reader.get("armasec.dev") == dict(foo="bar")
+    assert reader.read() == {"armasec.dev": dict(foo="bar"), "other.dev": dict(baz="qux")}
+
+
+def test_put__fails_if_store_is_too_small(tmp_path):
+    """
+    Verify that a ValueError is raised if the entries do not fit in the store.
+    """
+    store = SharedJwksStore(str(tmp_path / "jwks.store"), size=64)
+    with pytest.raises(ValueError, match="too small"):
+        store.put("armasec.dev", dict(data="x" * 100))
+    assert store.generation == 0
+
+
+def test_try_acquire_refresh__is_exclusive(tmp_path):
+    """
+    Verify that only one store on the same file may hold the refresh lock at a time.
+    """
+    path = str(tmp_path / "jwks.store")
+    first = SharedJwksStore(path)
+    second = SharedJwksStore(path)
+    assert first.try_acquire_refresh()
+    assert not first.try_acquire_refresh()
+    assert not second.try_acquire_refresh()
+
+    first.release_refresh()
+    assert second.try_acquire_refresh()
+    second.release_refresh()
+
+
+def test_open_shared_store__returns_none_if_unavailable(tmp_path):
+    """
+    Verify that None is returned if the store cannot be opened so callers can fall back.
+    """
+    assert open_shared_store(str(tmp_path / "missing" / "jwks.store")) is None
+    assert open_shared_store(str(tmp_path / "jwks.store")) is open_shared_store(
+        str(tmp_path / "jwks.store")
+    )
+
+
+def test_loader__reads_from_store_published_by_another_worker(
+    tmp_path, mock_openid_server, rs256_domain, rs256_jwk
+):
+    """
+    Verify that a loader in another worker adopts the resources from the store without calling
+    the OIDC provider and detects later changes through the generation.
+    """
+    path = str(tmp_path / "jwks.store")
+    leader = OpenidConfigLoader(rs256_domain, shared_store=SharedJwksStore(path))
+    assert leader.jwks == JWKs(keys=[rs256_jwk])
+    assert mock_openid_server.jwks_route.call_count == 1
+
+    follower = OpenidConfigLoader(
+        rs256_domain, shared_store=SharedJwksStore(path), refresh_interval=60
+    )
+    assert follower.jwks == JWKs(keys=[rs256_jwk])
+    assert follower.config == leader.config
+    assert mock_openid_server.openid_config_route.call_count == 1
+    assert mock_openid_server.jwks_route.call_count == 1
+    assert follower.sync_from_store() is False
+
+    new_jwk = rs256_jwk.model_copy(update=dict(kid="NEW_KID"))
+    leader._jwks = JWKs(keys=[new_jwk])
+    leader._publish_to_store()
+    assert follower.sync_from_store() is True
+    assert follower.jwks == JWKs(keys=[new_jwk])
+
+
+def test_loader__refresh_uses_store_refreshed_by_another_worker(
+    tmp_path, mock_openid_server, rs256_domain
+):
+    """
+    Verify that a refresh is skipped if another worker refreshed within the refresh interval.
+    """
+    path = str(tmp_path / "jwks.store")
+    leader = OpenidConfigLoader(rs256_domain, shared_store=SharedJwksStore(path))
+    leader.jwks
+
+    follower = OpenidConfigLoader(
+        rs256_domain,
+        shared_store=SharedJwksStore(path),
+        refresh_interval=60,
+    )
+    follower.jwks
+    assert follower.refresh() is False
+    assert mock_openid_server.jwks_route.call_count == 1
+
+
+def test_loader__ignores_old_store_entries(tmp_path, mock_openid_server, rs256_domain, rs256_jwk):
+    """
+    Verify that a loader fetches from the OIDC provider instead of adopting an entry older than its
+    refresh interval, or any entry if it has no age limit.
+    """
+    path = str(tmp_path / "jwks.store")
+    leader = OpenidConfigLoader(rs256_domain, shared_store=SharedJwksStore(path))
+    leader.jwks
+    store = SharedJwksStore(path)
+    entry = store.get(rs256_domain)
+
+    for limits in (dict(refresh_interval=60), dict(max_staleness=600), dict()):
+        store.put(rs256_domain, dict(entry, updated_at=time.time() - 3600))
+        loader = OpenidConfigLoader(rs256_domain, shared_store=store, **limits)
+        assert loader.jwks == JWKs(keys=[rs256_jwk])
+    assert mock_openid_server.jwks_route.call_count == 4
+
+    store.put(rs256_domain, dict(entry, updated_at=time.time() - 300))
+    assert OpenidConfigLoader(rs256_domain, shared_store=store, max_staleness=600).jwks
+    assert mock_openid_server.jwks_route.call_count == 4
@@ -0,0 +1,200 @@
+"""
+Test the tenant_registry module.
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+
+from armasec.exceptions import AuthenticationError
+from armasec.schemas import DomainConfig, JWKs
+from armasec.tenant_registry import TenantRegistry
+
+
+@pytest.fixture
+def templated_domain_config():
+    """
+    Provide a templated DomainConfig for use in the tests.
+    """
+    return DomainConfig(domain="armasec.dev/realms/{tenant}", audience="https://this.api")
+
+
+@pytest.fixture
+def build_fake_manager_config(rs256_jwk):
+    """
+    Provide a mock build function that returns a fake ManagerConfig with a single jwk.
+    """
+
+    def _helper(domain_config):
+        fake_manager_config = mock.MagicMock()
+        fake_manager_config.domain_config = domain_config
+        fake_manager_config.manager.token_decoder.jwks = JWKs(keys=[rs256_jwk])
+        return fake_manager_config
+
+    return mock.MagicMock(side_effect=_helper)
+
+
+def test_tenant_from_issuer(templated_domain_config, build_fake_manager_config):
+    """
+    Verify that the tenant is extracted from issuers that match the templated domain.
+    """
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+    assert registry.tenant_from_issuer("https://armasec.dev/realms/acme") == "acme"
+    assert registry.tenant_from_issuer("https://armasec.dev/realms/acme/") == "acme"
+    assert registry.tenant_from_issuer("https://other.dev/realms/acme") is None
+    assert registry.tenant_from_issuer("https://armasec.dev/realms/a/b") is None
+    assert registry.tenant_from_issuer("https://armasec.dev/realms/..") is None
+    assert registry.tenant_from_issuer("https://armasec.dev/realms/./") is None
+    assert registry.tenant_from_issuer(None) is None
+
+
+def test_init__fails_for_domain_without_template(build_fake_manager_config):
+    """
+    Verify that a registry cannot be built for a domain without a tenant placeholder.
+    """
+    with pytest.raises(AuthenticationError, match="is not templated"):
+        TenantRegistry(DomainConfig(domain="armasec.dev"), build_fake_manager_config)
+
+
+def test_get__loads_once_and_evicts_least_recently_used(
+    templated_domain_config, build_fake_manager_config
+):
+    """
+    Verify that a tenant is only loaded once while resident and that the least recently used
+    tenant is evicted when the registry is full.
+    """
+    templated_domain_config.max_tenants = 2
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+
+    acme = registry.get("acme")
+    assert acme.domain_config.domain == "armasec.dev/realms/acme"
+    assert registry.get("acme") is acme
+    assert build_fake_manager_config.call_count == 1
+
+    registry.get("globex")
+    registry.get("acme")
+    registry.get("initech")
+    assert registry.metrics() == dict(
+        domain="armasec.dev/realms/{tenant}",
+        resident_tenants=2,
+        hits=2,
+        misses=3,
+        evictions=1,
+    )
+
+    registry.get("acme")
+    registry.get("globex")
+    assert build_fake_manager_config.call_count == 4
+
+
+def test_get__evicts_idle_tenants(templated_domain_config, build_fake_manager_config):
+    """
+    Verify that tenants that have been idle longer than the idle timeout are evicted.
+    """
+    templated_domain_config.tenant_idle_timeout = 60
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+
+    with mock.patch("armasec.tenant_registry.time.monotonic", return_value=100.0):
+        registry.get("acme")
+    with mock.patch("armasec.tenant_registry.time.monotonic", return_value=200.0):
+        registry.get("globex")
+
+    assert registry.metrics()["resident_tenants"] == 1
+    assert registry.stats["evictions"] == 1
+
+
+def test_get__rejects_tenant_over_key_cap(templated_domain_config, build_fake_manager_config):
+    """
+    Verify that a tenant holding more keys than allowed is rejected and not kept in memory.
+    """
+    templated_domain_config.max_keys_per_tenant = 0
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+    with pytest.raises(AuthenticationError, match="exceeds the maximum of 0"):
+        registry.get("acme")
+    assert registry.resolve_issuer("https://armasec.dev/realms/acme") is None
+    assert registry.metrics()["resident_tenants"] == 0
+
+
+def test_prefetch__loads_tenants(templated_domain_config, build_fake_manager_config):
+    """
+    Verify that prefetch loads all the requested tenants and skips the ones that fail.
+    """
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+    build_fake_manager_config.side_effect = [
+        mock.MagicMock(**{"manager.token_decoder.jwks": JWKs(keys=[])}),
+        RuntimeError("BOOM!"),
+        mock.MagicMock(**{"manager.token_decoder.jwks": JWKs(keys=[])}),
+    ]
+    templated_domain_config.prefetch_concurrency = 1
+    registry.prefetch(["acme", "globex", "initech"])
+    assert registry.metrics()["resident_tenants"] == 2
+
+
+def test_get__rejects_dot_segment_tenants(templated_domain_config, build_fake_manager_config):
+    """
+    Verify that "." and ".." are never loaded as tenants, since they would change the path of the
+    tenant's OIDC resources.
+    """
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+    for tenant in (".", "..", ".hidden", "a/b", ""):
+        with pytest.raises(AuthenticationError, match="Invalid tenant"):
+            registry.get(tenant)
+    assert registry.get("a.b").domain_config.domain == "armasec.dev/realms/a.b"
+    assert build_fake_manager_config.call_count == 1
+
+
+def test_get__caches_failed_tenants(templated_domain_config, build_fake_manager_config):
+    """
+    Verify that a tenant that failed to load is rejected without loading it again until the
+    failure TTL elapses.
+    """
+    templated_domain_config.tenant_failure_ttl = 30
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+    build_fake_manager_config.side_effect = RuntimeError("BOOM!")
+
+    with mock.patch("armasec.tenant_registry.time.monotonic", return_value=100.0):
+        with pytest.raises(AuthenticationError, match="Failed to load manager"):
+            registry.get("acme")
+        with pytest.raises(AuthenticationError, match="failed to load recently"):
+            registry.get("acme")
+        assert registry.resolve_issuer("https://armasec.dev/realms/acme") is None
+    assert build_fake_manager_config.call_count == 1
+    assert registry.stats["failed"] == 1
+    assert registry.stats["suppressed"] == 2
+
+    with mock.patch("armasec.tenant_registry.time.monotonic", return_value=131.0):
+        with pytest.raises(AuthenticationError, match="Failed to load manager"):
+            registry.get("acme")
+    assert build_fake_manager_config.call_count == 2
+
+
+def test_get__caps_concurrent_loads(templated_domain_config, build_fake_manager_config, rs256_jwk):
+    """
+    Verify that a request for a tenant that is not resident is rejected while too many tenants are
+    loading, without loading it.
+    """
+    templated_domain_config.max_tenant_loads = 1
+    registry = TenantRegistry(templated_domain_config, build_fake_manager_config)
+    loading = threading.Event()
+    release = threading.Event()
+
+    def _slow_build(domain_config):
+        loading.set()
+        release.wait(5)
+        return mock.MagicMock(**{"manager.token_decoder.jwks": JWKs(keys=[rs256_jwk])})
+
+    build_fake_manager_config.side_effect = _slow_build
+    thread = threading.Thread(target=registry.get, args=("acme",))
+    thread.start()
+    assert loading.wait(5)
+
+    with pytest.raises(AuthenticationError, match="Too many tenants are loading"):
+        registry.get("globex")
+    assert registry.stats["throttled"] == 1
+
+    release.set()
+    thread.join(5)
+    registry.get("globex")
+    assert registry.metrics()["resident_tenants"] == 2
+    assert build_fake_manager_config.call_count == 2
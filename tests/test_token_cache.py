@@ -0,0 +1,223 @@
+"""
+Test the token_cache module.
+"""
+
+import socketserver
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from armasec.schemas import JWKs
+from armasec.token_cache import (
+    InMemoryTokenCache,
+    RedisTokenCache,
+    SharedMemoryTokenCache,
+    TokenCache,
+    decode_entry,
+    encode_entry,
+)
+from armasec.token_decoder import TokenDecoder
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """
+    Handle the subset of the Redis protocol used by the RedisTokenCache.
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            (command, key) = (args[0].upper(), args[1])
+            if command == b"SET":
+                expires_at = time.time() + int(args[4]) / 1000
+                self.server.data[key] = (args[2], expires_at)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"GET":
+                (value, expires_at) = self.server.data.get(key, (None, 0))
+                if value is None or expires_at <= time.time():
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"DEL":
+                self.wfile.write(b":%d\r\n" % int(self.server.data.pop(key, None) is not None))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def fake_redis_server():
+    """
+    Provide a local fake server that speaks the Redis protocol.
+    """
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = dict()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_encode_entry__round_trips():
+    """
+    Verify that an entry carries the expiry and payload through serialization.
+    """
+    entry = encode_entry(dict(sub="me", permissions=["a"]), 1234.5)
+    assert decode_entry(entry) == (1234.5, dict(sub="me", permissions=["a"]))
+
+
+def test_in_memory__evicts_least_recently_used_and_expired():
+    """
+    Verify that the in-memory backend evicts the least recently used entry and drops expired ones.
+    """
+    backend = InMemoryTokenCache(max_entries=2)
+    later = time.time() + 60
+    backend.set("a", b"A", later)
+    backend.set("b", b"B", later)
+    assert backend.get("a") == b"A"
+    backend.set("c", b"C", later)
+    assert backend.get("b") is None
+    assert backend.get("a") == b"A"
+
+    backend.set("d", b"D", time.time() - 1)
+    assert backend.get("d") is None
+
+
+def test_shared_memory__shares_entries_across_instances(tmp_path):
+    """
+    Verify that entries written by one shared memory backend are read by another one on the
+    same file and that oversized entries are skipped.
+    """
+    path = str(tmp_path / "tokens.cache")
+    writer = SharedMemoryTokenCache(path, slots=16, slot_size=256)
+    reader = SharedMemoryTokenCache(path, slots=16, slot_size=256)
+    later = time.time() + 60
+
+    writer.set("a", b"A", later)
+    assert reader.get("a") == b"A"
+    assert reader.get("b") is None
+
+    writer.set("big", b"x" * 512, later)
+    assert reader.get("big") is None
+
+    writer.set("old", b"O", time.time() - 1)
+    assert reader.get("old") is None
+
+    reader.delete("b")
+    assert reader.get("a") == b"A"
+    reader.delete("a")
+    assert writer.get("a") is None
+
+
+def test_redis__stores_entries_in_fake_server(fake_redis_server):
+    """
+    Verify that the Redis backend stores and retrieves entries with an expiry.
+    """
+    (host, port) = fake_redis_server.server_address
+    backend = RedisTokenCache(host=host, port=port, timeout=1)
+    assert backend.get("a") is None
+
+    backend.set("a", b"A\r\nB", time.time() + 60)
+    assert backend.get("a") == b"A\r\nB"
+    assert (b"armasec:a") in fake_redis_server.data
+
+    backend.set("old", b"O", time.time() - 1)
+    assert backend.get("old") is None
+
+    backend.delete("a")
+    assert backend.get("a") is None
+    assert (b"armasec:a") not in fake_redis_server.data
+
+
+def test_token_cache__bypasses_failing_backend():
+    """
+    Verify that a failing backend is bypassed for the cooldown period.
+    """
+    backend = mock.MagicMock()
+    backend.get.side_effect = ConnectionError("BOOM!")
+    cache = TokenCache(backend=backend, bypass_cooldown=60)
+    assert cache.get("a") is None
+    assert cache.bypassed
+    assert cache.get("a") is None
+    assert backend.get.call_count == 1
+    assert cache.stats["errors"] == 1
+    assert cache.stats["bypassed"] == 1
+
+
+def test_token_cache__bypasses_slow_backend():
+    """
+    Verify that a backend slower than the latency budget is bypassed.
+    """
+    backend = InMemoryTokenCache()
+    cache = TokenCache(backend=backend, latency_budget=0.001)
+    with mock.patch.object(backend, "get", side_effect=lambda _: time.sleep(0.01)):
+        assert cache.get("a") is None
+    assert cache.bypassed
+    assert cache.stats["slow"] == 1
+
+
+def test_token_cache__drops_undecodable_entries():
+    """
+    Verify that an entry that cannot be decoded is a miss and is removed from the backend, without
+    bypassing it.
+    """
+    backend = InMemoryTokenCache()
+    cache = TokenCache(backend=backend)
+    later = time.time() + 60
+    backend.set("short", b"x", later)
+    backend.set("garbage", encode_entry(dict(sub="me"), later)[:-2], later)
+    backend.set("list", encode_entry([], later), later)  # type: ignore[arg-type]
+
+    for key in ("short", "garbage", "list"):
+        assert cache.get(key) is None
+        assert backend.get(key) is None
+    assert cache.stats["corrupt"] == 3
+    assert cache.stats["misses"] == 3
+    assert not cache.bypassed
+
+
+def test_token_cache__skips_payloads_without_expiry():
+    """
+    Verify that payloads without an expiry are not cached and that max_ttl caps the expiry.
+    """
+    cache = TokenCache(max_ttl=10)
+    cache.set("a", dict(sub="me"), expires_at=None)
+    assert cache.get("a") is None
+
+    cache.set("b", dict(sub="me"), expires_at=time.time() + 3600)
+    (expires_at, _) = decode_entry(cache.backend.get("b"))
+    assert expires_at <= time.time() + 10
+
+
+def test_decoder__uses_token_cache(rs256_jwk, build_rs256_token):
+    """
+    Verify that a decoder verifies a token once and serves repeat decodes from the cache, and that
+    decoders in different namespaces do not share entries.
+    """
+    cache = TokenCache()
+    decoder = TokenDecoder(JWKs(keys=[rs256_jwk]), token_cache=cache, cache_namespace="one")
+    token = build_rs256_token(claim_overrides=dict(sub="me", permissions=["read:stuff"]))
+
+    first = decoder.decode(token)
+    with mock.patch("jose.jwt.decode") as mock_decode:
+        second = decoder.decode(token)
+        mock_decode.assert_not_called()
+
+    assert second.sub == first.sub == "me"
+    assert second.permissions == ["read:stuff"]
+    assert second.original_token == token
+    assert cache.stats["hits"] == 1
+
+    other = TokenDecoder(JWKs(keys=[rs256_jwk]), token_cache=cache, cache_namespace="two")
+    other.decode(token)
+    assert cache.stats["hits"] == 1
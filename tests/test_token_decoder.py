@@ -8,6 +8,7 @@ from unittest import mock
 import pytest
 
 from armasec.exceptions import AuthenticationError, PayloadMappingError
+from armasec.role_map import RoleMap
 from armasec.schemas.jwks import JWK, JWKs
 from armasec.token_decoder import TokenDecoder, extract_keycloak_permissions
 
@@ -142,6 +143,27 @@ def test_decode__with_permission_extractor(rs256_jwk, build_rs256_token):
     assert token_payload.permissions == ["read:stuff", "write:stuff"]
 
 
+def test_decode__with_role_map(rs256_jwk, build_rs256_token):
+    """
+    Verify that an RS256Decoder expands the extracted permissions through a role map.
+    """
+    token = build_rs256_token(
+        claim_overrides=dict(
+            permissions=[],
+            resource_access=dict(default=dict(roles=["editor"])),
+        ),
+    )
+
+    decoder = TokenDecoder(
+        JWKs(keys=[rs256_jwk]),
+        permission_extractor=lambda token_dict: token_dict["resource_access"]["default"]["roles"],
+        role_map=RoleMap(dict(editor=["viewer", "write:stuff"], viewer=["read:stuff"])),
+    )
+    token_payload = decoder.decode(token)
+    assert sorted(token_payload.permissions) == ["editor", "read:stuff", "viewer", "write:stuff"]
+    assert token_payload.permission_set == {"editor", "read:stuff", "viewer", "write:stuff"}
+
+
 def test_decode__permission_extractor_raises_error(rs256_jwk, build_rs256_token):
     """
     Verify that an RS256Decoder handles a failure in the permission extractor.
@@ -192,3 +214,16 @@ def test_extract_keycloak_permissions():
     }
 
     assert extract_keycloak_permissions(decoded_token) == ["read:stuff"]
+
+
+def test_jwks__replacing_keys_rebuilds_decode_keys(rs256_jwk, build_rs256_token):
+    """
+    Verify that replacing the jwks of a decoder prepares the new decode keys.
+    """
+    decoder = TokenDecoder(JWKs(keys=[]))
+    token = build_rs256_token()
+    with pytest.raises(AuthenticationError, match="Could not find a matching jwk"):
+        decoder.get_decode_key(token)
+
+    decoder.jwks = JWKs(keys=[rs256_jwk])
+    assert decoder.get_decode_key(token)["kid"] == rs256_jwk.kid
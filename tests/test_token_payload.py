@@ -44,3 +44,24 @@ def test_from_dict():
     assert payload.permissions == ["a", "b", "c"]
     assert payload.expire == exp
     assert payload.client_id == "some-fake-id"
+
+
+def test_permission_set():
+    """
+    This test verifies that the permissions of a TokenPayload are available as a frozenset that is
+    only built once.
+    """
+    payload = TokenPayload(sub="someone", permissions=["a", "b", "a"])
+    assert payload.permission_set == frozenset(["a", "b"])
+    assert payload.permission_set is payload.permission_set
+
+
+def test_token_digest():
+    """
+    Test that payloads decoded from the same token share a digest that is built once.
+    """
+    payload = TokenPayload(sub="me", original_token="a.b.c")
+    assert payload.token_digest == TokenPayload(sub="me", original_token="a.b.c").token_digest
+    assert payload.token_digest is payload.token_digest
+    assert payload.token_digest != TokenPayload(sub="me", original_token="a.b.d").token_digest
+    assert TokenPayload(sub="me").token_digest is None
@@ -2,6 +2,7 @@
 Verify that the TokenSecurity functions as expected with FastAPI's dependeny injection on endpoints
 """
 
+import asyncio
 from typing import List, Optional
 
 import asgi_lifespan
@@ -10,11 +11,21 @@ import httpx
 import pendulum
 import pytest
 import starlette
+import time
 from plummet import frozen_time
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 
 from armasec.token_security import PermissionMode, TokenSecurity
-from armasec.pluggable import plugin_manager, hookimpl
+from armasec.pluggable import PluginRunner, plugin_manager, hookimpl
 from armasec.exceptions import ArmasecError
+from armasec.token_decoder import TokenDecoder
+from armasec.claims_envelope import ClaimsEnvelope
+from armasec.decision_cache import DecisionCache
+from armasec.policy import Policy
+from armasec.revocation import MemoryRevocationSource, RevocationList
+from armasec.schemas import DomainConfig
+from armasec.token_payload import TokenPayload
 
 
 @pytest.fixture
@@ -156,6 +167,41 @@ async def test_injector_requires_some_scopes(client, build_secure_endpoint, buil
     assert "Not authorized" in response.text
 
 
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_applies_scope_expression_and_match_keys(
+    client, build_secure_endpoint, build_rs256_token
+):
+    """
+    This test verifies that a route secured with a scope expression and match_keys grants access
+    only to tokens that satisfy both.
+    """
+    exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC")
+
+    def _headers(permissions, org="acme"):
+        token = build_rs256_token(
+            claim_overrides=dict(sub="me", permissions=permissions, org=org, exp=exp.timestamp()),
+        )
+        return {"Authorization": f"bearer {token}"}
+
+    build_secure_endpoint(
+        "/requires_expression",
+        requires='"admin" or ("read:x" and "tenant:y")',
+        match_keys=dict(org="acme"),
+    )
+
+    response = await client.get("/requires_expression", headers=_headers(["admin"]))
+    assert response.status_code == starlette.status.HTTP_200_OK
+
+    response = await client.get("/requires_expression", headers=_headers(["read:x", "tenant:y"]))
+    assert response.status_code == starlette.status.HTTP_200_OK
+
+    response = await client.get("/requires_expression", headers=_headers(["read:x"]))
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+
+    response = await client.get("/requires_expression", headers=_headers(["admin"], org="other"))
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+
+
 @frozen_time("2021-09-27 22:22:00")
 async def test_injector_raises_error_on_unknown_permission_mode(
     client, build_secure_endpoint, build_rs256_token
@@ -247,3 +293,421 @@ async def test_injector_skip_plugins_flag(client, build_rs256_token, build_secur
         assert response.status_code == starlette.status.HTTP_200_OK
     finally:
         plugin_manager.unregister(DummyImplementation)
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_validates_with_async_plugins_and_timeout(
+    client, build_rs256_token, build_secure_endpoint
+):
+    """
+    This test verifies that a request is also validated against async plugin implementations and
+    that a plugin that exceeds the timeout of the PluginRunner denies the request.
+    """
+
+    class DummyError(ArmasecError):
+        status_code = starlette.status.HTTP_418_IM_A_TEAPOT
+        detail = "Ka-Boom!"
+
+    class DummyImplementation:
+        @staticmethod
+        @hookimpl
+        async def armasec_plugin_check_async(token_payload):
+            await asyncio.sleep(delay)
+            DummyError.require_condition(allow, "Request is not allowed by dummy plugin.")
+
+    build_secure_endpoint("/plugin_timeout", plugin_runner=PluginRunner(timeout=0.05))
+
+    plugin_manager.register(DummyImplementation)
+    try:
+        exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC")
+        token = build_rs256_token(
+            claim_overrides=dict(sub="me", permissions=["read:all"], exp=exp.timestamp()),
+        )
+        headers = {"Authorization": f"bearer {token}"}
+
+        (allow, delay) = (True, 0)
+        response = await client.get("/plugin_timeout", headers=headers)
+        assert response.status_code == starlette.status.HTTP_200_OK
+
+        (allow, delay) = (False, 0)
+        response = await client.get("/plugin_timeout", headers=headers)
+        assert response.status_code == starlette.status.HTTP_418_IM_A_TEAPOT
+
+        (allow, delay) = (True, 1.0)
+        response = await client.get("/plugin_timeout", headers=headers)
+        assert response.status_code == starlette.status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["detail"] == "Authorization checks timed out"
+    finally:
+        plugin_manager.unregister(DummyImplementation)
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_caches_decisions_for_opted_in_plugins(
+    client, build_rs256_token, build_secure_endpoint, mocker
+):
+    """
+    This test verifies that a decision cache shares the decisions made for a token across routes
+    with the same policy, and that it only includes the plugins that opt in to it.
+    """
+    calls = []
+
+    class CacheablePlugin:
+        armasec_decision_cacheable = True
+
+        @hookimpl
+        def armasec_plugin_check(self, token_payload):
+            calls.append("cacheable")
+
+    class UncachedPlugin:
+        @hookimpl
+        def armasec_plugin_check(self, token_payload):
+            calls.append("uncached")
+
+    decision_cache = DecisionCache()
+    build_secure_endpoint("/cached_a", scopes=["read:x"], decision_cache=decision_cache)
+    build_secure_endpoint("/cached_b", scopes=["read:x"], decision_cache=decision_cache)
+    check_spy = mocker.spy(Policy, "check")
+
+    plugin_manager.register(CacheablePlugin())
+    plugin_manager.register(UncachedPlugin())
+    try:
+        exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC")
+        token = build_rs256_token(
+            claim_overrides=dict(sub="me", permissions=["read:x"], exp=exp.timestamp()),
+        )
+        headers = {"Authorization": f"bearer {token}"}
+        for path in ("/cached_a", "/cached_b", "/cached_a"):
+            response = await client.get(path, headers=headers)
+            assert response.status_code == starlette.status.HTTP_200_OK
+        assert check_spy.call_count == 1
+        assert calls.count("cacheable") == 1
+        assert calls.count("uncached") == 3
+
+        token = build_rs256_token(
+            claim_overrides=dict(sub="me", permissions=["read:y"], exp=exp.timestamp()),
+        )
+        headers = {"Authorization": f"bearer {token}"}
+        for path in ("/cached_a", "/cached_b"):
+            response = await client.get(path, headers=headers)
+            assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+        assert check_spy.call_count == 2
+        assert decision_cache.metrics()["entries"] == 2
+    finally:
+        for plugin in plugin_manager.get_plugins():
+            if isinstance(plugin, (CacheablePlugin, UncachedPlugin)):
+                plugin_manager.unregister(plugin)
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_rejects_revoked_tokens(client, build_rs256_token, build_secure_endpoint):
+    """
+    This test verifies that a revocation list rejects tokens whose `jti` or `sub` were revoked,
+    even when an earlier decision for the token was cached.
+    """
+    source = MemoryRevocationSource()
+    revocation_list = RevocationList(source, sync_interval=None)
+    build_secure_endpoint(
+        "/revocable",
+        scopes=["read:x"],
+        decision_cache=DecisionCache(),
+        revocation_list=revocation_list,
+    )
+
+    exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC")
+    token = build_rs256_token(
+        claim_overrides=dict(sub="me", jti="token-1", permissions=["read:x"], exp=exp.timestamp()),
+    )
+    headers = {"Authorization": f"bearer {token}"}
+    response = await client.get("/revocable", headers=headers)
+    assert response.status_code == starlette.status.HTTP_200_OK
+
+    source.revoke("token-1")
+    revocation_list.sync()
+    response = await client.get("/revocable", headers=headers)
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+
+    token = build_rs256_token(
+        claim_overrides=dict(sub="me", jti="token-2", permissions=["read:x"], exp=exp.timestamp()),
+    )
+    headers = {"Authorization": f"bearer {token}"}
+    response = await client.get("/revocable", headers=headers)
+    assert response.status_code == starlette.status.HTTP_200_OK
+
+    source.revoke("me")
+    revocation_list.sync()
+    response = await client.get("/revocable", headers=headers)
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+
+
+async def test_injector_introspects_opaque_tokens(
+    app, client, rs256_domain, mock_introspection_server
+):
+    """
+    This test verifies that a domain with introspection enabled accepts active opaque tokens and
+    checks their scopes, and that introspection responses are cached across requests.
+    """
+    domain_config = DomainConfig(
+        domain=rs256_domain,
+        introspection=True,
+        introspection_endpoint=mock_introspection_server.endpoint,
+    )
+
+    @app.get(
+        "/opaque",
+        dependencies=[fastapi.Depends(TokenSecurity([domain_config], scopes=["read:x"]))],
+    )
+    async def _():
+        return dict(good="to go")
+
+    token = mock_introspection_server.issue(sub="me", scope="read:x", exp=time.time() + 60)
+    for _ in range(2):
+        response = await client.get("/opaque", headers={"Authorization": f"bearer {token}"})
+        assert response.status_code == starlette.status.HTTP_200_OK
+    assert mock_introspection_server.route.call_count == 1
+
+    token = mock_introspection_server.issue(sub="me", scope="read:y", exp=time.time() + 60)
+    response = await client.get("/opaque", headers={"Authorization": f"bearer {token}"})
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+
+    response = await client.get("/opaque", headers={"Authorization": "bearer unknown"})
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_verifies_token_once_per_request(
+    app, client, rs256_domain_config, build_rs256_token, mocker
+):
+    """
+    This test verifies that a token is only decoded once per request when several TokenSecurity
+    dependencies for the same domains are applied to a route, while each dependency still checks
+    its own scopes.
+    """
+    domain_configs = [rs256_domain_config]
+
+    @app.get(
+        "/layered",
+        dependencies=[
+            fastapi.Depends(TokenSecurity(domain_configs)),
+            fastapi.Depends(TokenSecurity(domain_configs, scopes=["write:x"])),
+        ],
+    )
+    async def _():
+        return dict(good="to go")
+
+    decode_spy = mocker.spy(TokenDecoder, "decode")
+    exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC")
+
+    token = build_rs256_token(
+        claim_overrides=dict(sub="me", permissions=["write:x"], exp=exp.timestamp()),
+    )
+    response = await client.get("/layered", headers={"Authorization": f"bearer {token}"})
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert decode_spy.call_count == 1
+
+    token = build_rs256_token(
+        claim_overrides=dict(sub="me", permissions=["read:x"], exp=exp.timestamp()),
+    )
+    response = await client.get("/layered", headers={"Authorization": f"bearer {token}"})
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+    assert decode_spy.call_count == 2
+
+
+def test_injector_verifies_websocket_once_and_closes_at_expiry(
+    app, rs256_domain_config, mock_openid_server, build_rs256_token, mocker
+):
+    """
+    This test verifies that a websocket is verified once when it connects, that in-band refresh
+    messages are handled without verifying every message, and that the connection is closed when
+    its token expires.
+    """
+
+    @app.websocket("/stream")
+    async def _(
+        websocket: fastapi.WebSocket,
+        token_payload=fastapi.Depends(TokenSecurity([rs256_domain_config], scopes=["read:x"])),
+    ):
+        await websocket.accept()
+        session = websocket.state.token_session
+        try:
+            while True:
+                message = await websocket.receive_json()
+                if await session.handle_message(message):
+                    await websocket.send_json(dict(refreshed=session.token_payload.sub))
+                else:
+                    await websocket.send_json(dict(echo=message, sub=token_payload.sub))
+        except WebSocketDisconnect:
+            pass
+
+    decode_spy = mocker.spy(TokenDecoder, "decode")
+    token = build_rs256_token(claim_overrides=dict(sub="me", permissions=["read:x"]))
+
+    with TestClient(app) as client:
+        with client.websocket_connect(
+            "/stream", headers={"Authorization": f"bearer {token}"}
+        ) as websocket:
+            for text in ("one", "two", "three"):
+                websocket.send_json(text)
+                assert websocket.receive_json() == dict(echo=text, sub="me")
+            refreshed = build_rs256_token(claim_overrides=dict(sub="me", permissions=["read:x"]))
+            websocket.send_json(dict(type="token_refresh", token=refreshed))
+            assert websocket.receive_json() == dict(refreshed="me")
+        assert decode_spy.call_count == 2
+
+        with pytest.raises(WebSocketDisconnect) as err_info:
+            with client.websocket_connect("/stream"):
+                pass
+        assert err_info.value.code == starlette.status.WS_1008_POLICY_VIOLATION
+
+        unscoped = build_rs256_token(claim_overrides=dict(sub="me", permissions=["write:x"]))
+        with pytest.raises(WebSocketDisconnect) as err_info:
+            with client.websocket_connect(
+                "/stream", headers={"Authorization": f"bearer {unscoped}"}
+            ):
+                pass
+        assert err_info.value.code == starlette.status.WS_1008_POLICY_VIOLATION
+
+        expiring = build_rs256_token(
+            claim_overrides=dict(sub="me", permissions=["read:x"], exp=int(time.time()) + 1),
+        )
+        with client.websocket_connect(
+            "/stream", headers={"Authorization": f"bearer {expiring}"}
+        ) as websocket:
+            with pytest.raises(WebSocketDisconnect) as err_info:
+                websocket.receive_json()
+        assert err_info.value.code == starlette.status.WS_1008_POLICY_VIOLATION
+        assert err_info.value.reason == "Token expired"
+
+
+def test_injector_cancels_websocket_token_session_on_disconnect(
+    app, rs256_domain_config, mock_openid_server, build_rs256_token
+):
+    """
+    This test verifies that the token session of a websocket is cancelled when the client
+    disconnects, so that no timer handle is left to keep the session alive until the token expires.
+    """
+    sessions = []
+
+    @app.websocket("/stream")
+    async def _(
+        websocket: fastapi.WebSocket,
+        token_payload=fastapi.Depends(TokenSecurity([rs256_domain_config], scopes=["read:x"])),
+    ):
+        await websocket.accept()
+        sessions.append(websocket.state.token_session)
+        assert sessions[-1]._handle is not None
+        try:
+            while True:
+                await websocket.receive_json()
+        except WebSocketDisconnect:
+            pass
+
+    token = build_rs256_token(claim_overrides=dict(sub="me", permissions=["read:x"]))
+
+    with TestClient(app) as client:
+        with client.websocket_connect(
+            "/stream", headers={"Authorization": f"bearer {token}"}
+        ) as websocket:
+            websocket.send_json("one")
+
+    (session,) = sessions
+    assert session.closed
+    assert session._handle is None
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_accepts_claims_envelope_without_verifying_token(
+    app, client, rs256_domain_config, rs256_iss, build_rs256_token, mocker
+):
+    """
+    This test verifies that a valid claims envelope is accepted without decoding the token, and
+    that an invalid or unbound envelope, or one issued for another domain, falls back to full
+    verification of the token.
+    """
+    envelope = ClaimsEnvelope(b"internal-secret")
+    decision_cache = DecisionCache()
+
+    @app.get(
+        "/internal",
+        dependencies=[
+            fastapi.Depends(
+                TokenSecurity(
+                    [rs256_domain_config],
+                    scopes=["read:x"],
+                    claims_envelope=envelope,
+                    decision_cache=decision_cache,
+                )
+            )
+        ],
+    )
+    async def _():
+        return dict(good="to go")
+
+    decode_spy = mocker.spy(TokenDecoder, "decode")
+    exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC")
+    claims = dict(sub="me", jti="abc", exp=exp.timestamp(), iss=rs256_iss)
+    token_payload = TokenPayload(permissions=["read:x"], **claims)
+    token = build_rs256_token(claim_overrides=dict(permissions=["read:x"], **claims))
+    authorization = {"Authorization": f"bearer {token}"}
+
+    response = await client.get(
+        "/internal", headers={**envelope.headers(token_payload), **authorization}
+    )
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert decode_spy.call_count == 0
+    assert decision_cache.stats["sets"] == 1
+
+    response = await client.get("/internal", headers=envelope.headers(token_payload))
+    assert response.status_code == starlette.status.HTTP_401_UNAUTHORIZED
+
+    forged = ClaimsEnvelope(b"wrong-secret").headers(token_payload)
+    response = await client.get("/internal", headers={**forged, **authorization})
+    assert response.status_code == starlette.status.HTTP_200_OK
+    assert decode_spy.call_count == 1
+
+    for foreign in (
+        TokenPayload(permissions=["read:x"], **{**claims, "iss": "https://other.domain"}),
+        TokenPayload(permissions=["read:x"], aud="https://other.api", **claims),
+    ):
+        response = await client.get(
+            "/internal", headers={**envelope.headers(foreign), **authorization}
+        )
+        assert response.status_code == starlette.status.HTTP_200_OK
+    assert decode_spy.call_count == 3
+
+    unscoped = TokenPayload(permissions=["write:x"], **claims)
+    response = await client.get(
+        "/internal", headers={**envelope.headers(unscoped), **authorization}
+    )
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
+    assert decode_spy.call_count == 3
+
+
+@frozen_time("2021-09-16 20:56:00")
+async def test_injector_checks_match_keys_of_claims_envelope(
+    app, client, rs256_domain, rs256_iss, build_rs256_token
+):
+    """
+    This test verifies that the claims of an envelope must contain the domain's match_keys.
+    """
+    envelope = ClaimsEnvelope(b"internal-secret", include_claims=["org"])
+    domain_config = DomainConfig(domain=rs256_domain, match_keys=dict(org="acme"))
+
+    @app.get(
+        "/internal",
+        dependencies=[fastapi.Depends(TokenSecurity([domain_config], claims_envelope=envelope))],
+    )
+    async def _():
+        return dict(good="to go")
+
+    exp = pendulum.parse("2021-09-17 20:56:00", tz="UTC").timestamp()
+    token = build_rs256_token(claim_overrides=dict(sub="me", jti="abc", exp=exp))
+    authorization = {"Authorization": f"bearer {token}"}
+    claims = dict(sub="me", jti="abc", exp=exp, iss=rs256_iss)
+
+    headers = envelope.headers(TokenPayload(org="acme", **claims))
+    response = await client.get("/internal", headers={**headers, **authorization})
+    assert response.status_code == starlette.status.HTTP_200_OK
+
+    headers = envelope.headers(TokenPayload(org="other", **claims))
+    response = await client.get("/internal", headers={**headers, **authorization})
+    assert response.status_code == starlette.status.HTTP_403_FORBIDDEN
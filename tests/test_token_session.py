@@ -0,0 +1,119 @@
+"""
+Verify that the TokenSession schedules and handles token expiry for long-lived connections.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from armasec.exceptions import AuthenticationError, AuthorizationError
+from armasec.token_payload import TokenPayload
+from armasec.token_session import TokenSession
+
+
+def build_payload(sub: str = "me", expires_in: float = 60.0) -> TokenPayload:
+    return TokenPayload(sub=sub, exp=time.time() + expires_in)
+
+
+@pytest.fixture
+def verifier(mocker):
+    return mocker.MagicMock()
+
+
+async def test_token_session__calls_on_expire_at_token_expiry(verifier, mocker):
+    on_expire = mocker.AsyncMock()
+    session = TokenSession(verifier, build_payload(expires_in=0.05), on_expire=on_expire)
+
+    assert not session.expired
+    await asyncio.sleep(0.1)
+
+    assert session.expired
+    assert session.closed
+    on_expire.assert_awaited_once_with(session)
+    verifier.verify.assert_not_called()
+
+
+async def test_token_session__refresh_reschedules_expiry(verifier, mocker):
+    on_expire = mocker.AsyncMock()
+    session = TokenSession(verifier, build_payload(expires_in=0.05), on_expire=on_expire)
+    refreshed = build_payload(expires_in=60)
+    verifier.verify.return_value = refreshed
+
+    assert await session.handle_message(dict(type="token_refresh", token="new-token"))
+    await asyncio.sleep(0.1)
+
+    verifier.verify.assert_called_once_with("Bearer new-token")
+    assert session.token_payload is refreshed
+    assert not session.expired
+    on_expire.assert_not_called()
+    session.cancel()
+
+
+async def test_token_session__refresh_rejects_other_subject(verifier, mocker):
+    authorize = mocker.AsyncMock()
+    session = TokenSession(verifier, build_payload(), authorize=authorize)
+    verifier.verify.return_value = build_payload(sub="someone-else")
+
+    with pytest.raises(AuthorizationError, match="different|subject"):
+        await session.refresh("new-token")
+
+    assert session.token_payload.sub == "me"
+    authorize.assert_not_called()
+    session.cancel()
+
+
+async def test_token_session__refresh_applies_authorize_check(verifier):
+    async def authorize(token_payload):
+        AuthorizationError.require_condition("a" in token_payload.permissions, "Missing a")
+
+    session = TokenSession(verifier, build_payload(), authorize=authorize)
+    verifier.verify.return_value = TokenPayload(sub="me", permissions=["b"], exp=time.time() + 60)
+
+    with pytest.raises(AuthorizationError, match="Missing a"):
+        await session.refresh("new-token")
+    session.cancel()
+
+
+async def test_token_session__waits_for_refresh_during_reauth_grace(verifier, mocker):
+    on_expire = mocker.AsyncMock()
+    session = TokenSession(
+        verifier, build_payload(expires_in=0.02), on_expire=on_expire, reauth_grace=0.1
+    )
+
+    await asyncio.sleep(0.05)
+    assert session.expired
+    assert not session.closed
+    on_expire.assert_not_called()
+
+    verifier.verify.return_value = build_payload(expires_in=60)
+    await session.refresh("new-token")
+    await asyncio.sleep(0.15)
+    assert not session.expired
+    on_expire.assert_not_called()
+    session.cancel()
+
+    with pytest.raises(AuthenticationError, match="closed"):
+        await session.refresh("newer-token")
+
+
+async def test_token_session__ignores_other_messages(verifier):
+    session = TokenSession(verifier, build_payload())
+
+    assert not await session.handle_message(dict(type="chat", text="hi"))
+    assert not await session.handle_message("token_refresh")
+    verifier.verify.assert_not_called()
+    session.cancel()
+
+
+async def test_token_session__idle_sessions_only_hold_timers(verifier):
+    loop = asyncio.get_running_loop()
+    tasks_before = len(asyncio.all_tasks())
+    token_payload = build_payload()
+
+    sessions = [TokenSession(verifier, token_payload) for _ in range(50_000)]
+
+    assert len(asyncio.all_tasks()) == tasks_before
+    assert sum(1 for handle in loop._scheduled if not handle.cancelled()) >= 50_000  # type: ignore
+    for session in sessions:
+        session.cancel()
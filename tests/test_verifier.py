@@ -0,0 +1,60 @@
+"""
+Verify that the Verifier authenticates raw Authorization header values.
+"""
+
+import sys
+import subprocess
+
+import pytest
+from plummet import frozen_time
+
+from armasec.exceptions import AuthenticationError, AuthorizationError
+from armasec.schemas import DomainConfig
+from armasec.verifier import Verifier
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_verify__returns_payload_for_valid_token(
+    rs256_domain_config, mock_openid_server, build_rs256_token
+):
+    verifier = Verifier([rs256_domain_config])
+    token = build_rs256_token(claim_overrides=dict(sub="me", permissions=["a"]))
+
+    token_payload = verifier.verify(f"Bearer {token}")
+
+    assert token_payload.sub == "me"
+    assert token_payload.permissions == ["a"]
+    assert len(verifier.managers) == 1
+
+
+@frozen_time("2021-09-16 20:56:00")
+@pytest.mark.parametrize("authorization", [None, "", "Bearer", "Bearer not-a-token", "Basic abc"])
+def test_verify__raises_authentication_error_for_bad_header(
+    authorization, rs256_domain_config, mock_openid_server
+):
+    verifier = Verifier([rs256_domain_config])
+
+    with pytest.raises(AuthenticationError):
+        verifier.verify(authorization)
+
+
+@frozen_time("2021-09-16 20:56:00")
+def test_verify__checks_match_keys(rs256_domain, mock_openid_server, build_rs256_token):
+    domain_config = DomainConfig(domain=rs256_domain, match_keys=dict(client_id="good-client"))
+    verifier = Verifier([domain_config])
+
+    good_token = build_rs256_token(claim_overrides=dict(azp="good-client"))
+    assert verifier.verify(f"Bearer {good_token}").client_id == "good-client"
+
+    bad_token = build_rs256_token(claim_overrides=dict(azp="bad-client"))
+    with pytest.raises(AuthorizationError):
+        verifier.verify(f"Bearer {bad_token}")
+
+
+def test_verifier__does_not_import_web_frameworks():
+    code = "import sys, armasec.verifier, armasec.middleware; print(sorted(sys.modules))"
+    modules = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert "fastapi" not in modules
+    assert "starlette" not in modules